@@ -1,29 +1,71 @@
-import requests
+import bisect
+import os
+from datetime import datetime, timezone
 
+import httpx
 
-def get_air_quality(lat: float, lon: float) -> dict | None:
+from api_scripts.http_client import get_json
+
+AIR_QUALITY_URL = os.environ.get("OPEN_METEO_AIR_QUALITY_URL", "https://air-quality-api.open-meteo.com/v1/air-quality")
+AIR_QUALITY_PARAMS = "pm2_5,pm10,nitrogen_dioxide,sulphur_dioxide"
+
+
+def current_air_quality(series: dict, now: datetime | None = None) -> dict:
+    """
+    Values for the current UTC hour from a ``get_air_quality_forecast`` series
+    (the last hour if the series ends earlier).
+    """
+    current_hour = (now or datetime.now(timezone.utc)).strftime("%Y-%m-%dT%H:00")
+    index = min(bisect.bisect_left(series["time"], current_hour), len(series["time"]) - 1)
+
+    return {
+        "pm25": series["pm25"][index],
+        "pm10": series["pm10"][index],
+        "no2": series["no2"][index],
+        "so2": series["so2"][index],
+    }
+
+
+def _format_air_quality(data: dict) -> dict:
+    return current_air_quality(_format_air_quality_series(data))
 
-    params = "pm2_5,pm10,nitrogen_dioxide,sulphur_dioxide"
-    url = f"https://air-quality-api.open-meteo.com/v1/air-quality?latitude={lat}&longitude={lon}&hourly={params}"
 
+def _format_air_quality_series(data: dict) -> dict:
+    hourly_data = data['hourly']
+
+    return {
+        "time": hourly_data['time'],
+        "pm25": hourly_data['pm2_5'],
+        "pm10": hourly_data['pm10'],
+        "no2": hourly_data['nitrogen_dioxide'],
+        "so2": hourly_data['sulphur_dioxide'],
+    }
+
+
+def get_air_quality(lat: float, lon: float) -> dict | None:
+    series = get_air_quality_forecast(lat, lon)
+    if series is None:
+        return None
     try:
-        response = requests.get(url)
-        response.raise_for_status()
+        return current_air_quality(series)
+    except IndexError as e:
+        print(f"Błąd przetwarzania danych - pusta seria godzinowa: {e}")
+        return None
 
-        data = response.json()
 
-        hourly_data = data['hourly']
+def get_air_quality_forecast(lat: float, lon: float) -> dict | None:
+    """
+    Full hourly series (UTC, from midnight of the current day) as columnar lists:
+    ``{"time": [...], "pm25": [...], "pm10": [...], "no2": [...], "so2": [...]}``.
+    """
 
-        formatted_data = {
-            "pm25": hourly_data['pm2_5'][0],
-            "pm10": hourly_data['pm10'][0],
-            "no2": hourly_data['nitrogen_dioxide'][0],
-            "so2": hourly_data['sulphur_dioxide'][0],
-        }
+    params = {"latitude": lat, "longitude": lon, "hourly": AIR_QUALITY_PARAMS}
 
-        return formatted_data
+    try:
+        data = get_json(AIR_QUALITY_URL, params=params)
+        return _format_air_quality_series(data)
 
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, ValueError) as e:
         print(f"Błąd zapytania do API: {e}")
         return None
     except (KeyError, IndexError) as e:
@@ -31,6 +73,54 @@ def get_air_quality(lat: float, lon: float) -> dict | None:
         return None
 
 
+def get_air_quality_forecast_batch(coordinates: list[tuple[float, float]]) -> list[dict | None]:
+    """
+    Fetch hourly series (as ``get_air_quality_forecast``) for many locations in one upstream request.
+
+    Uses Open-Meteo's multi-location query (comma-separated latitude/longitude
+    lists). Returns one entry per input coordinate, ``None`` where the location
+    could not be parsed; the whole list is ``None`` entries if the request fails.
+    """
+    if not coordinates:
+        return []
+
+    params = {
+        "latitude": ",".join(str(lat) for lat, _ in coordinates),
+        "longitude": ",".join(str(lon) for _, lon in coordinates),
+        "hourly": AIR_QUALITY_PARAMS,
+    }
+
+    try:
+        data = get_json(AIR_QUALITY_URL, params=params)
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Błąd zapytania do API: {e}")
+        return [None] * len(coordinates)
+
+    # Dla jednej lokalizacji Open-Meteo zwraca obiekt, dla wielu - listę
+    locations = data if isinstance(data, list) else [data]
+
+    results = []
+    for index in range(len(coordinates)):
+        try:
+            results.append(_format_air_quality_series(locations[index]))
+        except (KeyError, IndexError, TypeError) as e:
+            print(f"Błąd przetwarzania danych - nieoczekiwana struktura odpowiedzi: {e}")
+            results.append(None)
+    return results
+
+
+def get_air_quality_batch(coordinates: list[tuple[float, float]]) -> list[dict | None]:
+    """Current pollutant levels for many locations in one upstream request."""
+    results = []
+    for series in get_air_quality_forecast_batch(coordinates):
+        try:
+            results.append(current_air_quality(series) if series is not None else None)
+        except IndexError as e:
+            print(f"Błąd przetwarzania danych - pusta seria godzinowa: {e}")
+            results.append(None)
+    return results
+
+
 if __name__ == "__main__":
     warsaw_lat = 53.63506668442288
     warsaw_lon = 15.61684454482645
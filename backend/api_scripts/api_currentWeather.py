@@ -1,4 +1,8 @@
-import requests
+import os
+
+import httpx
+
+from api_scripts.http_client import get_json
 
 WMO_WEATHER_CODES = {
     0: "Czyste niebo",
@@ -32,31 +36,33 @@ WMO_WEATHER_CODES = {
 }
 
 
-def get_current_weather(lat: float, lon: float) -> dict | None:
+FORECAST_URL = os.environ.get("OPEN_METEO_FORECAST_URL", "https://api.open-meteo.com/v1/forecast")
+CURRENT_WEATHER_PARAMS = "temperature_2m,relative_humidity_2m,wind_speed_10m,weather_code"
 
-    params = "temperature_2m,relative_humidity_2m,wind_speed_10m,weather_code"
-    url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current={params}"
 
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
+def _format_current_weather(data: dict) -> dict:
+    current_data = data['current']
 
-        data = response.json()
-        current_data = data['current']
+    weather_code = current_data.get('weather_code')
+    condition = WMO_WEATHER_CODES.get(weather_code, "Nieznane warunki")
 
-        weather_code = current_data.get('weather_code')
-        condition = WMO_WEATHER_CODES.get(weather_code, "Nieznane warunki")
+    return {
+        "temperature": current_data.get('temperature_2m'),
+        "humidity": current_data.get('relative_humidity_2m'),
+        "wind_speed": current_data.get('wind_speed_10m'),
+        "condition": condition,
+    }
 
-        formatted_data = {
-            "temperature": current_data.get('temperature_2m'),
-            "humidity": current_data.get('relative_humidity_2m'),
-            "wind_speed": current_data.get('wind_speed_10m'),
-            "condition": condition,
-        }
 
-        return formatted_data
+def get_current_weather(lat: float, lon: float) -> dict | None:
+
+    params = {"latitude": lat, "longitude": lon, "current": CURRENT_WEATHER_PARAMS}
+
+    try:
+        data = get_json(FORECAST_URL, params=params)
+        return _format_current_weather(data)
 
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, ValueError) as e:
         print(f"Błąd zapytania do API: {e}")
         return None
     except (KeyError, IndexError) as e:
@@ -64,6 +70,40 @@ def get_current_weather(lat: float, lon: float) -> dict | None:
         return None
 
 
+def get_current_weather_batch(coordinates: list[tuple[float, float]]) -> list[dict | None]:
+    """
+    Fetch current weather for many locations in one upstream request
+    (Open-Meteo multi-location query). Returns one entry per input coordinate,
+    ``None`` where it could not be fetched or parsed.
+    """
+    if not coordinates:
+        return []
+
+    params = {
+        "latitude": ",".join(str(lat) for lat, _ in coordinates),
+        "longitude": ",".join(str(lon) for _, lon in coordinates),
+        "current": CURRENT_WEATHER_PARAMS,
+    }
+
+    try:
+        data = get_json(FORECAST_URL, params=params)
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Błąd zapytania do API: {e}")
+        return [None] * len(coordinates)
+
+    # Dla jednej lokalizacji Open-Meteo zwraca obiekt, dla wielu - listę
+    locations = data if isinstance(data, list) else [data]
+
+    results = []
+    for index in range(len(coordinates)):
+        try:
+            results.append(_format_current_weather(locations[index]))
+        except (KeyError, IndexError, TypeError) as e:
+            print(f"Błąd przetwarzania danych - nieoczekiwana struktura odpowiedzi: {e}")
+            results.append(None)
+    return results
+
+
 if __name__ == "__main__":
     warsaw_lat = 53.63506668442288
     warsaw_lon = 15.61684454482645
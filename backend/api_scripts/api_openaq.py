@@ -0,0 +1,84 @@
+import os
+import time
+from datetime import datetime
+
+import httpx
+import numpy as np
+
+from api_scripts.http_client import get_json
+
+DEFAULT_BASE_URL = "https://api.openaq.org/v3"
+OPENAQ_BASE_URL = os.environ.get("OPENAQ_BASE_URL", DEFAULT_BASE_URL).rstrip("/")
+# Bez klucza API działa tylko inny serwer niż domyślny (np. stand-in)
+OPENAQ_API_KEY = os.environ.get("OPENAQ_API_KEY", "")
+OPENAQ_ENABLED = bool(OPENAQ_API_KEY) or OPENAQ_BASE_URL != DEFAULT_BASE_URL
+
+# Odczyty starsze niż tyle godzin pomijamy - stacja mogła przestać działać
+OPENAQ_MAX_AGE_HOURS = float(os.environ.get("OPENAQ_MAX_AGE_HOURS", "3"))
+OPENAQ_PAGE_LIMIT = 1000
+OPENAQ_MAX_PAGES = int(os.environ.get("OPENAQ_MAX_PAGES", "50"))
+
+# Identyfikatory parametrów OpenAQ v3 w µg/m³ - te same jednostki co Open-Meteo
+OPENAQ_PARAMETERS = {
+    "pm25": 2,
+    "pm10": 1,
+    "no2": 5,
+    "so2": 6,
+}
+
+
+def _parse_utc(value: str) -> float:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def get_latest_readings(parameters: dict[str, int] = OPENAQ_PARAMETERS,
+                        max_age_hours: float = OPENAQ_MAX_AGE_HOURS) -> dict[str, np.ndarray] | None:
+    """
+    Latest reading of every OpenAQ sensor for each pollutant, as arrays keyed
+    ``"<pollutant>_lat"``, ``"<pollutant>_lon"``, ``"<pollutant>_value"`` and
+    ``"<pollutant>_time"`` (epoch seconds). Readings older than ``max_age_hours``
+    and negative values are dropped. Returns None if the download failed.
+    """
+    oldest = time.time() - max_age_hours * 3600
+    headers = {"X-API-Key": OPENAQ_API_KEY} if OPENAQ_API_KEY else None
+    arrays = {}
+    try:
+        for pollutant, parameter_id in parameters.items():
+            lats, lons, values, times = [], [], [], []
+            for page in range(1, OPENAQ_MAX_PAGES + 1):
+                # SDK openaq nie obsługuje stronicowania tego endpointu - pobieramy go wspólnym klientem HTTP
+                data = get_json(f"{OPENAQ_BASE_URL}/parameters/{parameter_id}/latest",
+                                params={"limit": OPENAQ_PAGE_LIMIT, "page": page}, headers=headers)
+                results = data["results"]
+                for latest in results:
+                    coordinates, value = latest.get("coordinates"), latest.get("value")
+                    if not coordinates or not latest.get("datetime") or value is None or value < 0:
+                        continue
+                    observed = _parse_utc(latest["datetime"]["utc"])
+                    if observed < oldest:
+                        continue
+                    lats.append(coordinates["latitude"])
+                    lons.append(coordinates["longitude"])
+                    values.append(value)
+                    times.append(observed)
+                if len(results) < OPENAQ_PAGE_LIMIT:
+                    break
+            arrays[f"{pollutant}_lat"] = np.asarray(lats, dtype=np.float64)
+            arrays[f"{pollutant}_lon"] = np.asarray(lons, dtype=np.float64)
+            arrays[f"{pollutant}_value"] = np.asarray(values, dtype=np.float64)
+            arrays[f"{pollutant}_time"] = np.asarray(times, dtype=np.float64)
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Błąd pobierania odczytów stacji OpenAQ: {e}")
+        return None
+    except (KeyError, TypeError) as e:
+        print(f"Błąd przetwarzania odczytów stacji OpenAQ - nieoczekiwana struktura odpowiedzi: {e}")
+        return None
+    return arrays
+
+
+if __name__ == "__main__":
+    readings = get_latest_readings()
+    if readings is not None:
+        for name, values in readings.items():
+            if name.endswith("_value"):
+                print(name, len(values))
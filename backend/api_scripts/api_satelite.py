@@ -1,53 +1,50 @@
-from oauthlib.oauth2 import BackendApplicationClient
-from requests_oauthlib import OAuth2Session
 import math
-import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 
-client_id = 'sh-665b9f90-1b62-463e-81dd-f153e09f6d0b'
-client_secret = 'aTIJjIS37jKXNIXiYCQ3jVwacQu488Y1'
+import httpx
+import numpy as np
 
-client = BackendApplicationClient(client_id=client_id)
-oauth = OAuth2Session(client=client)
+from api_scripts.grid_cache import GridCache, snap_to_grid
+from api_scripts.http_client import post_bytes, post_json
+from api_scripts.observation_store import open_default_store
 
-token = oauth.fetch_token(token_url='https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token',
-                          client_secret=client_secret, include_client_id=True)
-resp = oauth.get("https://sh.dataspace.copernicus.eu/configuration/v1/wms/instances")
+TOKEN_URL = os.environ.get(
+    "SH_TOKEN_URL", "https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token")
+STATISTICS_URL = os.environ.get("SH_STATISTICS_URL", "https://sh.dataspace.copernicus.eu/api/v1/statistics")
+PROCESS_URL = os.environ.get("SH_PROCESS_URL", "https://sh.dataspace.copernicus.eu/api/v1/process")
 
+# Dane logowania do Copernicus Data Space - tylko ze zmiennych środowiskowych
+SH_CLIENT_ID = os.environ.get("SH_CLIENT_ID", "")
+SH_CLIENT_SECRET = os.environ.get("SH_CLIENT_SECRET", "")
 
+# Równoległe zapytania i limit jednostek przetwarzania (PU) na minutę
+SH_MAX_CONCURRENCY = int(os.environ.get("SH_MAX_CONCURRENCY", "4"))
+SH_PU_PER_MINUTE = float(os.environ.get("SH_PU_PER_MINUTE", "300"))
 
+# Token odświeżamy z wyprzedzeniem, żeby nie wygasł w trakcie zapytania
+TOKEN_REFRESH_MARGIN = 60
 
-def get_no2_stats(oauth, lat, lon, size_km=70):
-    """
-    Get Sentinel-5P NO2 statistics for a square area around a point.
+PERCENTILES = (25, 50, 75, 90)
+RESOLUTION_DEG = 0.05
 
-    Args:
-        oauth: Authenticated OAuth session
-        lat (float): Latitude of the center point
-        lon (float): Longitude of the center point
-        size_km (float): Width of the square area in km (default 25 km)
+# Górna krawędź histogramu dla każdego wyjścia evalscriptu (mol/m²)
+OUTPUT_HISTOGRAM_EDGES = {
+    "no2": 0.0003,
+    "so2": 0.005,
+}
 
-    Returns:
-        dict: JSON response with NO2 statistics
-    """
-    # Approximate conversion: 1 deg latitude ≈ 111 km
-    half_size_deg_lat = size_km / 2 / 111.0
-    # Longitude degree size depends on latitude
-    half_size_deg_lon = size_km / 2 / (111.320 * math.cos(math.radians(lat)))
-    
-    bbox = [
-        lon - half_size_deg_lon,
-        lat - half_size_deg_lat,
-        lon + half_size_deg_lon,
-        lat + half_size_deg_lat
-    ]
-    
-    evalscript = """//VERSION=3
+# Jeden evalscript zwraca NO2 i SO2 jako osobne wyjścia - jedno zapytanie zamiast dwóch
+S5P_EVALSCRIPT = """//VERSION=3
 function setup() {
   return {
-    input: [{ bands: ["NO2", "dataMask"] }],
+    input: [{ bands: ["NO2", "SO2", "dataMask"] }],
     output: [
       { id: "no2", bands: 1, sampleType: "FLOAT32" },
+      { id: "so2", bands: 1, sampleType: "FLOAT32" },
       { id: "dataMask", bands: 1 }
     ]
   }
@@ -55,24 +52,55 @@ function setup() {
 function evaluatePixel(sample) {
   return {
     no2: [sample.NO2],
+    so2: [sample.SO2],
     dataMask: [sample.dataMask]
   }
 }"""
-    now = datetime.now(timezone.utc)
-
-    yesterday = now - timedelta(days=1)
-    yesterday_midnight = datetime(
-        year=yesterday.year,
-        month=  yesterday.month,
-        day=  yesterday.day,
-        hour= 23,
-        minute= 59,
-        second= 59,
-        tzinfo=timezone.utc
-    )
-    time_from = yesterday_midnight.strtime("%Y-%m-%dT%H-%M-%SZ")
-    time_to = now.strtime("%Y-%m-%dT%H-%M-%SZ")
-    stats_request = {
+
+# Raster NO2 dla warstwy heatmapy - piksele bez danych jako NaN
+NO2_RASTER_EVALSCRIPT = """//VERSION=3
+function setup() {
+  return {
+    input: [{ bands: ["NO2", "dataMask"] }],
+    output: { bands: 1, sampleType: "FLOAT32" }
+  }
+}
+function evaluatePixel(sample) {
+  return [sample.dataMask == 1 ? sample.NO2 : NaN];
+}"""
+
+
+def bbox_around(lat: float, lon: float, size_km: float) -> list[float]:
+    """
+    Square bbox [west, south, east, north] of side ``size_km`` centred on a point.
+
+    Approximate conversion: 1 deg latitude ≈ 111 km, longitude degrees shrink with cos(lat).
+    """
+    half_size_deg_lat = size_km / 2 / 111.0
+    half_size_deg_lon = size_km / 2 / (111.320 * math.cos(math.radians(lat)))
+    return [
+        lon - half_size_deg_lon,
+        lat - half_size_deg_lat,
+        lon + half_size_deg_lon,
+        lat + half_size_deg_lat,
+    ]
+
+
+def day_range(days_back: int = 1, now: datetime | None = None) -> tuple[str, str]:
+    """
+    ISO 8601 bounds of a whole UTC day, ``days_back`` days before today.
+
+    Sentinel-5P daily products for a finished day do not change, unlike today's partial one.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    day_start = datetime(now.year, now.month, now.day, tzinfo=timezone.utc) - timedelta(days=days_back)
+    day_end = day_start + timedelta(days=1)
+    return day_start.strftime("%Y-%m-%dT%H:%M:%SZ"), day_end.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def statistics_request(bbox: list[float], time_from: str, time_to: str) -> dict:
+    return {
         "input": {
             "bounds": {
                 "bbox": bbox,
@@ -81,163 +109,291 @@ function evaluatePixel(sample) {
             "data": [
                 {
                     "type": "sentinel-5p-l2",
-                    "dataFilter": {
-                        "timeRange": {
-                            "from": time_from,
-                            "to": time_to
-                        }
-                    }
+                    "dataFilter": {"timeRange": {"from": time_from, "to": time_to}}
                 }
             ]
         },
         "aggregation": {
-            "timeRange": {
-                            "from": time_from,
-                            "to": time_to
-            },
+            "timeRange": {"from": time_from, "to": time_to},
             "aggregationInterval": {"of": "P1D"},
-            "evalscript": evalscript,
-            "resx": 0.05,
-            "resy": 0.05
+            "evalscript": S5P_EVALSCRIPT,
+            "resx": RESOLUTION_DEG,
+            "resy": RESOLUTION_DEG
         },
         "calculations": {
-            "default": {
-                "histograms": {"default": {"nBins": 10, "lowEdge": 0.0, "highEdge": 0.0003}},
-                "statistics": {"default": {"percentiles": {"k": [25, 50, 75, 90]}}}
+            output: {
+                "histograms": {"default": {"nBins": 10, "lowEdge": 0.0, "highEdge": high_edge}},
+                "statistics": {"default": {"percentiles": {"k": list(PERCENTILES)}}}
             }
+            for output, high_edge in OUTPUT_HISTOGRAM_EDGES.items()
         }
     }
-    
-    url = "https://sh.dataspace.copernicus.eu/api/v1/statistics"
-    headers = {"Content-Type": "application/json", "Accept": "application/json"}
-    
-    response = oauth.request("POST", url=url, headers=headers, json=stats_request)
-    
-    if response.status_code != 200:
-        raise Exception(f"Request failed: {response.status_code} {response.text}")
-    
-    return response.json()
 
 
+def process_request(bbox: list[float], time_from: str, time_to: str, width: int, height: int,
+                    evalscript: str = NO2_RASTER_EVALSCRIPT) -> dict:
+    """Process API request for a single-band FLOAT32 GeoTIFF mosaic of one day."""
+    return {
+        "input": {
+            "bounds": {
+                "bbox": bbox,
+                "properties": {"crs": "http://www.opengis.net/def/crs/EPSG/0/4326"}
+            },
+            "data": [
+                {
+                    "type": "sentinel-5p-l2",
+                    "dataFilter": {"timeRange": {"from": time_from, "to": time_to}, "mosaickingOrder": "mostRecent"}
+                }
+            ]
+        },
+        "output": {
+            "width": width,
+            "height": height,
+            "responses": [{"identifier": "default", "format": {"type": "image/tiff"}}]
+        },
+        "evalscript": evalscript
+    }
 
-import datetime
-import json
-import math
 
-def get_so2_stats_km(oauth, center_lat, center_lon, size_km=50, start_date=None, end_date=None):
+def estimate_processing_units(bbox: list[float]) -> float:
     """
-    Query Sentinel-5P L2 SO2 statistics for a square area around a center point.
-
-    Parameters
-    ----------
-    oauth : OAuth2Session
-        Authenticated OAuth2 session.
-    center_lat : float
-        Latitude of center point.
-    center_lon : float
-        Longitude of center point.
-    size_km : float
-        Field size in km (square side length).
-    start_date : str, optional
-        ISO 8601 start date (default: 7 days ago).
-    end_date : str, optional
-        ISO 8601 end date (default: today).
-
-    Returns
-    -------
-    dict : JSON statistics from the Sentinel Hub Statistics API.
+    Rough Sentinel Hub processing-unit cost of one daily statistics request:
+    pixels / 512² scaled by input bands / 3, with the 0.01 PU minimum.
     """
-    now = datetime.now(timezone.utc)
-
-    yesterday = now - timedelta(days=1)
-    yesterday_midnight = datetime(
-        year=yesterday.year,
-        month=  yesterday.month,
-        day=  yesterday.day,
-        hour= 23,
-        minute= 59,
-        second= 59,
-        tzinfo=timezone.utc
+    width = (bbox[2] - bbox[0]) / RESOLUTION_DEG
+    height = (bbox[3] - bbox[1]) / RESOLUTION_DEG
+    input_bands = len(OUTPUT_HISTOGRAM_EDGES) + 1
+    return max(0.01, width * height / (512 * 512) * max(1.0, input_bands / 3))
+
+
+class ProcessingUnitQuota:
+    """Token bucket of processing units, refilled continuously at ``per_minute``."""
+
+    def __init__(self, per_minute: float = SH_PU_PER_MINUTE):
+        self.per_minute = per_minute
+        self._available = per_minute
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, units: float):
+        """Block until ``units`` processing units are available and take them."""
+        units = min(units, self.per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._available = min(self.per_minute, self._available + (now - self._updated_at) * self.per_minute / 60)
+                self._updated_at = now
+                if self._available >= units:
+                    self._available -= units
+                    return
+                wait = (units - self._available) * 60 / self.per_minute
+            time.sleep(wait)
+
+
+def _stat(value) -> float:
+    # API zwraca "NaN" jako tekst dla pustych przedziałów
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def is_complete_response(response: dict) -> bool:
+    """True if the response has intervals and each of them carries every output without an error."""
+    intervals = response.get("data") or []
+    return bool(intervals) and all(
+        "error" not in item and all(output in item.get("outputs", {}) for output in OUTPUT_HISTOGRAM_EDGES)
+        for item in intervals
     )
-    start_date = yesterday_midnight.strtime("%Y-%m-%dT%H-%M-%SZ")
-    end_date = now.strtime("%Y-%m-%dT%H-%M-%SZ")
-    
-    # Convert size from km to degrees
-    lat_rad = math.radians(center_lat)
-    half_lat_deg = (size_km / 2) / 111
-    half_lon_deg = (size_km / 2) / (111 * math.cos(lat_rad))
-
-    bbox = [
-        center_lon - half_lon_deg,
-        center_lat - half_lat_deg,
-        center_lon + half_lon_deg,
-        center_lat + half_lat_deg
+
+
+def stats_to_arrays(response: dict, output: str) -> dict[str, np.ndarray]:
+    """
+    Convert a Statistics API response into per-interval NumPy arrays:
+    ``time`` (datetime64, interval start), ``mean``, ``min``, ``max``, ``stdev``,
+    ``sample_count``, ``no_data_count`` and ``p25``/``p50``/... percentiles.
+    """
+    intervals = [
+        item for item in response.get("data", [])
+        if output in item.get("outputs", {}) and "error" not in item
     ]
 
-    # --- Sentinel Hub evalscript ---
-    evalscript = """//VERSION=3
-    function setup() {
-      return {
-        input: [{ bands: ["SO2", "dataMask"] }],
-        output: [
-          { id: "so2", bands: 1, sampleType: "FLOAT32" },
-          { id: "dataMask", bands: 1 }
-        ]
-      }
-    }
-    function evaluatePixel(sample) {
-      return {
-        so2: [sample.SO2],
-        dataMask: [sample.dataMask]
-      }
-    }
+    times, columns = [], {name: [] for name in ("mean", "min", "max", "stdev", "sample_count", "no_data_count")}
+    for percentile in PERCENTILES:
+        columns[f"p{percentile}"] = []
+
+    for item in intervals:
+        stats = item["outputs"][output]["bands"]["B0"]["stats"]
+        times.append(item["interval"]["from"].rstrip("Z"))
+        columns["mean"].append(_stat(stats.get("mean")))
+        columns["min"].append(_stat(stats.get("min")))
+        columns["max"].append(_stat(stats.get("max")))
+        columns["stdev"].append(_stat(stats.get("stDev")))
+        columns["sample_count"].append(_stat(stats.get("sampleCount")))
+        columns["no_data_count"].append(_stat(stats.get("noDataCount")))
+        percentiles = stats.get("percentiles", {})
+        for percentile in PERCENTILES:
+            columns[f"p{percentile}"].append(_stat(percentiles.get(f"{percentile:.1f}")))
+
+    arrays = {"time": np.array(times, dtype="datetime64[s]")}
+    for name, values in columns.items():
+        arrays[name] = np.array(values, dtype=np.float64)
+    return arrays
+
+
+def arrays_to_json(arrays: dict[str, np.ndarray]) -> dict[str, list]:
+    """JSON-friendly copy of ``stats_to_arrays`` output (NaN -> None, times as ISO strings)."""
+    result = {}
+    for name, values in arrays.items():
+        if values.dtype.kind == "M":
+            result[name] = [str(value) for value in values]
+        else:
+            result[name] = [None if math.isnan(value) else value for value in values.tolist()]
+    return result
+
+
+class SentinelStatsClient:
     """
+    Sentinel Hub Statistics API client for Sentinel-5P (Copernicus Data Space).
 
-    stats_request = {
-      "input": {
-        "bounds": { "bbox": bbox, "properties": { "crs": "http://www.opengis.net/def/crs/EPSG/0/4326" } },
-        "data": [
-          {
-            "type": "sentinel-5p-l2",
-            "dataFilter": { "timeRange": { "from": start_date, "to": end_date } }
-          }
-        ]
-      },
-      "aggregation": {
-        "timeRange": { "from": start_date, "to": end_date },
-        "aggregationInterval": { "of": "P1D" },
-        "evalscript": evalscript,
-        "resx": 0.05,
-        "resy": 0.05
-      },
-      "calculations": {
-        "default": {
-          "histograms": { "default": { "nBins": 10, "lowEdge": 0.0, "highEdge": 0.005 } },
-          "statistics": { "default": { "percentiles": { "k": [25, 50, 75, 90] } } }
-        }
-      }
-    }
+    Nothing touches the network until the first query. The OAuth token is
+    fetched lazily, reused across requests and refreshed shortly before it
+    expires; all requests go through the shared pooled HTTP client.
+
+    NO2 and SO2 come from one request per area (one evalscript, two outputs).
+    Batches of areas run with bounded concurrency under a processing-unit
+    quota, and responses for finished days are cached per (bbox tile, day).
+    URLs can point at a local stand-in (see ``standins/sentinel_hub.py``).
+    """
+
+    def __init__(self, client_id: str = SH_CLIENT_ID, client_secret: str = SH_CLIENT_SECRET,
+                 token_url: str = TOKEN_URL, statistics_url: str = STATISTICS_URL, process_url: str = PROCESS_URL,
+                 max_concurrency: int = SH_MAX_CONCURRENCY, quota: ProcessingUnitQuota | None = None,
+                 cache: GridCache | None = None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_url = token_url
+        self.statistics_url = statistics_url
+        self.process_url = process_url
+        self.quota = quota or ProcessingUnitQuota()
+        # Dane z zakończonego dnia nigdy się nie zmieniają - wpisy nie wygasają
+        self.cache = cache or GridCache(max_entries=2048, ttl=math.inf, step=RESOLUTION_DEG,
+                                        stale_ttl=0, store=open_default_store())
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="sentinel")
+        self._token = None
+        self._token_expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def _access_token(self, force_refresh: bool = False) -> str:
+        with self._lock:
+            if force_refresh or self._token is None or time.monotonic() >= self._token_expires_at - TOKEN_REFRESH_MARGIN:
+                if not self.client_id or not self.client_secret:
+                    raise RuntimeError("Brak danych logowania Sentinel Hub (SH_CLIENT_ID / SH_CLIENT_SECRET).")
+                token = post_json(self.token_url, data={
+                    "grant_type": "client_credentials",
+                    "client_id": self.client_id,
+                    "client_secret": self.client_secret,
+                })
+                self._token = token["access_token"]
+                self._token_expires_at = time.monotonic() + float(token.get("expires_in", 300))
+            return self._token
+
+    def statistics(self, stats_request: dict) -> dict:
+        """POST a raw Statistics API request; retries once with a fresh token on 401."""
+        self.quota.acquire(estimate_processing_units(stats_request["input"]["bounds"]["bbox"]))
+        for attempt in range(2):
+            headers = {
+                "Authorization": f"Bearer {self._access_token(force_refresh=attempt > 0)}",
+                "Accept": "application/json",
+            }
+            try:
+                return post_json(self.statistics_url, json=stats_request, headers=headers)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 401 or attempt > 0:
+                    raise RuntimeError(f"API Error {e.response.status_code}: {e.response.text}") from e
+
+    def process(self, request_body: dict) -> bytes:
+        """POST a Process API request and return the image bytes; retries once with a fresh token on 401."""
+        self.quota.acquire(estimate_processing_units(request_body["input"]["bounds"]["bbox"]))
+        for attempt in range(2):
+            headers = {
+                "Authorization": f"Bearer {self._access_token(force_refresh=attempt > 0)}",
+                "Accept": "image/tiff",
+            }
+            try:
+                return post_bytes(self.process_url, json=request_body, headers=headers)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 401 or attempt > 0:
+                    raise RuntimeError(f"API Error {e.response.status_code}: {e.response.text}") from e
+
+    def _area_response(self, lat: float, lon: float, size_km: float, days_back: int) -> dict:
+        snapped_lat, snapped_lon = snap_to_grid(lat, lon, RESOLUTION_DEG)
+        time_from, time_to = day_range(days_back)
+        day_index = int(datetime.fromisoformat(time_from.replace("Z", "+00:00")).timestamp() // 86400)
+        key = (f"s5p_stats_{size_km:g}km", snapped_lat, snapped_lon, day_index)
+
+        def request(snapped_lat, snapped_lon):
+            bbox = bbox_around(snapped_lat, snapped_lon, size_km)
+            return self.statistics(statistics_request(bbox, time_from, time_to))
+
+        # Bieżący dzień jest niepełny, więc nie trafia do cache
+        if days_back < 1:
+            return request(snapped_lat, snapped_lon)
+
+        incomplete = []
+
+        def fetch(snapped_lat, snapped_lon):
+            response = request(snapped_lat, snapped_lon)
+            if is_complete_response(response):
+                return response
+            # Błędy przedziałów albo brak produktu (OFFL za wczoraj) - bez cache, kolejne zapytanie spróbuje ponownie
+            incomplete.append(response)
+            return None
+
+        response = self.cache.get_or_fetch_key(key, fetch)
+        if response is None:
+            # Zapytania czekające na to samo pobieranie dostają pusty wynik zamiast ponownego kosztu PU
+            return incomplete[0] if incomplete else {"data": []}
+        return response
+
+    def area_stats(self, lat: float, lon: float, size_km: float = 70, days_back: int = 1) -> dict[str, dict[str, np.ndarray]]:
+        """NO2 and SO2 statistics (mol/m²) for a square area around a point, keyed by pollutant."""
+        response = self._area_response(lat, lon, size_km, days_back)
+        return {output: stats_to_arrays(response, output) for output in OUTPUT_HISTOGRAM_EDGES}
+
+    def stats_many(self, centers: list[tuple[float, float]], size_km: float = 70,
+                   days_back: int = 1) -> list[dict[str, dict[str, np.ndarray]] | None]:
+        """``area_stats`` for many areas, run concurrently; failed areas give ``None``."""
+        def one(center):
+            try:
+                return self.area_stats(center[0], center[1], size_km=size_km, days_back=days_back)
+            except (RuntimeError, httpx.HTTPError, KeyError, ValueError) as e:
+                print(f"Błąd pobierania statystyk Sentinel-5P dla {center}: {e}")
+                return None
+
+        return list(self._executor.map(one, centers))
 
-    headers = { "Content-Type": "application/json", "Accept": "application/json" }
-    url = "https://sh.dataspace.copernicus.eu/api/v1/statistics"
+    def no2_stats(self, lat: float, lon: float, size_km: float = 70, days_back: int = 1) -> dict[str, np.ndarray]:
+        """Sentinel-5P NO2 statistics (mol/m²) for a square area around a point."""
+        return self.area_stats(lat, lon, size_km, days_back)["no2"]
 
-    response = oauth.request("POST", url=url, headers=headers, json=stats_request)
-    data = response.json()
+    def so2_stats(self, lat: float, lon: float, size_km: float = 70, days_back: int = 1) -> dict[str, np.ndarray]:
+        """Sentinel-5P SO2 statistics (mol/m²) for a square area around a point."""
+        return self.area_stats(lat, lon, size_km, days_back)["so2"]
 
-    if response.status_code != 200:
-        raise RuntimeError(f"API Error {response.status_code}: {data}")
 
-    return data
+_default_client = None
 
 
+def get_default_client() -> SentinelStatsClient:
+    global _default_client
+    if _default_client is None:
+        _default_client = SentinelStatsClient()
+    return _default_client
 
-# Example usage:
-result = get_no2_stats(oauth, 53.75, 13.5, size_km=70)
-print(json.dumps(result, indent=2))
-result = get_no2_stats(oauth, 61, 11, size_km=70)
-print(json.dumps(result, indent=2))
-result = get_no2_stats(oauth, 64, 15, size_km=70)
-print(json.dumps(result, indent=2))
-result = get_no2_stats(oauth, 45, 8, size_km=70)
-print(json.dumps(result, indent=2))
 
+if __name__ == "__main__":
+    sentinel = get_default_client()
+    centers = [(53.75, 13.5), (61, 11), (64, 15), (45, 8)]
+    for center, stats in zip(centers, sentinel.stats_many(centers, size_km=70)):
+        print(center, stats)
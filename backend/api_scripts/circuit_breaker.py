@@ -0,0 +1,134 @@
+"""
+Per-upstream circuit breakers and a process-wide retry budget.
+
+A breaker opens after UPSTREAM_CIRCUIT_FAILURES consecutive failed calls to
+a host; while open, calls fail immediately with ``CircuitOpen`` instead of
+waiting for timeouts. After UPSTREAM_CIRCUIT_OPEN_SECONDS one probe call is
+let through (half-open) and its outcome closes or re-opens the circuit.
+
+Retries draw from a shared token bucket: every first attempt deposits
+UPSTREAM_RETRY_RATIO tokens and every retry costs one, so during an incident
+retries are capped at a fraction of normal traffic instead of multiplying it.
+"""
+import os
+import random
+import threading
+import time
+
+import httpx
+
+CIRCUIT_FAILURES = int(os.environ.get("UPSTREAM_CIRCUIT_FAILURES", "5"))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("UPSTREAM_CIRCUIT_OPEN_SECONDS", "30"))
+
+MAX_RETRIES = int(os.environ.get("UPSTREAM_MAX_RETRIES", "2"))
+RETRY_RATIO = float(os.environ.get("UPSTREAM_RETRY_RATIO", "0.1"))
+RETRY_BUDGET_MAX = float(os.environ.get("UPSTREAM_RETRY_BUDGET", "10"))
+RETRY_BACKOFF_BASE = float(os.environ.get("UPSTREAM_RETRY_BACKOFF", "0.1"))
+RETRY_BACKOFF_MAX = 1.0
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpen(httpx.HTTPError):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+def is_retryable(error: Exception) -> bool:
+    """Transport errors, timeouts, 5xx and 429 are worth another attempt; other 4xx are not."""
+    if isinstance(error, CircuitOpen):
+        return False
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status >= 500 or status == 429
+    return isinstance(error, httpx.TransportError)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff before retry number ``attempt`` (1-based)."""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURES, open_seconds: float = CIRCUIT_OPEN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; in half-open state only one probe at a time is allowed."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probe_running:
+                self._probe_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_running = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """The allowed call never reached the upstream (e.g. no free slot) - keep the state as it is."""
+        with self._lock:
+            self._probe_running = False
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state != CLOSED
+
+
+class RetryBudget:
+    def __init__(self, ratio: float = RETRY_RATIO, max_tokens: float = RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """Called once per original (non-retry) request."""
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """Take one token for a retry; False when the budget is exhausted."""
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+retry_budget = RetryBudget()
+
+
+def breaker_for(host: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker()
+        return breaker
+
+
+def breaker_states() -> dict[str, str]:
+    with _breakers_lock:
+        return {host: breaker.state for host, breaker in _breakers.items()}
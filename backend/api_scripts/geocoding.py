@@ -0,0 +1,272 @@
+"""
+Place-name lookup: a local gazetteer held in memory, with Nominatim (geopy) as fallback.
+
+The gazetteer is a tab-separated file, either the bundled ``gazetteer.tsv``
+(``name, country, latitude, longitude, population, alternate_names``) or a
+GeoNames dump such as ``cities15000.txt`` (set GAZETTEER_PATH). Names are
+normalised (case, diacritics, punctuation) and kept in a sorted prefix index,
+so a lookup is a dictionary hit or two bisections.
+
+Queries the gazetteer does not know go to Nominatim, at most one request per
+GEOCODE_MIN_INTERVAL_SECONDS across all worker processes (the Nominatim usage
+policy allows one per second). Answers, including "not found", are cached.
+"""
+import heapq
+import os
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+
+from geopy.exc import GeopyError
+from geopy.geocoders import Nominatim
+
+from api_scripts import metrics
+from api_scripts.shared_cache import claim_period, shared_cache
+
+DEFAULT_GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.tsv")
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH", DEFAULT_GAZETTEER_PATH)
+
+NOMINATIM_DOMAIN = os.environ.get("NOMINATIM_DOMAIN", "nominatim.openstreetmap.org")
+NOMINATIM_SCHEME = os.environ.get("NOMINATIM_SCHEME", "https")
+GEOCODE_USER_AGENT = os.environ.get("GEOCODE_USER_AGENT", "nasa-challenge-smog-api")
+GEOCODE_TIMEOUT_SECONDS = float(os.environ.get("GEOCODE_TIMEOUT_SECONDS", "5"))
+GEOCODE_MIN_INTERVAL_SECONDS = float(os.environ.get("GEOCODE_MIN_INTERVAL_SECONDS", "1.0"))
+# Jak długo zapytanie może czekać na swoją kolej do Nominatim, zanim zwrócimy 503
+GEOCODE_MAX_WAIT_SECONDS = float(os.environ.get("GEOCODE_MAX_WAIT_SECONDS", "2.0"))
+GEOCODE_CACHE_TTL_SECONDS = float(os.environ.get("GEOCODE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+GEOCODE_CACHE_MAX_ENTRIES = int(os.environ.get("GEOCODE_CACHE_MAX_ENTRIES", "2048"))
+
+MAX_RESULTS = 10
+# Dla najkrótszych prefiksów zakres w indeksie jest duży - wyniki liczymy z góry
+SHORT_PREFIX = 3
+
+# Znaki, których NFKD nie rozkłada na literę bazową i znak diakrytyczny
+_TRANSLITERATION = str.maketrans({"ł": "l", "ø": "o", "đ": "d", "ß": "ss", "æ": "ae", "œ": "oe"})
+
+
+def normalize(name: str) -> str:
+    """Lower-case, strip diacritics and punctuation, collapse whitespace: ``"Łódź"`` -> ``"lodz"``."""
+    decomposed = unicodedata.normalize("NFKD", name.casefold().translate(_TRANSLITERATION))
+    letters = (" " if not char.isalnum() else char for char in decomposed if not unicodedata.combining(char))
+    return " ".join("".join(letters).split())
+
+
+def _read_places(path: str) -> list[tuple[dict, list[str]]]:
+    places = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            columns = line.rstrip("\n").split("\t")
+            try:
+                if len(columns) >= 15:
+                    # GeoNames: name, asciiname, alternatenames, lat, lon, ..., country, ..., population
+                    place = {"name": columns[1], "country": columns[8], "latitude": float(columns[4]),
+                             "longitude": float(columns[5]), "population": int(columns[14] or 0)}
+                    names = [columns[1], columns[2], *columns[3].split(",")]
+                else:
+                    place = {"name": columns[0], "country": columns[1], "latitude": float(columns[2]),
+                             "longitude": float(columns[3]), "population": int(columns[4] or 0)}
+                    names = [columns[0], *(columns[5].split(",") if len(columns) > 5 else [])]
+            except (IndexError, ValueError):
+                # Nagłówek albo uszkodzony wiersz
+                continue
+            places.append((place, names))
+    return places
+
+
+class Gazetteer:
+    """
+    In-memory prefix index of place names.
+
+    ``search`` returns places whose (alternate) name equals the query first,
+    then places with a name starting with it, each group by population.
+    """
+
+    def __init__(self, places: list[tuple[dict, list[str]]]):
+        self.places = [place for place, _ in places]
+        self._population = [place["population"] for place in self.places]
+
+        keys = sorted({(normalize(name), index) for index, (_, names) in enumerate(places) for name in names
+                       if normalize(name)})
+        self._names = [name for name, _ in keys]
+        self._ids = [index for _, index in keys]
+
+        exact = {}
+        short = {}
+        for name, index in keys:
+            exact.setdefault(name, set()).add(index)
+            for length in range(1, min(SHORT_PREFIX, len(name)) + 1):
+                short.setdefault(name[:length], set()).add(index)
+        self._exact = {name: self._ranked(ids, MAX_RESULTS) for name, ids in exact.items()}
+        self._short = {prefix: self._ranked(ids, MAX_RESULTS) for prefix, ids in short.items()}
+
+    @classmethod
+    def load(cls, path: str = GAZETTEER_PATH) -> "Gazetteer":
+        return cls(_read_places(path))
+
+    def __len__(self) -> int:
+        return len(self.places)
+
+    def _ranked(self, ids, count: int) -> list[int]:
+        return heapq.nlargest(count, ids, key=self._population.__getitem__)
+
+    def search(self, query: str, limit: int = 5) -> list[dict]:
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        limit = min(limit, MAX_RESULTS)
+
+        if len(prefix) <= SHORT_PREFIX:
+            starting = self._short.get(prefix, [])
+        else:
+            start = bisect_left(self._names, prefix)
+            end = bisect_left(self._names, prefix + "\uffff", start)
+            starting = self._ranked(set(self._ids[start:end]), limit + MAX_RESULTS)
+
+        ranked = list(self._exact.get(prefix, []))
+        ranked += [index for index in starting if index not in ranked]
+        return [self.places[index] for index in ranked[:limit]]
+
+
+def load_default_gazetteer() -> Gazetteer:
+    try:
+        return Gazetteer.load(GAZETTEER_PATH)
+    except OSError as e:
+        print(f"Nie udało się wczytać gazetera {GAZETTEER_PATH}: {e}")
+        return Gazetteer([])
+
+
+gazetteer = load_default_gazetteer()
+
+class QueryCache:
+    """
+    LRU cache of geocoding answers keyed by ``(normalised query, limit)``, with a
+    wall-clock TTL. With a ``shared`` cache (SharedCache) answers fetched by
+    other worker processes are reused.
+    """
+
+    def __init__(self, max_entries: int = GEOCODE_CACHE_MAX_ENTRIES, ttl: float = GEOCODE_CACHE_TTL_SECONDS,
+                 shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def _set(self, key, value, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        found = self.shared.get(("geocode", *key)) if self.shared is not None else None
+        with self._lock:
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        value, expires_at = found
+        self._set(key, value, expires_at - time.time())
+        return value
+
+    def get_or_fetch(self, query: str, limit: int, fetch):
+        """Cached answer for the query, calling ``fetch()`` on a miss; ``None`` results are not cached."""
+        key = (normalize(query), limit)
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        value = fetch()
+        if value is not None:
+            self._set(key, value, self.ttl)
+            if self.shared is not None:
+                self.shared.set(("geocode", *key), value, self.ttl)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+geocode_cache = QueryCache(shared=shared_cache)
+
+_geocoder = Nominatim(user_agent=GEOCODE_USER_AGENT, timeout=GEOCODE_TIMEOUT_SECONDS,
+                      domain=NOMINATIM_DOMAIN, scheme=NOMINATIM_SCHEME)
+_geocoder_lock = threading.Lock()
+_last_slot = -1
+
+
+def _wait_for_slot(deadline: float) -> bool:
+    """Wait for the next free Nominatim slot (shared by all workers); False if it comes after ``deadline``."""
+    global _last_slot
+    while True:
+        now = time.time()
+        slot = int(now // GEOCODE_MIN_INTERVAL_SECONDS)
+        if slot > _last_slot and claim_period("nominatim", GEOCODE_MIN_INTERVAL_SECONDS, now):
+            _last_slot = slot
+            return True
+        wake_at = (slot + 1) * GEOCODE_MIN_INTERVAL_SECONDS
+        if wake_at > deadline:
+            return False
+        time.sleep(wake_at - now)
+
+
+def nominatim_search(query: str, limit: int = 5) -> list[dict] | None:
+    """Ask Nominatim; returns [] when nothing was found and None when it failed or no slot was free in time."""
+    deadline = time.time() + GEOCODE_MAX_WAIT_SECONDS
+    if not _geocoder_lock.acquire(timeout=GEOCODE_MAX_WAIT_SECONDS):
+        return None
+    try:
+        if not _wait_for_slot(deadline):
+            return None
+        with metrics.stage("geocode"):
+            locations = _geocoder.geocode(query, exactly_one=False, limit=limit, addressdetails=True)
+    except GeopyError as e:
+        print(f"Błąd geokodowania '{query}': {e}")
+        return None
+    finally:
+        _geocoder_lock.release()
+
+    return [
+        {"name": location.address, "country": location.raw.get("address", {}).get("country_code", "").upper(),
+         "latitude": location.latitude, "longitude": location.longitude, "population": None}
+        for location in locations or []
+    ]
+
+
+def geocode(query: str, limit: int = 5) -> tuple[list[dict] | None, str]:
+    """
+    Resolve a place name to up to ``limit`` places and the source that answered
+    (``"gazetteer"`` or ``"nominatim"``). The list is None when Nominatim was needed but unavailable.
+    """
+    limit = min(limit, MAX_RESULTS)
+    places = gazetteer.search(query, limit)
+    if places:
+        return places, "gazetteer"
+
+    return geocode_cache.get_or_fetch(query, limit, lambda: nominatim_search(query, limit)), "nominatim"
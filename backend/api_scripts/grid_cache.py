@@ -0,0 +1,344 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from api_scripts.observation_store import open_default_store
+from api_scripts.shared_cache import shared_cache
+
+# Open-Meteo odświeża dane co godzinę, więc wpis nie może żyć dłużej niż jeden kubełek czasowy
+UPSTREAM_REFRESH_SECONDS = 3600
+
+GRID_STEP = float(os.environ.get("CACHE_GRID_STEP", "0.05"))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "4096"))
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", str(UPSTREAM_REFRESH_SECONDS)))
+CACHE_STALE_SECONDS = float(os.environ.get("CACHE_STALE_SECONDS", "600"))
+
+# Jak stare dane można zwrócić (oznaczone jako nieaktualne), gdy upstream nie odpowiada
+CACHE_FALLBACK_SECONDS = float(os.environ.get("CACHE_FALLBACK_SECONDS", str(6 * UPSTREAM_REFRESH_SECONDS)))
+
+# Jak długo inne procesy czekają na wynik pobierania prowadzonego przez jeden z nich
+SHARED_FETCH_LEASE_SECONDS = float(os.environ.get("SHARED_FETCH_LEASE_SECONDS", "15"))
+SHARED_FETCH_POLL_SECONDS = 0.05
+
+# Odświeżanie wygasłych wpisów w tle (stale-while-revalidate)
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="cache-refresh")
+
+
+def snap_to_grid(lat: float, lon: float, step: float = GRID_STEP) -> tuple[float, float]:
+    """Round a coordinate pair to the centre of its grid cell."""
+    return (
+        round(round(lat / step) * step, 6),
+        round(round(lon / step) * step, 6),
+    )
+
+
+def hour_bucket(now: float | None = None) -> int:
+    """Index of the upstream refresh period that ``now`` falls into."""
+    if now is None:
+        now = time.time()
+    return int(now // UPSTREAM_REFRESH_SECONDS)
+
+
+def seconds_until_next_bucket(now: float | None = None) -> int:
+    """Seconds left until the upstream publishes its next hourly refresh."""
+    if now is None:
+        now = time.time()
+    return max(1, int(UPSTREAM_REFRESH_SECONDS - now % UPSTREAM_REFRESH_SECONDS))
+
+
+def mark_stale(value, bucket: int):
+    """
+    Copy of a cached dict marked ``"stale": True`` with the ``observed_at`` hour of
+    its bucket, so callers never pass it off as current data; other values are returned as is.
+    """
+    if not isinstance(value, dict):
+        return value
+    observed_at = time.strftime("%Y-%m-%dT%H:00Z", time.gmtime(bucket * UPSTREAM_REFRESH_SECONDS))
+    return {**value, "stale": True, "observed_at": observed_at}
+
+
+class GridCache:
+    """
+    Bounded LRU cache with TTL for upstream lookups, keyed ``(name, snapped_lat, snapped_lon, hour_bucket)``.
+
+    Expired entries are served marked as stale for ``stale_ttl`` more seconds while
+    refreshed in the background, and failed fetches fall back to the last value
+    within ``fallback_seconds``. ``store`` (ObservationStore) and ``shared``
+    (SharedCache) share fetched values with other worker processes.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl: float = CACHE_TTL_SECONDS,
+                 step: float = GRID_STEP, stale_ttl: float = CACHE_STALE_SECONDS, store=None,
+                 fallback_seconds: float = CACHE_FALLBACK_SECONDS, shared=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.step = step
+        self.stale_ttl = stale_ttl
+        self.store = store
+        self.fallback_seconds = fallback_seconds
+        self.shared = shared
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+        self.coalesced = 0
+        self.fallbacks = 0
+        self.shared_hits = 0
+        self.shared_waits = 0
+
+    def key_for(self, name: str, lat: float, lon: float, now: float | None = None) -> tuple:
+        snapped_lat, snapped_lon = snap_to_grid(lat, lon, self.step)
+        return name, snapped_lat, snapped_lon, hour_bucket(now)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, stale_until, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if stale_until <= now:
+                    del self._entries[key]
+
+        value = self._get_shared(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.shared_hits += 1
+        return value
+
+    def _get_shared(self, key):
+        """Copy a live entry written by another process into memory."""
+        if self.shared is None:
+            return None
+        found = self.shared.get(key)
+        if found is None:
+            return None
+        value, expires_at = found
+        self.set(key, value, ttl=expires_at - time.time())
+        return value
+
+    def get_stale(self, key):
+        """Return the value for ``key`` even if expired, as long as it is within the stale window."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                return None
+            return entry[2]
+
+    def set(self, key, value, ttl: float | None = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, expires_at + self.stale_ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def remember(self, key, value):
+        """Cache a freshly fetched value and record it in the store and the shared cache."""
+        self.set(key, value)
+        if self.store is not None:
+            self.store.record(key, value)
+        if self.shared is not None and self.ttl != math.inf:
+            self.shared.set(key, value, self.ttl)
+
+    def lookup(self, key):
+        """Like ``get``, but falls back to the store for values fetched by another process."""
+        value = self.get(key)
+        if value is None and self.store is not None:
+            value = self.store.load(key)
+            if value is not None:
+                self.set(key, value, ttl=min(self.ttl, seconds_until_next_bucket()))
+        return value
+
+    def warm_from_store(self, limit: int | None = None) -> int:
+        """Drop expired observations from the store, then load the current hour's ones into memory."""
+        if self.store is None:
+            return 0
+        self.store.prune()
+        rows = self.store.bucket_rows(hour_bucket(), limit or self.max_entries)
+        ttl = min(self.ttl, seconds_until_next_bucket())
+        for key, value in reversed(rows):
+            self.set(key, value, ttl=ttl)
+        return len(rows)
+
+    def get_or_fetch(self, name: str, lat: float, lon: float, fetch):
+        """
+        Return the cached value for the grid cell around (lat, lon), calling
+        ``fetch(snapped_lat, snapped_lon)`` on a miss. ``None`` results are not cached.
+        """
+        key = self.key_for(name, lat, lon)
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        previous_key = self.key_for(name, lat, lon, time.time() - UPSTREAM_REFRESH_SECONDS)
+        for stale_key in (key, previous_key):
+            stale = self.get_stale(stale_key)
+            if stale is not None:
+                with self._lock:
+                    self.stale_hits += 1
+                self._refresh_in_background(key, fetch)
+                return mark_stale(stale, stale_key[-1])
+
+        value = self._fetch_once(key, fetch)
+        if value is None:
+            return self.last_known(key)
+        return value
+
+    def last_known(self, key):
+        """
+        Newest value for the key's cell from an earlier (or the current, expired)
+        hour bucket within ``fallback_seconds``, marked as stale; None if there is none.
+        """
+        name, snapped_lat, snapped_lon, bucket = key
+        oldest_bucket = bucket - int(self.fallback_seconds // UPSTREAM_REFRESH_SECONDS)
+
+        found = None
+        with self._lock:
+            for candidate in range(bucket, oldest_bucket - 1, -1):
+                entry = self._entries.get((name, snapped_lat, snapped_lon, candidate))
+                if entry is not None:
+                    found = (candidate, entry[2])
+                    break
+        if found is None and self.store is not None:
+            rows = self.store.query(name, snapped_lat, snapped_lon, oldest_bucket, bucket)
+            if rows:
+                found = rows[-1]
+        if found is None:
+            return None
+
+        found_bucket, value = found
+        if not isinstance(value, dict):
+            return None
+        with self._lock:
+            self.fallbacks += 1
+        return mark_stale(value, found_bucket)
+
+    def get_or_fetch_key(self, key, fetch):
+        """``get_or_fetch`` for a caller-built key (no stale serving); ``fetch`` gets key[1], key[2]."""
+        value = self.get(key)
+        if value is not None:
+            return value
+        return self._fetch_once(key, fetch)
+
+    def _fetch_once(self, key, fetch):
+        """Single-flight: only one caller per key runs ``fetch``, the rest wait for its result."""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            value = self.store.load(key) if self.store is not None else None
+            if value is not None:
+                self.set(key, value, ttl=min(self.ttl, seconds_until_next_bucket()))
+            else:
+                value = self._fetch_shared(key, fetch)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _fetch_shared(self, key, fetch):
+        """
+        Run ``fetch`` for ``key`` in at most one process: if another worker holds
+        the lease, wait for the value it writes to the shared cache (up to the lease time).
+        """
+        _, snapped_lat, snapped_lon = key[:3]
+        if self.shared is not None:
+            deadline = time.monotonic() + SHARED_FETCH_LEASE_SECONDS
+            waited = False
+            while not self.shared.claim(key, SHARED_FETCH_LEASE_SECONDS):
+                if not waited:
+                    waited = True
+                    with self._lock:
+                        self.shared_waits += 1
+                time.sleep(SHARED_FETCH_POLL_SECONDS)
+                value = self._get_shared(key)
+                if value is not None:
+                    return value
+                if time.monotonic() > deadline:
+                    break
+
+        try:
+            value = fetch(snapped_lat, snapped_lon)
+            if value is not None:
+                self.remember(key, value)
+            return value
+        finally:
+            if self.shared is not None:
+                self.shared.release(key)
+
+    def _refresh_in_background(self, key, fetch):
+        with self._lock:
+            if key in self._inflight:
+                return
+
+        def refresh():
+            try:
+                self._fetch_once(key, fetch)
+            except Exception as e:
+                print(f"Błąd odświeżania danych w tle: {e}")
+
+        _refresh_executor.submit(refresh)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+            self.stale_hits = self.coalesced = self.fallbacks = 0
+            self.shared_hits = self.shared_waits = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "stale_hits": self.stale_hits,
+                "coalesced": self.coalesced,
+                "fallbacks": self.fallbacks,
+                "shared_hits": self.shared_hits,
+                "shared_waits": self.shared_waits,
+                "in_flight": len(self._inflight),
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Wspólny cache dla wszystkich zapytań do Open-Meteo w procesie; magazyn na dysku podpina open_upstream_store
+upstream_cache = GridCache(shared=shared_cache)
+
+
+def open_upstream_store() -> int:
+    """Attach the store configured by OBSERVATION_STORE_PATH to ``upstream_cache`` and warm it; returns rows loaded."""
+    if upstream_cache.store is None:
+        upstream_cache.store = open_default_store()
+    return upstream_cache.warm_from_store()
@@ -0,0 +1,306 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import httpx
+from werkzeug.exceptions import ServiceUnavailable
+
+from api_scripts import metrics
+from api_scripts.circuit_breaker import (CircuitOpen, backoff_delay, breaker_for, breaker_states, is_retryable,
+                                         retry_budget, MAX_RETRIES)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "3.0"))
+READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", "10.0"))
+PER_HOST_CONCURRENCY = int(os.environ.get("UPSTREAM_PER_HOST_CONCURRENCY", "16"))
+MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "64"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "32"))
+
+# Limit wszystkich równoległych zapytań do upstreamu w procesie - po jego przekroczeniu
+# zapytanie czeka co najwyżej UPSTREAM_QUEUE_TIMEOUT, a potem zwracamy szybkie 503
+UPSTREAM_MAX_IN_FLIGHT = int(os.environ.get("UPSTREAM_MAX_IN_FLIGHT", "64"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get("UPSTREAM_QUEUE_TIMEOUT", "0.1"))
+# Co ile kod asynchroniczny sprawdza, czy zwolnił się slot
+SLOT_POLL_SECONDS = 0.005
+
+TIMEOUT = httpx.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT, write=READ_TIMEOUT, pool=CONNECT_TIMEOUT)
+LIMITS = httpx.Limits(
+    max_connections=MAX_CONNECTIONS,
+    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=30.0,
+)
+
+_sync_client = None
+_sync_lock = threading.Lock()
+_sync_host_limits = {}
+_in_flight = threading.BoundedSemaphore(UPSTREAM_MAX_IN_FLIGHT)
+_in_flight_count = 0
+
+# Klient asynchroniczny jest związany z pętlą zdarzeń, więc trzymamy po jednym na pętlę
+_async_clients = weakref.WeakKeyDictionary()
+_async_host_limits = weakref.WeakKeyDictionary()
+
+
+class UpstreamSaturated(ServiceUnavailable):
+    """Raised when all upstream slots are busy; the server answers 503 with ``Retry-After: 1``."""
+
+    def __init__(self, description: str | None = None):
+        super().__init__(description, retry_after=1)
+
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc
+
+
+def circuit_states() -> dict[str, str]:
+    """Circuit breaker state (closed / open / half_open) per upstream host."""
+    return breaker_states()
+
+
+def in_flight() -> int:
+    """Number of upstream requests currently running in this process."""
+    return _in_flight_count
+
+
+def _saturated() -> UpstreamSaturated:
+    metrics.upstream_errors.inc("*", "saturated")
+    return UpstreamSaturated("Za dużo równoległych zapytań do zewnętrznych API.")
+
+
+class _UpstreamSlot:
+    """Hold one of the process-wide upstream slots for the duration of a request."""
+
+    def __enter__(self):
+        with metrics.stage("upstream_queue"):
+            acquired = _in_flight.acquire(timeout=UPSTREAM_QUEUE_TIMEOUT)
+        if not acquired:
+            raise _saturated()
+        return self._taken()
+
+    async def wait_async(self):
+        """Take a slot from a coroutine without blocking the event loop (``__exit__`` releases it)."""
+        # Odpytujemy semafor bez blokowania zamiast czekać w wątku pomocniczym - anulowane
+        # zadanie nie zostawi wtedy slotu zajętego przez wątek, którego nikt już nie zwolni
+        deadline = time.monotonic() + UPSTREAM_QUEUE_TIMEOUT
+        with metrics.stage("upstream_queue"):
+            while not _in_flight.acquire(blocking=False):
+                if time.monotonic() >= deadline:
+                    raise _saturated()
+                await asyncio.sleep(SLOT_POLL_SECONDS)
+        return self._taken()
+
+    def _taken(self):
+        global _in_flight_count
+        with _sync_lock:
+            _in_flight_count += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        global _in_flight_count
+        with _sync_lock:
+            _in_flight_count -= 1
+        _in_flight.release()
+
+
+@contextmanager
+def _observed(host: str):
+    """Record the latency and outcome of one upstream call (per host) and its Server-Timing stage."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with metrics.stage("upstream"):
+            yield
+        outcome = "ok"
+    except httpx.HTTPStatusError as e:
+        metrics.upstream_errors.inc(host, str(e.response.status_code))
+        raise
+    except httpx.HTTPError as e:
+        metrics.upstream_errors.inc(host, type(e).__name__)
+        raise
+    finally:
+        metrics.upstream_latency.observe(time.perf_counter() - started, host, outcome)
+
+
+def _decode_json(response: httpx.Response, host: str):
+    with metrics.stage("parse"):
+        try:
+            return response.json()
+        except ValueError:
+            metrics.upstream_errors.inc(host, "invalid_json")
+            raise
+
+
+def get_client() -> httpx.Client:
+    """Shared synchronous client with keep-alive pooling."""
+    global _sync_client
+    if _sync_client is None:
+        with _sync_lock:
+            if _sync_client is None:
+                _sync_client = httpx.Client(timeout=TIMEOUT, limits=LIMITS, http2=HTTP2_AVAILABLE)
+    return _sync_client
+
+
+def _sync_host_limit(host: str) -> threading.BoundedSemaphore:
+    with _sync_lock:
+        semaphore = _sync_host_limits.get(host)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(PER_HOST_CONCURRENCY)
+            _sync_host_limits[host] = semaphore
+        return semaphore
+
+
+def _check_circuit(host: str):
+    breaker = breaker_for(host)
+    if not breaker.allow():
+        metrics.upstream_errors.inc(host, "circuit_open")
+        raise CircuitOpen(f"Zewnętrzne API {host} jest chwilowo niedostępne (obwód otwarty).")
+    return breaker
+
+
+def _should_retry(error: Exception, attempt: int, host: str) -> bool:
+    if attempt >= MAX_RETRIES or not is_retryable(error) or not retry_budget.try_spend():
+        return False
+    metrics.upstream_retries.inc(host)
+    return True
+
+
+def _send(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    One upstream call with the circuit breaker, jittered retries under the
+    shared retry budget, and the process-wide and per-host concurrency limits.
+    """
+    host = _host(url)
+    retry_budget.deposit()
+    attempt = 0
+    while True:
+        breaker = _check_circuit(host)
+        try:
+            with _UpstreamSlot(), _sync_host_limit(host):
+                with _observed(host):
+                    response = get_client().request(method, url, **kwargs)
+                    response.raise_for_status()
+        except httpx.HTTPError as e:
+            # 4xx oznacza błąd po naszej stronie, a nie awarię upstreamu
+            if is_retryable(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if not _should_retry(e, attempt, host):
+                raise
+            attempt += 1
+            time.sleep(backoff_delay(attempt))
+            continue
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record_success()
+        return response
+
+
+def get_json(url: str, params: dict | None = None, headers: dict | None = None) -> dict:
+    """
+    GET ``url`` through the shared client and return the decoded JSON body.
+
+    Raises ``httpx.HTTPError`` on transport errors, timeouts and non-2xx
+    responses, ``ValueError`` if the body is not valid JSON, and
+    ``UpstreamSaturated`` if no upstream slot frees up in time.
+    """
+    response = _send("GET", url, params=params, headers=headers)
+    return _decode_json(response, _host(url))
+
+
+def post_json(url: str, json: dict | None = None, data: dict | None = None, headers: dict | None = None) -> dict:
+    """POST through the shared client (JSON or form body) and return the decoded JSON response."""
+    response = _send("POST", url, json=json, data=data, headers=headers)
+    return _decode_json(response, _host(url))
+
+
+def post_bytes(url: str, json: dict | None = None, headers: dict | None = None) -> bytes:
+    """POST a JSON body through the shared client and return the raw response body."""
+    return _send("POST", url, json=json, headers=headers).content
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Shared asynchronous client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(timeout=TIMEOUT, limits=LIMITS, http2=HTTP2_AVAILABLE)
+        _async_clients[loop] = client
+        _async_host_limits[loop] = {}
+    return client
+
+
+def _async_host_limit(host: str) -> asyncio.Semaphore:
+    limits = _async_host_limits[asyncio.get_running_loop()]
+    semaphore = limits.get(host)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(PER_HOST_CONCURRENCY)
+        limits[host] = semaphore
+    return semaphore
+
+
+async def aget_json(url: str, params: dict | None = None) -> dict:
+    """Async counterpart of :func:`get_json`."""
+    client = get_async_client()
+    host = _host(url)
+    retry_budget.deposit()
+    attempt = 0
+    while True:
+        breaker = _check_circuit(host)
+        # Sloty są wspólne z kodem synchronicznym
+        slot = _UpstreamSlot()
+        try:
+            await slot.wait_async()
+        except BaseException:
+            breaker.release()
+            raise
+        try:
+            async with _async_host_limit(host):
+                with _observed(host):
+                    response = await client.get(url, params=params)
+                    response.raise_for_status()
+        except httpx.HTTPError as e:
+            if is_retryable(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if not _should_retry(e, attempt, host):
+                raise
+            attempt += 1
+            await asyncio.sleep(backoff_delay(attempt))
+            continue
+        except BaseException:
+            breaker.release()
+            raise
+        finally:
+            slot.__exit__(None, None, None)
+        breaker.record_success()
+        return _decode_json(response, host)
+
+
+async def aclose():
+    """Close the async client bound to the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.pop(loop, None)
+    _async_host_limits.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+
+
+def close():
+    """Close the shared synchronous client."""
+    global _sync_client
+    with _sync_lock:
+        if _sync_client is not None:
+            _sync_client.close()
+            _sync_client = None
@@ -0,0 +1,161 @@
+"""
+In-process metrics rendered in the Prometheus text exposition format, plus
+per-request stage timings for the ``Server-Timing`` header.
+
+Metrics are kept per process; behind several workers each one exposes its own.
+"""
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Granice kubełków w sekundach - od trafień w cache (ms) po timeouty upstreamu
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name, self.help_text, self.label_names = name, help_text, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help_text, self.label_names = name, help_text, labels
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = f'le="{_number(bound)}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.label_names, label_values, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.label_names, label_values)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(self.label_names, label_values)} {count}")
+        return lines
+
+
+class Gauge:
+    """
+    Metric whose samples are read from ``collect()`` at scrape time. Use
+    ``metric_type="counter"`` for running totals kept elsewhere.
+    """
+
+    def __init__(self, name: str, help_text: str, labels: tuple, collect, metric_type: str = "gauge"):
+        self.name, self.help_text, self.label_names = name, help_text, labels
+        self.collect = collect
+        self.metric_type = metric_type
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        for label_values, value in self.collect():
+            lines.append(f"{self.name}{_labels(self.label_names, label_values)} {_number(value)}")
+        return lines
+
+
+_registry = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text format (version 0.0.4)."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+upstream_latency = register(Histogram(
+    "upstream_request_duration_seconds", "Latency of upstream API calls.", ("host", "outcome")))
+upstream_errors = register(Counter(
+    "upstream_errors_total", "Failed upstream API calls by reason.", ("host", "reason")))
+upstream_retries = register(Counter(
+    "upstream_retries_total", "Upstream calls retried under the retry budget.", ("host",)))
+request_latency = register(Histogram(
+    "http_request_duration_seconds", "Latency of API requests until the response is ready.",
+    ("route", "method", "status")))
+
+
+# Etapy obsługi bieżącego żądania dla nagłówka Server-Timing (None = nie zbieramy)
+_stages = contextvars.ContextVar("stages", default=None)
+
+
+def start_stages(enabled: bool = True):
+    """Begin (or, with ``enabled=False``, disable) collecting stage timings for the current request."""
+    _stages.set({} if enabled else None)
+
+
+def current_stages() -> dict | None:
+    return _stages.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Add the time spent in the block to stage ``name`` of the current request, if timings are collected."""
+    stages = _stages.get()
+    if stages is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - started
+
+
+def server_timing(stages: dict, total: float) -> str:
+    """Format stage durations as a ``Server-Timing`` header value (milliseconds)."""
+    entries = [f"{name};dur={duration * 1000:.1f}" for name, duration in stages.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
@@ -0,0 +1,131 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_STORE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "observations.sqlite")
+OBSERVATION_STORE_PATH = os.environ.get("OBSERVATION_STORE_PATH", DEFAULT_STORE_PATH)
+# Obserwacje starsze niż tyle godzin są usuwane z magazynu (0 = bez limitu)
+OBSERVATION_RETENTION_HOURS = float(os.environ.get("OBSERVATION_RETENTION_HOURS", "168"))
+# Jak często zapisujący proces usuwa przeterminowane wiersze
+PRUNE_INTERVAL_SECONDS = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    kind TEXT NOT NULL,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    bucket INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (kind, lat, lon, bucket)
+)
+"""
+
+_INDEX = "CREATE INDEX IF NOT EXISTS observations_fetched_at ON observations (fetched_at)"
+
+
+class ObservationStore:
+    """
+    SQLite (WAL) store of upstream observations.
+
+    Rows are keyed like GridCache entries: ``(kind, lat, lon, bucket)`` where
+    lat/lon are snapped grid coordinates and bucket is the upstream hourly
+    refresh period. The first observation for a key wins, so several worker
+    processes writing the same cell never conflict. Each thread gets its own
+    connection. Rows fetched more than ``retention_hours`` ago are deleted by
+    ``prune``, which writers also run once per ``PRUNE_INTERVAL_SECONDS``.
+    """
+
+    def __init__(self, path: str = OBSERVATION_STORE_PATH, retention_hours: float = OBSERVATION_RETENTION_HOURS):
+        self.path = path
+        self.retention_hours = retention_hours
+        self._local = threading.local()
+        self._pruned_at = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self._connection()
+        connection.execute(_SCHEMA)
+        connection.execute(_INDEX)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def record(self, key: tuple, value):
+        kind, lat, lon, bucket = key
+        try:
+            self._connection().execute(
+                "INSERT OR IGNORE INTO observations (kind, lat, lon, bucket, fetched_at, payload) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, lat, lon, bucket, time.time(), json.dumps(value)),
+            )
+        except sqlite3.Error as e:
+            print(f"Błąd zapisu obserwacji: {e}")
+        if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL_SECONDS:
+            self.prune()
+
+    def prune(self) -> int:
+        """Delete observations fetched more than ``retention_hours`` ago; returns the number of rows removed."""
+        self._pruned_at = time.monotonic()
+        if self.retention_hours <= 0:
+            return 0
+        try:
+            cursor = self._connection().execute(
+                "DELETE FROM observations WHERE fetched_at < ?", (time.time() - self.retention_hours * 3600,))
+        except sqlite3.Error as e:
+            print(f"Błąd usuwania starych obserwacji: {e}")
+            return 0
+        return cursor.rowcount
+
+    def load(self, key: tuple):
+        kind, lat, lon, bucket = key
+        try:
+            row = self._connection().execute(
+                "SELECT payload FROM observations WHERE kind = ? AND lat = ? AND lon = ? AND bucket = ?",
+                (kind, lat, lon, bucket),
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Błąd odczytu obserwacji: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def query(self, kind: str, lat: float, lon: float, start_bucket: int, end_bucket: int) -> list[tuple[int, dict]]:
+        """All observations for one grid cell with ``start_bucket <= bucket <= end_bucket``, oldest first."""
+        try:
+            rows = self._connection().execute(
+                "SELECT bucket, payload FROM observations WHERE kind = ? AND lat = ? AND lon = ? AND bucket BETWEEN ? AND ? "
+                "ORDER BY bucket",
+                (kind, lat, lon, start_bucket, end_bucket),
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Błąd odczytu obserwacji: {e}")
+            return []
+        return [(bucket, json.loads(payload)) for bucket, payload in rows]
+
+    def bucket_rows(self, bucket: int, limit: int) -> list[tuple[tuple, dict]]:
+        """Most recently fetched observations for one bucket, as (key, value) pairs."""
+        try:
+            rows = self._connection().execute(
+                "SELECT kind, lat, lon, bucket, payload FROM observations WHERE bucket = ? ORDER BY fetched_at DESC LIMIT ?",
+                (bucket, limit),
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Błąd odczytu obserwacji: {e}")
+            return []
+        return [((kind, lat, lon, row_bucket), json.loads(payload)) for kind, lat, lon, row_bucket, payload in rows]
+
+
+def open_default_store() -> ObservationStore | None:
+    """Open the store configured by OBSERVATION_STORE_PATH; an empty value disables it."""
+    if not OBSERVATION_STORE_PATH:
+        return None
+    try:
+        return ObservationStore(OBSERVATION_STORE_PATH)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Nie udało się otworzyć magazynu obserwacji: {e}")
+        return None
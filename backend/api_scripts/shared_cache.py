@@ -0,0 +1,193 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+DEFAULT_SHARED_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data",
+                                         "shared_cache.sqlite")
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH", DEFAULT_SHARED_CACHE_PATH)
+
+# Jak często (najwyżej) usuwać wygasłe wpisy z pliku
+EVICT_INTERVAL_SECONDS = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    value TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at);
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    hits INTEGER NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+
+def _encode_key(key) -> str:
+    return json.dumps(list(key) if isinstance(key, tuple) else key, separators=(",", ":"))
+
+
+class SharedCache:
+    """
+    Cache shared by all worker processes on one machine, kept in a SQLite (WAL) file.
+
+    Every write is a single atomic statement and entries carry a wall-clock
+    expiry; expired rows are skipped on read and deleted periodically. Leases
+    (``claim`` / ``release``) let one process fetch a key while the others
+    wait for its result, and let periodic jobs run in only one worker.
+    Named counters (``add_counts`` / ``top_counts``) sum per-key hits from all workers.
+    Values must be JSON-serialisable (tuples come back as lists).
+    """
+
+    def __init__(self, path: str = SHARED_CACHE_PATH):
+        self.path = path
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        self._evicted_at = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key) -> tuple[object, float] | None:
+        """Return ``(value, expires_at)`` for a live entry, or None."""
+        try:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?",
+                (_encode_key(key), time.time()),
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Błąd odczytu współdzielonego cache: {e}")
+            return None
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def set(self, key, value, ttl: float):
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cache (key, expires_at, value) VALUES (?, ?, ?)",
+                (_encode_key(key), time.time() + ttl, json.dumps(value)),
+            )
+        except sqlite3.Error as e:
+            print(f"Błąd zapisu współdzielonego cache: {e}")
+            return
+        self._maybe_evict()
+
+    def claim(self, key, lease_seconds: float) -> bool:
+        """
+        Take the lease on ``key`` for ``lease_seconds`` unless another owner holds
+        a live one. Returns True if this process now holds it.
+        """
+        now = time.time()
+        try:
+            cursor = self._connection().execute(
+                "INSERT INTO leases (key, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.expires_at <= ? OR leases.owner = excluded.owner",
+                (_encode_key(key), self.owner, now + lease_seconds, now),
+            )
+        except sqlite3.Error as e:
+            print(f"Błąd zapisu dzierżawy: {e}")
+            # Bez działającego pliku każdy proces radzi sobie sam
+            return True
+        return cursor.rowcount == 1
+
+    def release(self, key):
+        try:
+            self._connection().execute(
+                "DELETE FROM leases WHERE key = ? AND owner = ?", (_encode_key(key), self.owner))
+        except sqlite3.Error as e:
+            print(f"Błąd zwalniania dzierżawy: {e}")
+
+    def add_counts(self, name: str, counts: dict) -> bool:
+        """Add per-key hit counts to the counter ``name``; returns False if the write failed."""
+        try:
+            self._connection().executemany(
+                "INSERT INTO counters (name, key, hits) VALUES (?, ?, ?) "
+                "ON CONFLICT (name, key) DO UPDATE SET hits = hits + excluded.hits",
+                [(name, _encode_key(key), hits) for key, hits in counts.items()],
+            )
+        except sqlite3.Error as e:
+            print(f"Błąd zapisu liczników {name}: {e}")
+            return False
+        return True
+
+    def top_counts(self, name: str, count: int) -> list[tuple]:
+        """Keys of the counter ``name`` with the most hits (as tuples), best first."""
+        try:
+            rows = self._connection().execute(
+                "SELECT key FROM counters WHERE name = ? ORDER BY hits DESC LIMIT ?", (name, count)).fetchall()
+        except sqlite3.Error as e:
+            print(f"Błąd odczytu liczników {name}: {e}")
+            return []
+        return [tuple(json.loads(row[0])) for row in rows]
+
+    def decay_counts(self, name: str, keep: int):
+        """Halve every hit count of ``name``, dropping keys left at zero and all but the ``keep`` best."""
+        try:
+            connection = self._connection()
+            connection.execute("UPDATE counters SET hits = hits / 2 WHERE name = ?", (name,))
+            connection.execute(
+                "DELETE FROM counters WHERE name = ? AND (hits = 0 OR key NOT IN "
+                "(SELECT key FROM counters WHERE name = ? ORDER BY hits DESC LIMIT ?))", (name, name, keep))
+        except sqlite3.Error as e:
+            print(f"Błąd zapisu liczników {name}: {e}")
+
+    def evict_expired(self) -> int:
+        now = time.time()
+        connection = self._connection()
+        removed = connection.execute("DELETE FROM cache WHERE expires_at <= ?", (now,)).rowcount
+        connection.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+        return removed
+
+    def _maybe_evict(self):
+        now = time.monotonic()
+        if now - self._evicted_at < EVICT_INTERVAL_SECONDS:
+            return
+        self._evicted_at = now
+        try:
+            self.evict_expired()
+        except sqlite3.Error as e:
+            print(f"Błąd usuwania wygasłych wpisów współdzielonego cache: {e}")
+
+
+def open_default_shared_cache() -> SharedCache | None:
+    """Open the cache configured by SHARED_CACHE_PATH; an empty value disables it."""
+    if not SHARED_CACHE_PATH:
+        return None
+    try:
+        return SharedCache(SHARED_CACHE_PATH)
+    except (sqlite3.Error, OSError) as e:
+        print(f"Nie udało się otworzyć współdzielonego cache: {e}")
+        return None
+
+
+shared_cache = open_default_shared_cache()
+
+
+def claim_period(name: str, period_seconds: float, now: float | None = None) -> bool:
+    """
+    True in exactly one worker per ``period_seconds``-long period (and always
+    without a shared cache), so that periodic background jobs run only once.
+    """
+    if shared_cache is None:
+        return True
+    if now is None:
+        now = time.time()
+    return shared_cache.claim(("job", name, int(now // period_seconds)), period_seconds)
@@ -0,0 +1,214 @@
+"""
+ASGI entry point. The flask-restx app (same routes and Swagger docs) runs behind
+an ASGI server, which keeps slow clients and idle keep-alive connections on the
+event loop instead of in worker threads:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5001
+
+Requests beyond ASGI_MAX_IN_FLIGHT are rejected immediately with 503 instead of
+queueing, and upstream calls are capped separately by UPSTREAM_MAX_IN_FLIGHT.
+
+/aqi/stream (Server-Sent Events) is served directly on the event loop, so open
+streams neither hold a WSGI thread nor count against ASGI_MAX_IN_FLIGHT.
+
+Background jobs (store warm-up, prefetch, station refresh, tiles, NO2 rasters)
+start on the lifespan startup event, once in every worker process.
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from prediction.subscriptions import STREAM_HEADERS, AsyncSubscription, HubFull, aqi_hub, parse_cells
+from server import app, start_background_jobs
+
+ASGI_MAX_IN_FLIGHT = int(os.environ.get("ASGI_MAX_IN_FLIGHT", "256"))
+WSGI_THREADS = int(os.environ.get("WSGI_THREADS", "64"))
+
+_wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi")
+
+
+class _ThreadPoolWsgiInstance(WsgiToAsgiInstance):
+    """WsgiToAsgiInstance that runs the WSGI app on the _wsgi_executor pool."""
+
+    # asgiref uruchamia wszystkie żądania WSGI w jednym wspólnym wątku (thread_sensitive=True) -
+    # tutaj każde dostaje wątek z puli, a odpowiedź wraca do pętli zdarzeń przez run_coroutine_threadsafe
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            raise ValueError("WSGI wrapper received a non-HTTP scope")
+        self.scope = scope
+        loop = asyncio.get_running_loop()
+
+        def sync_send(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        with SpooledTemporaryFile(max_size=65536) as body:
+            while True:
+                message = await receive()
+                if message["type"] != "http.request":
+                    raise ValueError("WSGI wrapper received a non-HTTP-request message")
+                body.write(message.get("body", b""))
+                if not message.get("more_body"):
+                    break
+            body.seek(0)
+            await loop.run_in_executor(_wsgi_executor, self.run_wsgi_app, body, sync_send)
+
+    def run_wsgi_app(self, body, sync_send):
+        try:
+            environ = self.build_environ(self.scope, body)
+        except ValueError:
+            # Za dużo powtórzonych nagłówków
+            sync_send({"type": "http.response.start", "status": 400, "headers": [(b"content-type", b"text/plain")]})
+            sync_send({"type": "http.response.body", "body": b"Bad Request: Too many duplicate headers"})
+            return
+
+        bytes_sent = 0
+        output = self.wsgi_application(environ, self.start_response)
+        try:
+            for chunk in output:
+                if not self.response_started:
+                    self.response_started = True
+                    sync_send(self.response_start)
+                # Nie wysyłamy więcej, niż zapowiada Content-Length
+                if self.response_content_length is not None:
+                    chunk = chunk[:self.response_content_length - bytes_sent]
+                sync_send({"type": "http.response.body", "body": chunk, "more_body": True})
+                bytes_sent += len(chunk)
+                if bytes_sent == self.response_content_length:
+                    break
+        finally:
+            # Zamknięcie odpowiedzi WSGI (np. strumieni NDJSON/SSE) zwalnia ich zasoby
+            if hasattr(output, "close"):
+                output.close()
+
+        if not self.response_started:
+            self.response_started = True
+            sync_send(self.response_start)
+        sync_send({"type": "http.response.body"})
+
+
+class ThreadPoolWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi that handles requests concurrently on a pool of WSGI_THREADS threads."""
+
+    async def __call__(self, scope, receive, send):
+        await _ThreadPoolWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+async def _send_json(send, status: int, payload: dict, headers: list | None = None):
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *(headers or []),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AqiStream:
+    """ASGI middleware serving GET /aqi/stream as an async event stream; everything else goes to ``app``."""
+
+    path = "/aqi/stream"
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path or scope["method"] != "GET":
+            return await self.app(scope, receive, send)
+
+        query = parse_qs(scope["query_string"].decode())
+        try:
+            cells = parse_cells(query.get("points", [""])[0])
+        except ValueError as e:
+            return await _send_json(send, 400, {"message": str(e),
+                                                "example_usage": f"{self.path}?points=50.06,19.94;52.23,21.01"})
+
+        subscription = AsyncSubscription(cells)
+        try:
+            aqi_hub.subscribe(subscription)
+        except HubFull as e:
+            return await _send_json(send, 503, {"message": str(e)}, [(b"retry-after", b"5")])
+
+        async def close_on_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            subscription.close()
+
+        watcher = asyncio.ensure_future(close_on_disconnect())
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                            (b"access-control-allow-origin", b"*"),
+                            *((name.lower().encode(), value.encode()) for name, value in STREAM_HEADERS.items())],
+            })
+            async for chunk in subscription.events():
+                await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        except OSError:
+            # Klient rozłączył się w trakcie wysyłania
+            pass
+        finally:
+            watcher.cancel()
+            aqi_hub.unsubscribe(subscription)
+
+
+class InFlightLimit:
+    """ASGI middleware returning 503 as soon as more than ``limit`` HTTP requests are being handled."""
+
+    def __init__(self, app, limit: int = ASGI_MAX_IN_FLIGHT):
+        self.app = app
+        self.limit = limit
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        if self.in_flight >= self.limit:
+            await _send_json(send, 503, {"message": "Serwer jest przeciążony, spróbuj ponownie za chwilę."},
+                             [(b"retry-after", b"1")])
+            return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+
+class Lifespan:
+    """ASGI middleware starting the background jobs on lifespan startup; other scopes go to ``app``."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "lifespan":
+            return await self.app(scope, receive, send)
+
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    start_background_jobs()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+application = Lifespan(AqiStream(InFlightLimit(ThreadPoolWsgiToAsgi(app))))
@@ -0,0 +1,191 @@
+"""
+End-to-end load scenario replaying the map click from MapView.js.
+
+Each virtual user picks a point and fires /current-weather, /air-quality and
+/aqi in parallel (like the frontend's Promise.all), then waits ``--think-ms``
+and clicks again. Latency of the whole click and of each route is reported as
+p50/p95/p99 together with requests per second.
+
+By default the Open-Meteo stand-in and the API are started as subprocesses:
+
+    python -m benchmarks.load --users 50 --duration 30 --upstream-latency-ms 80
+
+Use ``--target`` to run against an already running server instead.
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CLICK_ROUTES = ["/current-weather", "/air-quality", "/aqi"]
+
+# Obszar, po którym "klikają" użytkownicy - domyślnie Polska
+DEFAULT_AREA = (54.9, 49.0, 24.2, 14.1)
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(name: str, latencies: list[float], elapsed: float) -> str:
+    values = sorted(latencies)
+    return (f"{name:<20}{len(values):>8}{len(values) / elapsed:>10.1f}"
+            f"{percentile(values, 0.50) * 1000:>10.1f}{percentile(values, 0.95) * 1000:>10.1f}"
+            f"{percentile(values, 0.99) * 1000:>10.1f}")
+
+
+class Results:
+    def __init__(self):
+        self.clicks = []
+        self.routes = {route: [] for route in CLICK_ROUTES}
+        self.errors = {}
+
+    def error(self, route: str, reason: str):
+        key = f"{route} {reason}"
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+
+async def _timed_get(client: httpx.AsyncClient, route: str, params: dict, results: Results):
+    started = time.perf_counter()
+    try:
+        response = await client.get(route, params=params)
+    except httpx.HTTPError as e:
+        results.error(route, type(e).__name__)
+        return
+    results.routes[route].append(time.perf_counter() - started)
+    if response.status_code != 200:
+        results.error(route, str(response.status_code))
+
+
+async def virtual_user(client: httpx.AsyncClient, deadline: float, area, think: float, results: Results):
+    north, south, east, west = area
+    while time.perf_counter() < deadline:
+        params = {"latitude": round(random.uniform(south, north), 4),
+                  "longitude": round(random.uniform(west, east), 4)}
+        started = time.perf_counter()
+        await asyncio.gather(*(_timed_get(client, route, params, results) for route in CLICK_ROUTES))
+        results.clicks.append(time.perf_counter() - started)
+        if think:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * think)
+
+
+async def run_load(target: str, users: int, duration: float, area, think: float) -> tuple[Results, float]:
+    results = Results()
+    limits = httpx.Limits(max_connections=users * len(CLICK_ROUTES), max_keepalive_connections=users * len(CLICK_ROUTES))
+    async with httpx.AsyncClient(base_url=target, limits=limits, timeout=30) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(virtual_user(client, deadline, area, think, results) for _ in range(users)))
+        elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+def _wait_until_up(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Serwer {url} nie wystartował w ciągu {timeout} s")
+
+
+def start_servers(args) -> list[subprocess.Popen]:
+    """Start the Open-Meteo stand-in and the API (uvicorn or the Flask dev server)."""
+    standin_url = f"http://127.0.0.1:{args.standin_port}"
+    standin = subprocess.Popen(
+        [sys.executable, "-m", "standins.open_meteo", "--port", str(args.standin_port),
+         "--latency-ms", str(args.upstream_latency_ms), "--jitter-ms", str(args.upstream_jitter_ms),
+         "--error-rate", str(args.upstream_error_rate)],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+    env = dict(os.environ)
+    env.update({
+        "OPEN_METEO_AIR_QUALITY_URL": f"{standin_url}/v1/air-quality",
+        "OPEN_METEO_FORECAST_URL": f"{standin_url}/v1/forecast",
+        # Każdy przebieg zaczyna z pustym cache, bez danych z poprzednich uruchomień
+        "OBSERVATION_STORE_PATH": "",
+        "SHARED_CACHE_PATH": os.path.join(tempfile.mkdtemp(prefix="load-"), "shared_cache.sqlite"),
+    })
+    if args.server == "uvicorn":
+        command = [sys.executable, "-m", "uvicorn", "asgi:application", "--port", str(args.port),
+                   "--workers", str(args.workers), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-c",
+                   f"import server; server.start_background_jobs(); server.app.run(port={args.port}, threaded=True)"]
+    api = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    processes = [standin, api]
+    try:
+        _wait_until_up(f"{standin_url}/v1/forecast?latitude=0&longitude=0")
+        _wait_until_up(f"http://127.0.0.1:{args.port}/swagger.json")
+    except RuntimeError:
+        stop_servers(processes)
+        raise
+    return processes
+
+
+def stop_servers(processes: list[subprocess.Popen]):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MapView click load test")
+    parser.add_argument("--target", help="base URL of a running API (default: start local servers)")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20, help="test duration in seconds")
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between clicks of one user")
+    parser.add_argument("--area", default=",".join(str(value) for value in DEFAULT_AREA),
+                        help="north,south,east,west area to click in")
+    parser.add_argument("--server", choices=["uvicorn", "flask"], default="uvicorn")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--port", type=int, default=5011)
+    parser.add_argument("--standin-port", type=int, default=5102)
+    parser.add_argument("--upstream-latency-ms", type=float, default=50)
+    parser.add_argument("--upstream-jitter-ms", type=float, default=50)
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    area = tuple(float(value) for value in args.area.split(","))
+
+    processes = [] if args.target else start_servers(args)
+    target = args.target or f"http://127.0.0.1:{args.port}"
+    try:
+        results, elapsed = asyncio.run(run_load(target, args.users, args.duration, area, args.think_ms / 1000))
+    finally:
+        stop_servers(processes)
+
+    print(f"{args.users} users, {elapsed:.1f} s against {target}")
+    print(f"{'':<20}{'count':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    print(summarize("click", results.clicks, elapsed))
+    for route, latencies in results.routes.items():
+        print(summarize(route, latencies, elapsed))
+    total = sum(len(latencies) for latencies in results.routes.values())
+    print(f"{'total requests':<20}{total:>8}{total / elapsed:>10.1f}")
+    for key, count in sorted(results.errors.items()):
+        print(f"error {key}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Micro-benchmarks for the AQI and heatmap hot paths.
+
+Upstream lookups are served by an in-process fake fetcher, so the numbers
+measure only our own code (cache lookup, AQI maths, interpolation):
+
+    python -m benchmarks.micro
+    python -m benchmarks.micro --repeat 7 --only heatmap
+"""
+import argparse
+import math
+import random
+import statistics
+import timeit
+from datetime import datetime, timezone
+
+from api_scripts.grid_cache import upstream_cache
+from prediction import neuralnetworkFRmock as model
+
+
+def fake_air_quality(latitude: float, longitude: float) -> dict:
+    """Deterministic stand-in for get_air_quality (no network)."""
+    spatial = math.sin(math.radians(latitude * 9)) * math.cos(math.radians(longitude * 7))
+    return {
+        "pm25": round(12 + 10 * spatial, 1),
+        "pm10": round(25 + 15 * spatial, 1),
+        "no2": round(20 + 15 * spatial, 1),
+        "so2": round(5 + 4 * spatial, 1),
+    }
+
+
+def fake_air_quality_forecast(latitude: float, longitude: float) -> dict:
+    """Deterministic stand-in for get_air_quality_forecast: the same values for every hour of the day."""
+    values = fake_air_quality(latitude, longitude)
+    day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    series = {"time": [f"{day}T{hour:02d}:00" for hour in range(24)]}
+    series.update((name, [value] * 24) for name, value in values.items())
+    return series
+
+
+def _use_fake_upstream():
+    model.get_air_quality_forecast = fake_air_quality_forecast
+    # Fałszywe wartości nie mogą trafić do plików współdzielonych z serwerem (cache workerów, magazyn obserwacji)
+    upstream_cache.shared = None
+    upstream_cache.store = None
+    upstream_cache.clear()
+
+
+def bench_calculate_sub_index():
+    pollutants = ["pm2.5", "pm10", "no2", "so2"]
+    samples = [(random.choice(pollutants), random.uniform(0, 400)) for _ in range(1000)]
+
+    def run():
+        for pollutant, concentration in samples:
+            model.calculate_sub_index(pollutant, concentration)
+
+    return run, len(samples)
+
+
+def bench_aqi_cached():
+    points = [(random.uniform(49, 55), random.uniform(14, 24)) for _ in range(1000)]
+    for point in points:
+        model.aqi(*point)
+
+    def run():
+        for point in points:
+            model.aqi(*point)
+
+    return run, len(points)
+
+
+def bench_aqi_from_air_data():
+    samples = [fake_air_quality(random.uniform(49, 55), random.uniform(14, 24)) for _ in range(1000)]
+
+    def run():
+        for air_data in samples:
+            model.aqi_from_air_data(air_data)
+
+    return run, len(samples)
+
+
+def _heatmap_bench(resolution: int):
+    def bench():
+        bbox = (54.9, 49.0, 24.2, 14.1)
+        model.generate_heatmap_data(*bbox, resolution=resolution)
+
+        def run():
+            model.generate_heatmap_data(*bbox, resolution=resolution)
+
+        return run, 1
+
+    return bench
+
+
+BENCHMARKS = {
+    "calculate_sub_index": bench_calculate_sub_index,
+    "aqi_from_air_data": bench_aqi_from_air_data,
+    "aqi_cached": bench_aqi_cached,
+    "heatmap_20": _heatmap_bench(20),
+    "heatmap_200": _heatmap_bench(200),
+}
+
+
+def run_benchmark(name: str, repeat: int, number: int) -> dict:
+    run, calls = BENCHMARKS[name]()
+    timings = timeit.repeat(run, repeat=repeat, number=number)
+    per_call = [timing / (number * calls) for timing in timings]
+    return {
+        "name": name,
+        "best_us": min(per_call) * 1e6,
+        "median_us": statistics.median(per_call) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AQI / heatmap micro-benchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=10, help="runs of each benchmark per repeat")
+    parser.add_argument("--only", help="run only benchmarks whose name contains this text")
+    args = parser.parse_args()
+
+    random.seed(0)
+    _use_fake_upstream()
+
+    print(f"{'benchmark':<24}{'best [µs/call]':>16}{'median [µs/call]':>18}")
+    for name in BENCHMARKS:
+        if args.only and args.only not in name:
+            continue
+        result = run_benchmark(name, args.repeat, args.number)
+        print(f"{result['name']:<24}{result['best_us']:>16.2f}{result['median_us']:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import bisect
+import math
+
+import numpy as np
+
+from prediction.aqi_tables import (AQI_BREAKPOINTS, AQI_CATEGORIES, AQI_CATEGORIES_EN, AQI_COMMENTS, AQI_COMMENTS_EN,
+                                   NO_DATA_LABELS, OUT_OF_SCALE_LABELS, POLLUTANT_BREAKPOINT_KEYS)
+
+# Kolejność osi zanieczyszczeń we wszystkich tablicach tego modułu
+POLLUTANTS = tuple(POLLUTANT_BREAKPOINT_KEYS)
+
+NO_DATA = -1
+
+# Tabele progów skompilowane raz do postaci (zanieczyszczenie, przedział)
+_C_LOW = np.array([[band[0] for band in AQI_BREAKPOINTS[POLLUTANT_BREAKPOINT_KEYS[p]]] for p in POLLUTANTS], dtype=np.float64)
+_C_HIGH = np.array([[band[1] for band in AQI_BREAKPOINTS[POLLUTANT_BREAKPOINT_KEYS[p]]] for p in POLLUTANTS], dtype=np.float64)
+_I_LOW = np.array([[band[2] for band in AQI_BREAKPOINTS[POLLUTANT_BREAKPOINT_KEYS[p]]] for p in POLLUTANTS], dtype=np.float64)
+_I_HIGH = np.array([[band[3] for band in AQI_BREAKPOINTS[POLLUTANT_BREAKPOINT_KEYS[p]]] for p in POLLUTANTS], dtype=np.float64)
+_SLOPE = (_I_HIGH - _I_LOW) / (_C_HIGH - _C_LOW)
+# Te same tabele jako listy dla pojedynczych wartości (bez narzutu numpy)
+_C_LOW_ROWS = _C_LOW.tolist()
+_C_TOP = _C_HIGH[:, -1].tolist()
+_I_LOW_ROWS = _I_LOW.tolist()
+_SLOPE_ROWS = _SLOPE.tolist()
+
+# Kody kategorii: indeksy w AQI_CATEGORIES, potem "Poza skalą" i "Brak danych"
+OUT_OF_SCALE = len(AQI_CATEGORIES)
+NO_DATA_CATEGORY = OUT_OF_SCALE + 1
+AQI_MAX = max(high for _, high in AQI_CATEGORIES)
+
+# Gęsta tablica AQI (0..AQI_MAX) -> kod kategorii, budowana raz przy imporcie
+CATEGORY_TABLE = np.full(AQI_MAX + 1, OUT_OF_SCALE, dtype=np.int8)
+for _code, (_low, _high) in enumerate(AQI_CATEGORIES):
+    CATEGORY_TABLE[_low:_high + 1] = _code
+_CATEGORY_TABLE_LIST = tuple(CATEGORY_TABLE.tolist())
+
+CATEGORY_RANGES = tuple(AQI_CATEGORIES) + (None, None)
+CATEGORY_STRINGS = {
+    "pl": {
+        "names": tuple(AQI_CATEGORIES.values()) + (OUT_OF_SCALE_LABELS["pl"], NO_DATA_LABELS["pl"]),
+        "comments": tuple(AQI_COMMENTS.values()) + (OUT_OF_SCALE_LABELS["pl"], NO_DATA_LABELS["pl"]),
+    },
+    "en": {
+        "names": tuple(AQI_CATEGORIES_EN.values()) + (OUT_OF_SCALE_LABELS["en"], NO_DATA_LABELS["en"]),
+        "comments": tuple(AQI_COMMENTS_EN.values()) + (OUT_OF_SCALE_LABELS["en"], NO_DATA_LABELS["en"]),
+    },
+}
+CATEGORY_NAMES = CATEGORY_STRINGS["pl"]["names"]
+CATEGORY_COMMENTS = CATEGORY_STRINGS["pl"]["comments"]
+
+
+def stack_concentrations(air_data_list: list[dict]) -> np.ndarray:
+    """
+    Build a (pollutants, locations) array from ``get_air_quality``-style dicts.
+    Missing values become NaN.
+    """
+    concentrations = np.full((len(POLLUTANTS), len(air_data_list)), np.nan)
+    for column, air_data in enumerate(air_data_list):
+        for row, pollutant in enumerate(POLLUTANTS):
+            value = air_data.get(pollutant)
+            if value is not None:
+                concentrations[row, column] = value
+    return concentrations
+
+
+def sub_indices(concentrations) -> np.ndarray:
+    """
+    Sub-index for every concentration in an array of shape (pollutants, ...).
+
+    The leading axis follows POLLUTANTS; any trailing axes (hours, locations)
+    are computed in one pass. NaN concentrations give NO_DATA.
+    """
+    concentrations = np.asarray(concentrations, dtype=np.float64)
+    flat = concentrations.reshape(len(POLLUTANTS), -1)
+    result = np.empty(flat.shape, dtype=np.int16)
+
+    for row in range(len(POLLUTANTS)):
+        values = flat[row]
+        band = np.searchsorted(_C_LOW[row], values, side="right") - 1
+        band = np.clip(band, 0, _C_LOW.shape[1] - 1)
+        index = _SLOPE[row, band] * (values - _C_LOW[row, band]) + _I_LOW[row, band]
+        index = np.where(values > _C_HIGH[row, -1], 500, np.ceil(np.clip(index, 0, 500)))
+        result[row] = np.where(np.isnan(values), NO_DATA, index)
+
+    return result.reshape(concentrations.shape)
+
+
+def sub_index(row: int, value: float | None) -> int:
+    """``sub_indices`` for one concentration of POLLUTANTS[row] (same bands, gap handling and rounding)."""
+    if value is None or math.isnan(value):
+        return NO_DATA
+    if value > _C_TOP[row]:
+        return 500
+    lows = _C_LOW_ROWS[row]
+    band = min(max(bisect.bisect_right(lows, value) - 1, 0), len(lows) - 1)
+    index = _SLOPE_ROWS[row][band] * (value - lows[band]) + _I_LOW_ROWS[row][band]
+    return math.ceil(min(max(index, 0.0), 500.0))
+
+
+def summarize(air_data: dict, codes_only: bool = False) -> dict:
+    """``describe(compute_aqi(...))`` for a single ``get_air_quality`` dict, without numpy overhead."""
+    indices = [sub_index(row, air_data.get(pollutant)) for row, pollutant in enumerate(POLLUTANTS)]
+    aqi_value = max(indices)
+    dominant = indices.index(aqi_value)
+    return describe(aqi_value, dominant, category_code(aqi_value), codes_only)
+
+
+def category_code(aqi_value: int) -> int:
+    """Category code of a single AQI value (index into CATEGORY_NAMES)."""
+    if 0 <= aqi_value <= AQI_MAX:
+        return _CATEGORY_TABLE_LIST[aqi_value]
+    return NO_DATA_CATEGORY if aqi_value == NO_DATA else OUT_OF_SCALE
+
+
+def category_codes(aqi_values) -> np.ndarray:
+    """Category code per AQI value (index into CATEGORY_NAMES)."""
+    aqi_values = np.asarray(aqi_values)
+    codes = CATEGORY_TABLE[np.clip(aqi_values, 0, AQI_MAX).astype(np.intp)]
+    codes = np.where((aqi_values < 0) | (aqi_values > AQI_MAX), np.int8(OUT_OF_SCALE), codes)
+    codes[aqi_values == NO_DATA] = NO_DATA_CATEGORY
+    return codes
+
+
+def compute_aqi(concentrations) -> dict:
+    """
+    AQI for an array of concentrations of shape (pollutants, ...).
+
+    Returns a dict of arrays shaped like the trailing axes: ``aqi`` (NO_DATA
+    where all pollutants are missing), ``dominant`` (index into POLLUTANTS)
+    and ``category`` (index into CATEGORY_NAMES).
+    """
+    indices = sub_indices(concentrations)
+    dominant = indices.argmax(axis=0)
+    aqi_values = indices.max(axis=0)
+    return {
+        "aqi": aqi_values,
+        "dominant": dominant,
+        "category": category_codes(aqi_values),
+    }
+
+
+def describe(aqi_value: int, dominant: int, category: int, codes_only: bool = False) -> dict:
+    """
+    Turn one element of ``compute_aqi`` output into the dict returned by ``aqi()``.
+    With ``codes_only`` the category and comment strings are left out (see ``categories``).
+    """
+    if aqi_value == NO_DATA:
+        summary = {"aqi": 0, "category": CATEGORY_NAMES[NO_DATA_CATEGORY], "category_code": NO_DATA_CATEGORY,
+                   "dominant_pollutant": None}
+    else:
+        summary = {
+            "aqi": int(aqi_value),
+            "category": CATEGORY_NAMES[category],
+            "category_code": int(category),
+            "comment": CATEGORY_COMMENTS[category],
+            "dominant_pollutant": POLLUTANTS[int(dominant)],
+        }
+    if codes_only:
+        summary.pop("category")
+        summary.pop("comment", None)
+    return summary
+
+
+def describe_all(result: dict, codes_only: bool = False) -> list[dict]:
+    """``describe`` for every element of a 1-D ``compute_aqi`` result."""
+    return [
+        describe(aqi_value, dominant, category, codes_only)
+        for aqi_value, dominant, category in zip(
+            result["aqi"].tolist(), result["dominant"].tolist(), result["category"].tolist()
+        )
+    ]
+
+
+def categories(lang: str | None = None) -> list[dict]:
+    """
+    All category codes with their AQI range and localized name and comment,
+    in every language or only ``lang``. Served once by /aqi/categories so that
+    responses can carry just ``category_code``.
+    """
+    languages = [lang] if lang else list(CATEGORY_STRINGS)
+    described = []
+    for code, aqi_range in enumerate(CATEGORY_RANGES):
+        described.append({
+            "code": code,
+            "aqi_min": aqi_range[0] if aqi_range else None,
+            "aqi_max": aqi_range[1] if aqi_range else None,
+            "name": {language: CATEGORY_STRINGS[language]["names"][code] for language in languages},
+            "comment": {language: CATEGORY_STRINGS[language]["comments"][code] for language in languages},
+        })
+    return described
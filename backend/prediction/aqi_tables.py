@@ -0,0 +1,82 @@
+AQI_BREAKPOINTS = {
+    "pm2.5": [
+        (0.0, 12.0, 0, 50),
+        (12.1, 35.4, 51, 100),
+        (35.5, 55.4, 101, 150),
+        (55.5, 150.4, 151, 200),
+        (150.5, 250.4, 201, 300),
+        (250.5, 500.4, 301, 500),
+    ],
+    "pm10": [
+        (0, 54, 0, 50),
+        (55, 154, 51, 100),
+        (155, 254, 101, 150),
+        (255, 354, 151, 200),
+        (355, 424, 201, 300),
+        (425, 604, 301, 500),
+    ],
+    "no2": [
+        (0, 53, 0, 50),
+        (54, 100, 51, 100),
+        (101, 360, 101, 150),
+        (361, 649, 151, 200),
+        (650, 1249, 201, 300),
+        (1250, 2049, 301, 500),
+    ],
+    "so2": [
+        (0, 35, 0, 50),
+        (36, 75, 51, 100),
+        (76, 185, 101, 150),
+        (186, 304, 151, 200),
+        (305, 604, 201, 300),
+        (605, 1004, 301, 500),
+    ],
+}
+
+AQI_CATEGORIES = {
+    (0, 50): "Dobra",
+    (51, 100): "Umiarkowana",
+    (101, 150): "Niezdrowa dla grup wrażliwych",
+    (151, 200): "Niezdrowa",
+    (201, 300): "Bardzo niezdrowa",
+    (301, 500): "Niebezpieczna",
+}
+
+AQI_COMMENTS = {
+    (0, 50): "Jakość powietrza jest zadowalająca. Możesz bez obaw spędzać czas na zewnątrz.",
+    (51, 100): "Jakość powietrza jest akceptowalna. Osoby bardzo wrażliwe powinny rozważyć ograniczenie dłuższego wysiłku na zewnątrz.",
+    (101, 150): "Osoby z grup wrażliwych (dzieci, osoby starsze, osoby z chorobami serca i płuc) mogą odczuwać negatywne skutki zdrowotne. Powinny unikać długotrwałej aktywności na zewnątrz.",
+    (151, 200): "Każdy może zacząć odczuwać skutki zdrowotne. Grupy wrażliwe mogą doświadczać poważniejszych problemów. Ogranicz wysiłek na świeżym powietrzu.",
+    (201, 300): "Ostrzeżenie zdrowotne: każdy może doświadczyć poważniejszych skutków zdrowotnych. Zaleca się unikanie wszelkiej aktywności na zewnątrz.",
+    (301, 500): "Zagrożenie dla zdrowia: cała populacja jest narażona na poważne skutki zdrowotne. Pozostań w domu i ogranicz aktywność do minimum.",
+}
+
+AQI_CATEGORIES_EN = {
+    (0, 50): "Good",
+    (51, 100): "Moderate",
+    (101, 150): "Unhealthy for sensitive groups",
+    (151, 200): "Unhealthy",
+    (201, 300): "Very unhealthy",
+    (301, 500): "Hazardous",
+}
+
+AQI_COMMENTS_EN = {
+    (0, 50): "Air quality is satisfactory. You can spend time outdoors without concern.",
+    (51, 100): "Air quality is acceptable. Unusually sensitive people should consider limiting prolonged outdoor exertion.",
+    (101, 150): "Sensitive groups (children, older adults, people with heart or lung disease) may experience health effects. They should avoid prolonged outdoor activity.",
+    (151, 200): "Everyone may begin to experience health effects. Sensitive groups may experience more serious effects. Limit outdoor exertion.",
+    (201, 300): "Health alert: everyone may experience more serious health effects. Avoid all outdoor activity.",
+    (301, 500): "Health emergency: the entire population is likely to be affected. Stay indoors and keep activity to a minimum.",
+}
+
+# Etykiety kategorii spoza przedziałów AQI_CATEGORIES
+OUT_OF_SCALE_LABELS = {"pl": "Poza skalą", "en": "Beyond the index"}
+NO_DATA_LABELS = {"pl": "Brak danych", "en": "No data"}
+
+# Klucze zwracane przez get_air_quality -> nazwy zanieczyszczeń w AQI_BREAKPOINTS
+POLLUTANT_BREAKPOINT_KEYS = {
+    "pm25": "pm2.5",
+    "pm10": "pm10",
+    "no2": "no2",
+    "so2": "so2",
+}
@@ -0,0 +1,89 @@
+"""
+Compact encodings of regular heatmap grids and columnar batch results.
+
+A grid is sent as its origin (south-west cell), step and shape plus one packed
+array of intensities instead of ``[lat, lon, intensity]`` triples:
+
+- ``uint8``: ``value = offset + q * scale`` for q in 0..254, 255 means no data
+- ``float16``: values as IEEE half floats, NaN means no data
+
+Raw binary layout (little-endian): a 52-byte header
+``magic "HMAP", version u8, dtype u8 (1 = uint8, 2 = float16), rows u16,
+cols u16, 2 bytes padding, south f64, west f64, lat_step f64, lon_step f64,
+offset f32, scale f32``, followed by rows x cols values, row 0 = south.
+"""
+import struct
+
+import msgpack
+import numpy as np
+
+BINARY_MAGIC = b"HMAP"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sBBHH2x4d2f")
+
+DTYPE_CODES = {"uint8": 1, "float16": 2}
+UINT8_NO_DATA = 255
+UINT8_LEVELS = 254
+
+
+def pack_grid(grid_lats, grid_lons, values, dtype: str = "uint8") -> dict:
+    """Describe a regular grid by origin, step and shape with a packed value array."""
+    grid_lats = np.asarray(grid_lats, dtype=np.float64)
+    grid_lons = np.asarray(grid_lons, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float32)
+    rows, cols = values.shape
+
+    packed = {
+        "origin": [float(grid_lats[0]), float(grid_lons[0])],
+        "step": [
+            float(grid_lats[-1] - grid_lats[0]) / (rows - 1) if rows > 1 else 0.0,
+            float(grid_lons[-1] - grid_lons[0]) / (cols - 1) if cols > 1 else 0.0,
+        ],
+        "shape": [rows, cols],
+        "dtype": dtype,
+        "offset": 0.0,
+        "scale": 1.0,
+    }
+
+    if dtype == "float16":
+        packed["values"] = values.astype("<f2")
+        return packed
+
+    # Kwantyzacja liniowa do 255 poziomów w zakresie danych - błąd co najwyżej scale / 2
+    finite = values[np.isfinite(values)]
+    offset = float(finite.min()) if finite.size else 0.0
+    span = float(finite.max()) - offset if finite.size else 0.0
+    scale = span / UINT8_LEVELS if span > 0 else 1.0
+    with np.errstate(invalid="ignore"):
+        quantized = np.clip(np.rint((values - offset) / scale), 0, UINT8_LEVELS)
+    quantized[~np.isfinite(values)] = UINT8_NO_DATA
+
+    packed.update(offset=offset, scale=scale, nodata=UINT8_NO_DATA, values=quantized.astype(np.uint8))
+    return packed
+
+
+def grid_to_msgpack(packed: dict) -> bytes:
+    return msgpack.packb({**packed, "values": packed["values"].tobytes()}, use_bin_type=True)
+
+
+def grid_to_binary(packed: dict) -> bytes:
+    rows, cols = packed["shape"]
+    header = BINARY_HEADER.pack(
+        BINARY_MAGIC, BINARY_VERSION, DTYPE_CODES[packed["dtype"]], rows, cols,
+        *packed["origin"], *packed["step"], packed["offset"], packed["scale"],
+    )
+    return header + packed["values"].tobytes()
+
+
+def columns(results: list[dict]) -> dict:
+    """Turn a list of result dicts into ``{field: [values...]}`` (None where a result lacks the field)."""
+    names = []
+    for result in results:
+        for name in result:
+            if name not in names:
+                names.append(name)
+    return {name: [result.get(name) for result in results] for name in names}
+
+
+def columns_to_msgpack(results: list[dict]) -> bytes:
+    return msgpack.packb({"count": len(results), "columns": columns(results)}, use_bin_type=True)
@@ -0,0 +1,87 @@
+import math
+import os
+
+import numpy as np
+
+from api_scripts.grid_cache import GRID_STEP, snap_to_grid
+
+# Rozdzielczość modelu CAMS w Open-Meteo to ~0.1° (Europa) - gęstsze próbkowanie nic nie wnosi
+MIN_ANCHOR_SPACING = float(os.environ.get("HEATMAP_MIN_ANCHOR_SPACING", "0.1"))
+MAX_ANCHORS_PER_AXIS = int(os.environ.get("HEATMAP_MAX_ANCHORS_PER_AXIS", "8"))
+
+DEFAULT_RESOLUTION = 20
+MAX_RESOLUTION = 200
+
+IDW_POWER = 2
+
+
+def anchor_points(north: float, south: float, east: float, west: float) -> list[tuple[float, float]]:
+    """
+    Rzadka siatka punktów kotwiczących dla obszaru (nie gęściej niż MIN_ANCHOR_SPACING, najwyżej
+    MAX_ANCHORS_PER_AXIS na oś), przyciągnięta do siatki cache - sąsiednie widoki używają tych samych wpisów.
+    """
+    lat_count = _anchor_count(north - south)
+    lon_count = _anchor_count(east - west)
+
+    anchors = set()
+    for lat in np.linspace(south, north, lat_count):
+        for lon in np.linspace(west, east, lon_count):
+            anchors.add(snap_to_grid(float(lat), float(lon), GRID_STEP))
+    return sorted(anchors)
+
+
+def _anchor_count(span: float) -> int:
+    count = math.ceil(abs(span) / MIN_ANCHOR_SPACING) + 1
+    return max(2, min(MAX_ANCHORS_PER_AXIS, count))
+
+
+def idw_grid(anchor_lats, anchor_lons, anchor_values, grid_lats, grid_lons, power: int = IDW_POWER) -> np.ndarray:
+    """
+    Interpolacja IDW wartości kotwic na siatkę (len(grid_lats), len(grid_lons)). Dla ``anchor_values``
+    o kształcie (kotwice, k) każda z k serii jest liczona z własnych kotwic bez NaN (dodatkowa oś na końcu).
+    """
+    anchor_lats = np.asarray(anchor_lats, dtype=np.float32)
+    anchor_lons = np.asarray(anchor_lons, dtype=np.float32)
+    anchor_values = np.asarray(anchor_values, dtype=np.float32)
+    grid_lats = np.asarray(grid_lats, dtype=np.float32)
+    grid_lons = np.asarray(grid_lons, dtype=np.float32)
+
+    lon_scale = np.float32(math.cos(math.radians(float(grid_lats.mean()))))
+
+    # (rows, anchors) i (cols, anchors) - pełna macierz odległości składana przez broadcasting
+    dlat2 = np.square(grid_lats[:, None] - anchor_lats[None, :])
+    dlon2 = np.square((grid_lons[:, None] - anchor_lons[None, :]) * lon_scale)
+    dist2 = dlat2[:, None, :] + dlon2[None, :, :]
+
+    if power == 2:
+        weights = 1.0 / np.maximum(dist2, np.float32(1e-12))
+    else:
+        weights = 1.0 / np.maximum(dist2, np.float32(1e-12)) ** (power / 2)
+
+    if anchor_values.ndim == 1:
+        return (weights @ anchor_values) / weights.sum(axis=-1)
+
+    known = ~np.isnan(anchor_values)
+    with np.errstate(invalid="ignore"):
+        return (weights @ np.where(known, anchor_values, 0)) / (weights @ known.astype(np.float32))
+
+
+def grid_axes(north: float, south: float, east: float, west: float, resolution: int) -> tuple[np.ndarray, np.ndarray]:
+    # Osie w float64 - współrzędne trafiają do odpowiedzi (49.9, nie 49.900001525878906); float32 tylko dla wartości
+    lats = np.linspace(south, north, resolution, dtype=np.float64)
+    lons = np.linspace(west, east, resolution, dtype=np.float64)
+    return lats, lons
+
+
+def empty_grid(resolution: int) -> np.ndarray:
+    """Siatka bez danych (same NaN)"""
+    return np.full((resolution, resolution), np.nan, dtype=np.float32)
+
+
+def to_points(grid_lats: np.ndarray, grid_lons: np.ndarray, values: np.ndarray) -> list[list[float]]:
+    """Siatka jako punkty [lat, lon, intensywność] dla /heatmap-data, bez komórek NaN (intensywność do 2 miejsc)"""
+    lat_mesh, lon_mesh = np.meshgrid(grid_lats, grid_lons, indexing="ij")
+    intensity = np.round(np.maximum(values, 0).astype(np.float64), 2)
+    points = np.stack([lat_mesh.ravel(), lon_mesh.ravel(), intensity.ravel()], axis=1)
+    points = points[~np.isnan(points[:, 2])]
+    return points.astype(float).tolist()
@@ -1,150 +1,329 @@
+import bisect
+import hashlib
 import math
-import random
-from api_scripts.api_airQuality import get_air_quality
+import os
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from api_scripts.api_airQuality import current_air_quality, get_air_quality_forecast, get_air_quality_forecast_batch
 from api_scripts.api_currentWeather import get_current_weather
+from api_scripts.grid_cache import snap_to_grid, upstream_cache
+from api_scripts import metrics
+from prediction import aqi_arrays, heatmap
+from prediction.stations import station_layer
+from prediction.aqi_tables import POLLUTANT_BREAKPOINT_KEYS
 
-AQI_BREAKPOINTS = {
-    "pm2.5": [
-        (0.0, 12.0, 0, 50),
-        (12.1, 35.4, 51, 100),
-        (35.5, 55.4, 101, 150),
-        (55.5, 150.4, 151, 200),
-        (150.5, 250.4, 201, 300),
-        (250.5, 500.4, 301, 500),
-    ],
-    "pm10": [
-        (0, 54, 0, 50),
-        (55, 154, 51, 100),
-        (155, 254, 101, 150),
-        (255, 354, 151, 200),
-        (355, 424, 201, 300),
-        (425, 604, 301, 500),
-    ],
-    "no2": [
-        (0, 53, 0, 50),
-        (54, 100, 51, 100),
-        (101, 360, 101, 150),
-        (361, 649, 151, 200),
-        (650, 1249, 201, 300),
-        (1250, 2049, 301, 500),
-    ],
-    "so2": [
-        (0, 35, 0, 50),
-        (36, 75, 51, 100),
-        (76, 185, 101, 150),
-        (186, 304, 151, 200),
-        (305, 604, 201, 300),
-        (605, 1004, 301, 500),
-    ],
-}
-
-AQI_CATEGORIES = {
-    (0, 50): "Dobra",
-    (51, 100): "Umiarkowana",
-    (101, 150): "Niezdrowa dla grup wrażliwych",
-    (151, 200): "Niezdrowa",
-    (201, 300): "Bardzo niezdrowa",
-    (301, 500): "Niebezpieczna",
-}
-
-AQI_COMMENTS = {
-    (0, 50): "Jakość powietrza jest zadowalająca. Możesz bez obaw spędzać czas na zewnątrz.",
-    (51, 100): "Jakość powietrza jest akceptowalna. Osoby bardzo wrażliwe powinny rozważyć ograniczenie dłuższego wysiłku na zewnątrz.",
-    (101, 150): "Osoby z grup wrażliwych (dzieci, osoby starsze, osoby z chorobami serca i płuc) mogą odczuwać negatywne skutki zdrowotne. Powinny unikać długotrwałej aktywności na zewnątrz.",
-    (151, 200): "Każdy może zacząć odczuwać skutki zdrowotne. Grupy wrażliwe mogą doświadczać poważniejszych problemów. Ogranicz wysiłek na świeżym powietrzu.",
-    (201, 300): "Ostrzeżenie zdrowotne: każdy może doświadczyć poważniejszych skutków zdrowotnych. Zaleca się unikanie wszelkiej aktywności na zewnątrz.",
-    (301, 500): "Zagrożenie dla zdrowia: cała populacja jest narażona na poważne skutki zdrowotne. Pozostań w domu i ogranicz aktywność do minimum.",
-}
 
 def air_quality(latitude: float, longitude: float) :
-    result = get_air_quality(latitude, longitude)
+    result = upstream_cache.get_or_fetch("air_quality", latitude, longitude, _current_air_quality)
     return result
 
+def air_quality_series(latitude: float, longitude: float) -> dict | None:
+    """Godzinowa seria stężeń dla komórki z bieżącej godziny - jedno zapytanie do Open-Meteo na komórkę i godzinę."""
+    key = upstream_cache.key_for("air_quality_forecast", latitude, longitude)
+    return upstream_cache.get_or_fetch_key(key, get_air_quality_forecast)
+
+def _current_air_quality(latitude: float, longitude: float) -> dict | None:
+    # Bieżące stężenia to bieżąca godzina UTC z tej samej serii, z której korzysta prognoza
+    series = air_quality_series(latitude, longitude)
+    if not series or not series["time"]:
+        return None
+    return current_air_quality(series)
+
+def fetch_air_quality_batch(coordinates: list[tuple[float, float]]) -> list[dict | None]:
+    """
+    Bieżące stężenia dla wielu komórek jednym zapytaniem do Open-Meteo. Pobrane serie
+    trafiają do cache prognozy, więc /aqi/forecast dla tych komórek nie pyta upstreamu ponownie.
+    """
+    results = []
+    for (latitude, longitude), series in zip(coordinates, get_air_quality_forecast_batch(coordinates)):
+        if not series or not series["time"]:
+            results.append(None)
+            continue
+        upstream_cache.remember(upstream_cache.key_for("air_quality_forecast", latitude, longitude), series)
+        results.append(current_air_quality(series))
+    return results
+
 def current_weather(latitude: float, longitude: float) :
-    result = get_current_weather(latitude, longitude)
+    result = upstream_cache.get_or_fetch("current_weather", latitude, longitude, get_current_weather)
     return result
 
 
 def calculate_sub_index(pollutant_name: str, concentration: float) -> int:
-    if pollutant_name not in AQI_BREAKPOINTS:
-        return 0
-
-    for c_low, c_high, i_low, i_high in AQI_BREAKPOINTS[pollutant_name]:
-        if c_low <= concentration <= c_high:
-            index = ((i_high - i_low) / (c_high - c_low)) * (concentration - c_low) + i_low
-            return math.ceil(index)
-    return 500
+    """Subindeks dla jednego stężenia - ta sama implementacja co aqi_arrays.sub_indices (bez luk między progami)."""
+    for row, pollutant in enumerate(aqi_arrays.POLLUTANTS):
+        if POLLUTANT_BREAKPOINT_KEYS[pollutant] == pollutant_name:
+            return aqi_arrays.sub_index(row, concentration)
+    return 0
 
 
 def get_aqi_category(index_value: int) -> str:
-    for (low, high), category in AQI_CATEGORIES.items():
-        if low <= index_value <= high:
-            return category
-    return "Poza skalą"
+    return aqi_arrays.CATEGORY_NAMES[aqi_arrays.category_code(index_value)]
 
 def get_aqi_comment(index_value: int) -> str:
-    for (low, high), category in AQI_COMMENTS.items():
-        if low <= index_value <= high:
-            return category
-    return "Poza skalą"
-
-def aqi(latitude: float, longitude: float) -> dict:
-    air_data = air_quality(latitude, longitude)
-
-    sub_indices = {}
-
-    for pollutant, concentration in air_data.items():
-        if pollutant in AQI_BREAKPOINTS:
-            sub_index = calculate_sub_index(pollutant, concentration)
-            sub_indices[pollutant] = sub_index
-
-    if not sub_indices:
-        return {"aqi": 0, "category": "Brak danych", "dominant_pollutant": None}
+    return aqi_arrays.CATEGORY_COMMENTS[aqi_arrays.category_code(index_value)]
+
+def aqi(latitude: float, longitude: float, codes_only: bool = False, air_data: dict | None = None) -> dict:
+    """AQI dla punktu; ``air_data`` pozwala podać dane już pobrane dla tej komórki (np. do ETagu)."""
+    if air_data is None:
+        air_data = air_quality(latitude, longitude)
+    if air_data is None:
+        return {"error": "Błąd pobierania danych"}
+    # Korekta stacjami w środku komórki siatki - cała komórka ma ten sam wynik (i ETag)
+    cell_lat, cell_lon = snap_to_grid(latitude, longitude, upstream_cache.step)
+    with metrics.stage("aqi"):
+        return aqi_from_air_data(station_layer.blend_air_data(cell_lat, cell_lon, air_data), codes_only)
+
+def aqi_from_air_data(air_data: dict, codes_only: bool = False) -> dict:
+    """
+    AQI ze stężeń zwróconych przez get_air_quality. Przy `codes_only` odpowiedź zawiera tylko
+    `category_code` - nazwy i komentarze kategorii udostępnia /aqi/categories.
+    """
+    # Jedna implementacja AQI dla pojedynczych punktów i tablic (batch, heatmapa, prognoza)
+    result = aqi_arrays.summarize(air_data, codes_only)
+    # Dane z cache zwrócone podczas awarii upstreamu
+    if air_data.get("stale"):
+        result["stale"] = True
+        result["observed_at"] = air_data.get("observed_at")
+    # Udział odczytów pobliskich stacji OpenAQ w stężeniach (prediction/stations.py)
+    if air_data.get("station_weight"):
+        result["station_weight"] = air_data["station_weight"]
+    return result
 
-    dominant_pollutant = max(sub_indices, key=sub_indices.get)
-    final_aqi = sub_indices[dominant_pollutant]
+FORECAST_MAX_HOURS = 120
 
-    category = get_aqi_category(final_aqi)
-    comment = get_aqi_comment(final_aqi)
+def _forecast_series(latitude: float, longitude: float, hours: int) -> tuple[list, np.ndarray] | None:
+    """
+    Godzinowa prognoza z cache (ta sama seria, z której pochodzą bieżące stężenia),
+    przycięta do `hours` godzin od bieżącej godziny UTC.
+    Zwraca (czasy, tablica stężeń o kształcie (zanieczyszczenia, godziny)).
+    """
+    series = upstream_cache.get_or_fetch("air_quality_forecast", latitude, longitude, get_air_quality_forecast)
+    if series is None:
+        return None
+
+    current_hour = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:00")
+    start = bisect.bisect_left(series["time"], current_hour)
+    window = slice(start, start + hours)
+
+    times = series["time"][window]
+    concentrations = np.array([series[pollutant][window] for pollutant in aqi_arrays.POLLUTANTS], dtype=np.float64)
+    return times, concentrations
+
+def _blocks(values: np.ndarray, step: int, fill) -> np.ndarray:
+    """Dzieli ostatnią oś na bloki po `step` godzin (ostatni blok dopełniony wartością `fill`)."""
+    padding = (-values.shape[-1]) % step
+    if padding:
+        pad_width = [(0, 0)] * (values.ndim - 1) + [(0, padding)]
+        values = np.pad(values, pad_width, constant_values=fill)
+    return values.reshape(values.shape[:-1] + (-1, step))
+
+def _json_floats(values: np.ndarray) -> list:
+    return [None if math.isnan(value) else round(value, 2) for value in values.tolist()]
+
+def air_quality_forecast(latitude: float, longitude: float, hours: int = 24, step: int = 1) -> dict:
+    """
+    Prognoza stężeń na kolejne `hours` godzin w postaci kolumnowej.
+    Przy `step` > 1 wartości są uśredniane w blokach po `step` godzin.
+    """
+    forecast = _forecast_series(latitude, longitude, hours)
+    if forecast is None:
+        return {"error": "Nie udało się pobrać prognozy jakości powietrza."}
+    times, concentrations = forecast
+
+    if step > 1:
+        blocks = _blocks(concentrations, step, np.nan)
+        counts = (~np.isnan(blocks)).sum(axis=-1)
+        sums = np.nansum(blocks, axis=-1)
+        concentrations = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+        times = times[::step]
+
+    result = {"time": times, "step_hours": step}
+    for row, pollutant in enumerate(aqi_arrays.POLLUTANTS):
+        result[pollutant] = _json_floats(concentrations[row])
+    return result
 
-    return {
-        "aqi": final_aqi,
-        "category": category,
-        "comment": comment,
-        "dominant_pollutant": dominant_pollutant,
+def aqi_forecast(latitude: float, longitude: float, hours: int = 24, step: int = 1, codes_only: bool = False) -> dict:
+    """
+    Prognoza AQI na kolejne `hours` godzin w postaci kolumnowej.
+    Przy `step` > 1 dla każdego bloku zwracana jest najgorsza godzina.
+    """
+    forecast = _forecast_series(latitude, longitude, hours)
+    if forecast is None:
+        return {"error": "Nie udało się pobrać prognozy jakości powietrza."}
+    times, concentrations = forecast
+
+    result = aqi_arrays.compute_aqi(concentrations)
+    aqi_values, dominant, category = result["aqi"], result["dominant"], result["category"]
+
+    if step > 1:
+        worst = _blocks(aqi_values, step, aqi_arrays.NO_DATA - 1).argmax(axis=-1)
+        picked = np.arange(len(worst)) * step + worst
+        aqi_values, dominant, category = aqi_values[picked], dominant[picked], category[picked]
+        times = times[::step]
+
+    no_data = aqi_values == aqi_arrays.NO_DATA
+    codes = category.tolist()
+    result = {
+        "time": times,
+        "step_hours": step,
+        "aqi": [None if missing else value for value, missing in zip(aqi_values.tolist(), no_data.tolist())],
+        "dominant_pollutant": [None if missing else aqi_arrays.POLLUTANTS[index]
+                               for index, missing in zip(dominant.tolist(), no_data.tolist())],
+        "category_code": codes,
     }
+    if not codes_only:
+        result["category"] = [aqi_arrays.CATEGORY_NAMES[code] for code in codes]
+    return result
 
-def generate_heatmap_data(north, south, east, west):
+# Pula wątków do równoległych zapytań do Open-Meteo (prognoza + jakość powietrza)
+_upstream_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="upstream")
+
+def location_snapshot(latitude: float, longitude: float, codes_only: bool = False) -> dict:
     """
-    Generuje symulowane dane dla heatmapy w danym obszarze.
-    Pobiera prawdziwy wskaźnik AQI dla centrum mapy, a resztę punktów losuje.
+    Zwraca pogodę, stężenia zanieczyszczeń i AQI dla jednego punktu.
+    Oba zapytania do Open-Meteo idą równolegle, a AQI liczone jest z tych samych danych.
     """
-    center_lat = (north + south) / 2
-    center_lon = (east + west) / 2
-
+    weather_future = _upstream_executor.submit(current_weather, latitude, longitude)
+    air_future = _upstream_executor.submit(air_quality, latitude, longitude)
 
-    try:
-        center_aqi_data = aqi(center_lat, center_lon)
-        base_aqi = center_aqi_data.get("aqi", 50)
-    except Exception:
-        base_aqi = 50
+    weather_data = weather_future.result()
+    air_data = air_future.result()
 
-    heatmap_points = []
+    if weather_data is None and air_data is None:
+        return {"error": "Nie udało się pobrać danych dla tej lokalizacji."}
 
-    lat_step = (north - south) / 20
-    lon_step = (east - west) / 20
+    cell_lat, cell_lon = snap_to_grid(latitude, longitude, upstream_cache.step)
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "weather": weather_data,
+        "air_quality": air_data,
+        "aqi": (aqi_from_air_data(station_layer.blend_air_data(cell_lat, cell_lon, air_data), codes_only)
+                if air_data is not None else None),
+    }
 
-    for i in range(20):
-        for j in range(20):
-            lat = south + i * lat_step
-            lon = west + j * lon_step
+BATCH_CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", "100"))
 
-            intensity = base_aqi + random.uniform(-15, 15)
-            intensity = max(0, intensity)
+def aqi_batch(points: list[tuple[float, float]], codes_only: bool = False):
+    """
+    Liczy AQI dla wielu punktów naraz. Punkty są przyciągane do siatki cache i deduplikowane,
+    brakujące komórki pobierane są z Open-Meteo w paczkach (zapytania wielolokalizacyjne), równolegle.
 
-            heatmap_points.append([lat, lon, intensity])
+    Generator zwraca słowniki z polem "index" (pozycja punktu w wejściu) w kolejności,
+    w jakiej dane stają się dostępne.
+    """
+    cells = {}
+    for index, (latitude, longitude) in enumerate(points):
+        key = upstream_cache.key_for("air_quality", latitude, longitude)
+        cells.setdefault(key, []).append(index)
+
+    def results_for(keys, air_data_list):
+        available = [(key, air_data) for key, air_data in zip(keys, air_data_list) if air_data is not None]
+        concentrations, station_weights = station_layer.blend(
+            [key[1] for key, _ in available], [key[2] for key, _ in available],
+            aqi_arrays.stack_concentrations([air_data for _, air_data in available]))
+        summaries = aqi_arrays.describe_all(aqi_arrays.compute_aqi(concentrations), codes_only)
+        for summary, station_weight in zip(summaries, station_weights.tolist()):
+            if station_weight > 0:
+                summary["station_weight"] = round(station_weight, 3)
+        described = iter(summaries)
+
+        for key, air_data in zip(keys, air_data_list):
+            _, cell_lat, cell_lon, _ = key
+            summary = next(described) if air_data is not None else None
+            for index in cells[key]:
+                latitude, longitude = points[index]
+                if summary is None:
+                    yield {"index": index, "latitude": latitude, "longitude": longitude,
+                           "error": "Błąd pobierania danych"}
+                else:
+                    yield {"index": index, "latitude": latitude, "longitude": longitude,
+                           "cell": [cell_lat, cell_lon], **summary}
+
+    cached_keys, cached_data, missing = [], [], []
+    for key in cells:
+        air_data = upstream_cache.lookup(key)
+        if air_data is None:
+            missing.append(key)
+        else:
+            cached_keys.append(key)
+            cached_data.append(air_data)
+    yield from results_for(cached_keys, cached_data)
+
+    def fetch_chunk(chunk):
+        air_data_list = fetch_air_quality_batch([(key[1], key[2]) for key in chunk])
+        for key, air_data in zip(chunk, air_data_list):
+            if air_data is not None:
+                upstream_cache.remember(key, air_data)
+        return chunk, air_data_list
+
+    chunks = [missing[i:i + BATCH_CHUNK_SIZE] for i in range(0, len(missing), BATCH_CHUNK_SIZE)]
+    futures = [_upstream_executor.submit(fetch_chunk, chunk) for chunk in chunks]
+    for future in as_completed(futures):
+        yield from results_for(*future.result())
+
+def heatmap_anchor_data(north, south, east, west) -> list[tuple[tuple[float, float], dict | None]]:
+    """Punkty kotwiczące heatmapy dla obszaru z ich danymi (równolegle, przez cache)."""
+    anchors = heatmap.anchor_points(north, south, east, west)
+    return list(zip(anchors, _upstream_executor.map(lambda anchor: air_quality(*anchor), anchors)))
+
+def anchor_data_version(anchor_data) -> str | None:
+    """
+    Skrót danych kotwic i migawki stacji, z których powstanie heatmapa - ta sama wersja
+    daje tę samą siatkę. None, gdy brak danych albo któraś kotwica jest nieaktualna (stale).
+    """
+    if not any(air_data is not None for _, air_data in anchor_data):
+        return None
+    if any(air_data is not None and air_data.get("stale") for _, air_data in anchor_data):
+        return None
+    return hashlib.sha1(repr((anchor_data, station_layer.version())).encode()).hexdigest()
 
-    return heatmap_points
+def heatmap_grid(north, south, east, west, resolution: int = heatmap.DEFAULT_RESOLUTION, anchor_data=None):
+    """
+    Siatka AQI resolution x resolution dla obszaru: (szerokości, długości, wartości).
+    Pobiera prawdziwe AQI w rzadkiej siatce punktów kotwiczących (równolegle, przez cache),
+    a następnie interpoluje je metodą IDW. Zwraca None, gdy brak danych dla wszystkich kotwic.
+    ``anchor_data`` to wynik heatmap_anchor_data, jeśli został już pobrany.
+    """
+    resolution = max(2, min(heatmap.MAX_RESOLUTION, int(resolution)))
+
+    if anchor_data is None:
+        anchor_data = heatmap_anchor_data(north, south, east, west)
+    anchors = [anchor for anchor, _ in anchor_data]
+    anchor_data = [air_data for _, air_data in anchor_data]
+
+    known = [(anchor, air_data) for anchor, air_data in zip(anchors, anchor_data) if air_data is not None]
+    if not known:
+        return None
+
+    anchor_lats = [anchor[0] for anchor, _ in known]
+    anchor_lons = [anchor[1] for anchor, _ in known]
+    concentrations = aqi_arrays.stack_concentrations([air_data for _, air_data in known])
+    grid_lats, grid_lons = heatmap.grid_axes(north, south, east, west, resolution)
+
+    if not station_layer.covers(north, south, east, west):
+        values = np.maximum(aqi_arrays.compute_aqi(concentrations)["aqi"], 0)
+        grid = heatmap.idw_grid(anchor_lats, anchor_lons, values, grid_lats, grid_lons)
+        return grid_lats, grid_lons, grid
+
+    # Ze stacjami w pobliżu interpolujemy stężenia (nie AQI), korygujemy je w każdym węźle siatki
+    # odczytami najbliższych stacji i dopiero wtedy liczymy AQI
+    grid_concentrations = heatmap.idw_grid(anchor_lats, anchor_lons, concentrations.T, grid_lats, grid_lons)
+    lat_mesh, lon_mesh = np.meshgrid(grid_lats, grid_lons, indexing="ij")
+    blended, _ = station_layer.blend(lat_mesh.ravel(), lon_mesh.ravel(),
+                                     grid_concentrations.reshape(-1, len(aqi_arrays.POLLUTANTS)).T)
+    grid = np.maximum(aqi_arrays.compute_aqi(blended)["aqi"], 0).reshape(lat_mesh.shape).astype(np.float32)
+    return grid_lats, grid_lons, grid
+
+def generate_heatmap_data(north, south, east, west, resolution: int = heatmap.DEFAULT_RESOLUTION, anchor_data=None):
+    """
+    Generuje dane dla heatmapy w danym obszarze jako listę [lat, lon, intensywność].
+    """
+    grid = heatmap_grid(north, south, east, west, resolution, anchor_data)
+    if grid is None:
+        return []
+    return heatmap.to_points(*grid)
 
 
 
@@ -0,0 +1,259 @@
+import glob
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+
+import numpy as np
+import tifffile
+
+from api_scripts.api_satelite import day_range, get_default_client, process_request
+from api_scripts.shared_cache import claim_period
+from prediction import heatmap
+from prediction.tiles import parse_regions
+
+DEFAULT_RASTER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "rasters")
+NO2_RASTER_DIR = os.environ.get("NO2_RASTER_DIR", DEFAULT_RASTER_DIR)
+
+# Regiony w formacie "north,south,east,west;..." - pusty = warstwa wyłączona
+NO2_RASTER_REGIONS = os.environ.get("NO2_RASTER_REGIONS", "")
+NO2_RASTER_RESOLUTION = float(os.environ.get("NO2_RASTER_RESOLUTION", "0.05"))
+NO2_RASTER_KEEP_DAYS = int(os.environ.get("NO2_RASTER_KEEP_DAYS", "7"))
+MAX_RASTER_SIDE = 2500
+NO2_RASTER_REFRESH_SECONDS = 6 * 3600
+# Po tylu godzinach od końca dnia produkt Sentinel-5P uznajemy za kompletny - wcześniej pobrany raster
+# może być pusty albo częściowy, więc przy kolejnych odświeżeniach pobieramy go ponownie
+NO2_RASTER_FINAL_AFTER_HOURS = float(os.environ.get("NO2_RASTER_FINAL_AFTER_HOURS", "24"))
+
+# Jak często sprawdzać, czy w katalogu pojawiły się nowe rastry (np. od innego procesu)
+RELOAD_INTERVAL_SECONDS = 60
+
+
+def _region_name(region: tuple[float, float, float, float]) -> str:
+    return "_".join(f"{value:g}" for value in region)
+
+
+def _read_meta(meta_path: str) -> dict | None:
+    try:
+        with open(meta_path) as meta_file:
+            return json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+
+
+def fetch_region_raster(region: tuple[float, float, float, float], days_back: int = 1,
+                        raster_dir: str = NO2_RASTER_DIR, client=None) -> str | None:
+    """
+    Download one day's NO2 mosaic for a region and store it as a raw float32 grid
+    (``.f32``) plus a JSON sidecar with its georeferencing, the share of pixels
+    with data (``coverage``) and the download time. A raster downloaded less than
+    NO2_RASTER_FINAL_AFTER_HOURS after the end of its day is downloaded again on
+    the next call; a new download never replaces one with better coverage.
+    Returns the grid path, or None if there is no data for the day yet.
+    """
+    north, south, east, west = region
+    width = min(MAX_RASTER_SIDE, max(1, round((east - west) / NO2_RASTER_RESOLUTION)))
+    height = min(MAX_RASTER_SIDE, max(1, round((north - south) / NO2_RASTER_RESOLUTION)))
+    time_from, time_to = day_range(days_back)
+    day_end = datetime.strptime(time_to, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
+
+    base = os.path.join(raster_dir, f"no2_{_region_name(region)}_{time_from[:10]}")
+    previous = _read_meta(base + ".json")
+    # Dane pobrane po czasie dostarczenia produktu są kompletne i się nie zmieniają - nie pobieramy ich ponownie
+    if previous is not None and previous.get("fetched_at", 0.0) >= day_end + NO2_RASTER_FINAL_AFTER_HOURS * 3600:
+        return base + ".f32"
+
+    client = client or get_default_client()
+    fetched_at = time.time()
+    image = client.process(process_request([west, south, east, north], time_from, time_to, width, height))
+    grid = np.ascontiguousarray(tifffile.imread(BytesIO(image)), dtype=np.float32).reshape(height, width)
+
+    coverage = float(np.isfinite(grid).mean())
+    if coverage == 0.0 and previous is None:
+        # Pusty raster przesłoniłby w warstwie dane z poprzedniego dnia
+        return None
+
+    os.makedirs(raster_dir, exist_ok=True)
+    if previous is not None and previous.get("coverage", 0.0) > round(coverage, 4):
+        # Zapisany raster ma więcej danych - zostaje, zapisujemy tylko czas sprawdzenia
+        meta = dict(previous, fetched_at=fetched_at)
+    else:
+        meta = {
+            "north": north, "south": south, "east": east, "west": west,
+            "width": width, "height": height, "day": time_from[:10],
+            "coverage": round(coverage, 4), "fetched_at": fetched_at,
+        }
+        # Zapis przez plik tymczasowy i os.replace - czytelnicy nigdy nie widzą niepełnego rastra
+        grid.tofile(base + ".f32.tmp")
+        os.replace(base + ".f32.tmp", base + ".f32")
+    with open(base + ".json.tmp", "w") as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(base + ".json.tmp", base + ".json")
+    return base + ".f32"
+
+
+def prune_rasters(raster_dir: str = NO2_RASTER_DIR, keep_days: int = NO2_RASTER_KEEP_DAYS):
+    """Remove rasters older than ``keep_days`` days."""
+    oldest_day = day_range(keep_days)[0][:10]
+    for meta_path in glob.glob(os.path.join(raster_dir, "no2_*.json")):
+        with open(meta_path) as meta_file:
+            day = json.load(meta_file)["day"]
+        if day < oldest_day:
+            for path in (meta_path, meta_path[:-len(".json")] + ".f32"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+class Raster:
+    """Memory-mapped float32 grid with its bounds; row 0 is the northern edge."""
+
+    def __init__(self, grid: np.ndarray, north: float, south: float, east: float, west: float, day: str):
+        self.grid = grid
+        self.north, self.south, self.east, self.west = north, south, east, west
+        self.day = day
+        self.lat_step = (north - south) / grid.shape[0]
+        self.lon_step = (east - west) / grid.shape[1]
+
+    @classmethod
+    def open(cls, meta_path: str) -> "Raster":
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        grid = np.memmap(meta_path[:-len(".json")] + ".f32", dtype=np.float32, mode="r",
+                         shape=(meta["height"], meta["width"]))
+        return cls(grid, meta["north"], meta["south"], meta["east"], meta["west"], meta["day"])
+
+    def rows_cols(self, lats: np.ndarray, lons: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Pixel indices for the given latitude / longitude axes; -1 where outside the raster."""
+        rows = np.clip(np.floor((self.north - lats) / self.lat_step), 0, self.grid.shape[0] - 1).astype(np.int64)
+        cols = np.clip(np.floor((lons - self.west) / self.lon_step), 0, self.grid.shape[1] - 1).astype(np.int64)
+        rows[(lats < self.south) | (lats > self.north)] = -1
+        cols[(lons < self.west) | (lons > self.east)] = -1
+        return rows, cols
+
+
+class NO2Layer:
+    """
+    Latest NO2 raster per region, memory-mapped from NO2_RASTER_DIR.
+
+    ``sample`` reads only the pixels needed for the requested grid straight
+    from the mapped files, so serving a bbox needs no upstream call.
+    """
+
+    def __init__(self, raster_dir: str = NO2_RASTER_DIR):
+        self.raster_dir = raster_dir
+        self.rasters = []
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def reload(self):
+        meta_paths = sorted(glob.glob(os.path.join(self.raster_dir, "no2_*.json")))
+        signature = tuple((path, os.path.getmtime(path)) for path in meta_paths if os.path.exists(path))
+        if signature == self._signature:
+            return
+
+        latest = {}
+        for meta_path in meta_paths:
+            try:
+                raster = Raster.open(meta_path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Nie udało się otworzyć rastra {meta_path}: {e}")
+                continue
+            region = (raster.north, raster.south, raster.east, raster.west)
+            if region not in latest or latest[region].day < raster.day:
+                latest[region] = raster
+
+        self.rasters = list(latest.values())
+        self._signature = signature
+
+    def version(self) -> tuple:
+        """Paths and modification times of the raster files in use (changes whenever sampled values may change)."""
+        self._maybe_reload()
+        return self._signature
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_INTERVAL_SECONDS:
+            return
+        with self._lock:
+            if now - self._checked_at >= RELOAD_INTERVAL_SECONDS:
+                self.reload()
+                self._checked_at = now
+
+    def sample(self, north: float, south: float, east: float, west: float, resolution: int):
+        """
+        NO2 column (mol/m²) on a resolution x resolution grid over the bbox.
+        Returns (lats, lons, values) with NaN where no raster covers a cell.
+        """
+        self._maybe_reload()
+        lats = np.linspace(south, north, resolution, dtype=np.float64)
+        lons = np.linspace(west, east, resolution, dtype=np.float64)
+        values = np.full((resolution, resolution), np.nan, dtype=np.float32)
+
+        for raster in self.rasters:
+            rows, cols = raster.rows_cols(lats, lons)
+            row_mask, col_mask = rows >= 0, cols >= 0
+            if not row_mask.any() or not col_mask.any():
+                continue
+            target = np.ix_(row_mask, col_mask)
+            sampled = raster.grid[np.ix_(rows[row_mask], cols[col_mask])]
+            values[target] = np.where(np.isnan(values[target]), sampled, values[target])
+
+        return lats, lons, values
+
+
+no2_layer = NO2Layer()
+
+
+def no2_heatmap_grid(north, south, east, west, resolution: int):
+    """Siatka NO2 (µmol/m²) dla obszaru: (szerokości, długości, wartości), NaN bez pokrycia rastrem."""
+    lats, lons, values = no2_layer.sample(north, south, east, west, resolution)
+    return lats, lons, values * 1e6
+
+
+def no2_heatmap_data(north, south, east, west, resolution: int):
+    """
+    Dane heatmapy z warstwy satelitarnej NO2 (intensywność w µmol/m²).
+    Punkty bez pokrycia rastrem są pomijane.
+    """
+    return heatmap.to_points(*no2_heatmap_grid(north, south, east, west, resolution))
+
+
+def refresh_rasters(regions, days_back: int = 1) -> int:
+    # Dni, których produkt mógł jeszcze nie być kompletny przy poprzednim pobraniu, sprawdzamy ponownie
+    last_day_back = days_back + math.ceil(NO2_RASTER_FINAL_AFTER_HOURS / 24)
+    refreshed = 0
+    for region in regions:
+        for day_back in range(days_back, last_day_back + 1):
+            try:
+                if fetch_region_raster(region, days_back=day_back) is not None:
+                    refreshed += 1
+            except Exception as e:
+                print(f"Błąd pobierania rastra NO2 dla regionu {region}: {e}")
+    prune_rasters()
+    return refreshed
+
+
+def _refresh_loop(regions):
+    while True:
+        # Rastry trafiają do wspólnego katalogu, więc pobiera je tylko jeden worker
+        if claim_period("no2_raster_refresh", NO2_RASTER_REFRESH_SECONDS):
+            refreshed = refresh_rasters(regions)
+            print(f"Odświeżono {refreshed} rastrów NO2")
+        no2_layer.reload()
+        # Dane z poprzedniego dnia pojawiają się w ciągu doby - sprawdzamy co 6 godzin
+        time.sleep(NO2_RASTER_REFRESH_SECONDS)
+
+
+def start_raster_refresh(spec: str = NO2_RASTER_REGIONS) -> threading.Thread | None:
+    """Start the background NO2 raster refresh if any regions are configured."""
+    regions = parse_regions(spec)
+    if not regions:
+        return None
+
+    thread = threading.Thread(target=_refresh_loop, args=(regions,), name="no2-raster-refresh", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+
+from api_scripts.api_currentWeather import get_current_weather_batch
+from api_scripts.grid_cache import GRID_STEP, UPSTREAM_REFRESH_SECONDS, snap_to_grid, upstream_cache
+from api_scripts.shared_cache import claim_period, shared_cache
+from prediction.neuralnetworkFRmock import fetch_air_quality_batch
+
+# Ile najczęściej odpytywanych komórek odświeżać po każdej aktualizacji danych (0 = wyłączone)
+PREFETCH_HOT_CELLS = int(os.environ.get("PREFETCH_HOT_CELLS", "200"))
+# Open-Meteo publikuje nowe dane chwilę po pełnej godzinie
+PREFETCH_DELAY_SECONDS = float(os.environ.get("PREFETCH_DELAY_SECONDS", "60"))
+PREFETCH_BATCH_SIZE = int(os.environ.get("PREFETCH_BATCH_SIZE", "50"))
+PREFETCH_BATCH_INTERVAL_SECONDS = float(os.environ.get("PREFETCH_BATCH_INTERVAL_SECONDS", "1.0"))
+HOT_CELLS_MAX_TRACKED = 10000
+# Tyle sekund przed prefetchem każdy worker dopisuje swoje liczniki do współdzielonego pliku
+HOT_CELLS_FLUSH_LEAD_SECONDS = 10
+
+# Rodzaje danych w cache i funkcje pobierające je dla wielu komórek naraz
+BATCH_FETCHERS = {
+    "air_quality": fetch_air_quality_batch,
+    "current_weather": get_current_weather_batch,
+}
+
+
+class HotCells:
+    """
+    Access counts per (kind, grid cell), halved after every prefetch round so
+    that the ranking follows recent traffic. Tracks at most ``max_tracked``
+    cells; when full, the least requested half is dropped.
+
+    With a ``shared`` cache (SharedCache) every worker adds its counts to the
+    shared file with ``flush``, and ``top`` / ``decay`` work on the totals of
+    all workers, so the one worker that prefetches sees the whole traffic.
+    """
+
+    def __init__(self, step: float = GRID_STEP, max_tracked: int = HOT_CELLS_MAX_TRACKED, shared=None):
+        self.step = step
+        self.max_tracked = max_tracked
+        self.shared = shared
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, lat: float, lon: float):
+        cell = (kind, *snap_to_grid(lat, lon, self.step))
+        with self._lock:
+            self._counts[cell] = self._counts.get(cell, 0) + 1
+            if len(self._counts) > self.max_tracked:
+                self._trim()
+
+    def _trim(self):
+        ranked = sorted(self._counts.items(), key=lambda item: item[1], reverse=True)
+        self._counts = dict(ranked[:self.max_tracked // 2])
+
+    def flush(self):
+        """Move this process's counts into the shared counters (no-op without a shared cache)."""
+        if self.shared is None:
+            return
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        if counts:
+            self.shared.add_counts("hot_cells", counts)
+
+    def top(self, count: int) -> list[tuple[str, float, float]]:
+        if self.shared is not None:
+            return self.shared.top_counts("hot_cells", count)
+        with self._lock:
+            ranked = sorted(self._counts.items(), key=lambda item: item[1], reverse=True)
+        return [cell for cell, _ in ranked[:count]]
+
+    def decay(self):
+        if self.shared is not None:
+            self.shared.decay_counts("hot_cells", self.max_tracked)
+            return
+        with self._lock:
+            self._counts = {cell: hits // 2 for cell, hits in self._counts.items() if hits > 1}
+
+
+hot_cells = HotCells(shared=shared_cache)
+
+
+def prefetch_hot_cells(count: int = PREFETCH_HOT_CELLS, batch_size: int = PREFETCH_BATCH_SIZE,
+                       interval: float = PREFETCH_BATCH_INTERVAL_SECONDS) -> int:
+    """
+    Fetch the ``count`` most requested cells that are not yet cached for the
+    current hour, one multi-location upstream request per ``batch_size`` cells
+    and at most one request per ``interval`` seconds. Returns the number of cells stored.
+    """
+    missing = {}
+    for kind, lat, lon in hot_cells.top(count):
+        key = upstream_cache.key_for(kind, lat, lon)
+        if kind in BATCH_FETCHERS and upstream_cache.lookup(key) is None:
+            missing.setdefault(kind, []).append(key)
+
+    stored = 0
+    for kind, keys in missing.items():
+        for start in range(0, len(keys), batch_size):
+            chunk = keys[start:start + batch_size]
+            results = BATCH_FETCHERS[kind]([(key[1], key[2]) for key in chunk])
+            for key, value in zip(chunk, results):
+                if value is not None:
+                    upstream_cache.remember(key, value)
+                    stored += 1
+            time.sleep(interval)
+    return stored
+
+
+def seconds_until_prefetch(now: float | None = None, delay: float = PREFETCH_DELAY_SECONDS) -> float:
+    """Seconds until ``delay`` seconds past the next upstream refresh."""
+    if now is None:
+        now = time.time()
+    return UPSTREAM_REFRESH_SECONDS - now % UPSTREAM_REFRESH_SECONDS + delay
+
+
+def _prefetch_loop():
+    while True:
+        # Każdy worker dopisuje swoje liczniki przed prefetchem, potem jeden z nich pobiera komórki
+        # najpopularniejsze łącznie we wszystkich workerach; wyniki trafiają do współdzielonego cache
+        time.sleep(max(0.0, seconds_until_prefetch() - HOT_CELLS_FLUSH_LEAD_SECONDS))
+        hot_cells.flush()
+        time.sleep(seconds_until_prefetch())
+        if claim_period("hot_cell_prefetch", UPSTREAM_REFRESH_SECONDS):
+            try:
+                stored = prefetch_hot_cells()
+                print(f"Pobrano z wyprzedzeniem {stored} popularnych komórek")
+            except Exception as e:
+                print(f"Błąd pobierania popularnych komórek z wyprzedzeniem: {e}")
+            hot_cells.decay()
+
+
+def start_prefetch(count: int = PREFETCH_HOT_CELLS) -> threading.Thread | None:
+    """Start the hourly prefetch of the most requested cells, unless disabled."""
+    if count <= 0:
+        return None
+
+    thread = threading.Thread(target=_prefetch_loop, name="hot-cell-prefetch", daemon=True)
+    thread.start()
+    return thread
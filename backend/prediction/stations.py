@@ -0,0 +1,275 @@
+"""
+Ground-truth correction of modelled concentrations with nearby OpenAQ stations.
+
+A snapshot of the latest station readings is downloaded periodically (by one
+worker) into STATIONS_SNAPSHOT_PATH; every process loads it into one KD-tree
+over the unit-sphere coordinates of all station locations. ``blend`` queries
+the k nearest locations within STATION_RADIUS_KM for a whole array of points
+at once (one query for all pollutants) and mixes their inverse-distance-
+weighted readings into the model values, with a weight falling linearly from
+STATION_BLEND_WEIGHT at a station to 0 at the radius.
+"""
+import math
+import os
+import threading
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from api_scripts.api_openaq import OPENAQ_ENABLED, OPENAQ_MAX_AGE_HOURS, get_latest_readings
+from api_scripts.shared_cache import claim_period
+from prediction.aqi_arrays import POLLUTANTS
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data",
+                                     "openaq_snapshot.npz")
+STATIONS_SNAPSHOT_PATH = os.environ.get("STATIONS_SNAPSHOT_PATH", DEFAULT_SNAPSHOT_PATH)
+OPENAQ_REFRESH_SECONDS = float(os.environ.get("OPENAQ_REFRESH_SECONDS", "3600"))
+
+STATION_NEIGHBOURS = int(os.environ.get("STATION_NEIGHBOURS", "4"))
+STATION_RADIUS_KM = float(os.environ.get("STATION_RADIUS_KM", "25"))
+# Udział odczytu stacji w wyniku tuż przy stacji (0 = bez korekty)
+STATION_BLEND_WEIGHT = float(os.environ.get("STATION_BLEND_WEIGHT", "0.7"))
+
+EARTH_RADIUS_KM = 6371.0
+# Jak często sprawdzać, czy inny proces zapisał nowszą migawkę
+RELOAD_INTERVAL_SECONDS = 60
+
+
+def unit_vectors(lats, lons) -> np.ndarray:
+    """(n, 3) points on the unit sphere; chord distance between them grows with great-circle distance."""
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lat = np.cos(lats)
+    return np.stack([cos_lat * np.cos(lons), cos_lat * np.sin(lons), np.sin(lats)], axis=-1)
+
+
+class StationIndex:
+    """
+    One KD-tree over all station locations with (pollutants, stations) matrices
+    of readings and their times (NaN where a location does not measure the
+    pollutant), so a single query serves every pollutant.
+    """
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, values: np.ndarray, times: np.ndarray):
+        values = np.asarray(values, dtype=np.float64)
+        self.times = np.nan_to_num(np.asarray(times, dtype=np.float64), nan=-np.inf)
+        self.present = (~np.isnan(values)).astype(np.float64)
+        self.values = np.nan_to_num(values)
+        self.tree = cKDTree(unit_vectors(lats, lons))
+
+    def expire(self, oldest: float) -> bool:
+        """Stop using readings observed before ``oldest``; returns whether any reading is left."""
+        self.present[self.times < oldest] = 0.0
+        return bool(self.present.any())
+
+    def __len__(self) -> int:
+        return self.values.shape[1]
+
+    @classmethod
+    def from_readings(cls, readings: dict[str, tuple[np.ndarray, ...]]) -> "StationIndex":
+        """Merge ``{pollutant: (lats, lons, values, times)}`` by location (rounded to ~1 m)."""
+        keys = np.concatenate([np.round(np.stack([lats, lons], axis=1), 5) for lats, lons, _, _ in readings.values()])
+        locations, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        values = np.full((len(POLLUTANTS), len(locations)), np.nan)
+        times = np.full((len(POLLUTANTS), len(locations)), np.nan)
+        start = 0
+        for pollutant, (_, _, readings_values, readings_times) in readings.items():
+            stop = start + len(readings_values)
+            row = POLLUTANTS.index(pollutant)
+            values[row, inverse[start:stop]] = readings_values
+            times[row, inverse[start:stop]] = readings_times
+            start = stop
+        return cls(locations[:, 0], locations[:, 1], values, times)
+
+    def estimate(self, lats, lons, k: int = STATION_NEIGHBOURS,
+                 radius_km: float = STATION_RADIUS_KM) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (pollutants, n) IDW estimates from the ``k`` nearest locations within
+        ``radius_km`` of each point and the distance in km to the nearest one
+        measuring each pollutant (NaN / inf where there is none).
+        """
+        k = min(k, len(self))
+        chord = 2 * math.sin(radius_km / EARTH_RADIUS_KM / 2)
+        distances, indices = self.tree.query(unit_vectors(lats, lons), k=k, distance_upper_bound=chord, workers=-1)
+        distances = distances.reshape(len(distances), k)
+        indices = np.minimum(indices.reshape(len(indices), k), len(self) - 1)
+
+        inverse_square = 1.0 / np.maximum(distances, 1e-9) ** 2
+        shape = (len(self.values), len(distances))
+        weighted, total, nearest = np.zeros(shape), np.zeros(shape), np.full(shape, np.inf)
+        # Pętla po k sąsiadach zamiast tablic (pollutants, n, k) - kilka razy szybciej dla dużych siatek
+        for column in range(k):
+            stations = indices[:, column]
+            weights = self.present[:, stations] * inverse_square[:, column]
+            weighted += weights * self.values[:, stations]
+            total += weights
+            np.minimum(nearest, np.where(weights > 0, distances[:, column], np.inf), out=nearest)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            estimate = weighted / total
+        nearest_km = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(nearest, 2.0) / 2)
+        return estimate, nearest_km
+
+
+class StationLayer:
+    """Station index built from the snapshot file, reloaded when the file changes."""
+
+    def __init__(self, path: str = STATIONS_SNAPSHOT_PATH):
+        self.path = path
+        self.index = None
+        self._live = 0
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return 0 if self.index is None else len(self.index)
+
+    def reload(self):
+        try:
+            signature = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if signature == self._signature:
+            return
+
+        try:
+            with np.load(self.path) as snapshot:
+                arrays = {name: snapshot[name] for name in snapshot.files}
+        except (OSError, ValueError) as e:
+            print(f"Nie udało się wczytać migawki stacji {self.path}: {e}")
+            return
+
+        oldest = time.time() - OPENAQ_MAX_AGE_HOURS * 3600
+        readings = {}
+        for pollutant in POLLUTANTS:
+            if f"{pollutant}_value" not in arrays:
+                continue
+            fresh = arrays[f"{pollutant}_time"] >= oldest
+            if fresh.any():
+                readings[pollutant] = tuple(arrays[f"{pollutant}_{field}"][fresh]
+                                            for field in ("lat", "lon", "value", "time"))
+        self.index = StationIndex.from_readings(readings) if readings else None
+        self._live = int(self.index.present.sum()) if self.index is not None else 0
+        self._signature = signature
+
+    def version(self) -> tuple | None:
+        """Loaded snapshot and number of readings still in use (changes whenever blending results may change)."""
+        self._maybe_reload()
+        return (self._signature, self._live) if self.index is not None else None
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_INTERVAL_SECONDS:
+            return
+        with self._lock:
+            if now - self._checked_at >= RELOAD_INTERVAL_SECONDS:
+                self.reload()
+                self.expire()
+                self._checked_at = now
+
+    def expire(self):
+        """
+        Drop readings older than OPENAQ_MAX_AGE_HOURS, also when the snapshot is
+        not being refreshed any more; without fresh readings blending stops.
+        """
+        index = self.index
+        if index is None:
+            return
+        if not index.expire(time.time() - OPENAQ_MAX_AGE_HOURS * 3600):
+            self.index = None
+        self._live = int(index.present.sum())
+
+    def covers(self, north: float, south: float, east: float, west: float) -> bool:
+        """Whether any station is close enough to affect a point of the bbox."""
+        self._maybe_reload()
+        index = self.index
+        if index is None or STATION_BLEND_WEIGHT <= 0:
+            return False
+        centre = unit_vectors([(north + south) / 2], [(east + west) / 2])[0]
+        corner = unit_vectors([north], [east])[0]
+        half_diagonal_km = 2 * EARTH_RADIUS_KM * math.asin(min(1.0, float(np.linalg.norm(corner - centre)) / 2))
+        chord = 2 * math.sin(min(math.pi / 2, (half_diagonal_km + STATION_RADIUS_KM) / EARTH_RADIUS_KM / 2))
+        return index.tree.query_ball_point(centre, chord, return_length=True) > 0
+
+    def blend(self, lats, lons, concentrations) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Correct a (pollutants, n) array of model concentrations at n points.
+        Returns the corrected copy and the largest station weight used per point.
+        """
+        self._maybe_reload()
+        blended = np.array(concentrations, dtype=np.float64)
+        index = self.index
+        if index is None or STATION_BLEND_WEIGHT <= 0:
+            return blended, np.zeros(blended.shape[1])
+
+        estimate, nearest_km = index.estimate(lats, lons)
+        weight = STATION_BLEND_WEIGHT * np.clip(1 - nearest_km / STATION_RADIUS_KM, 0, 1)
+        corrected = np.where(np.isnan(blended), estimate, (1 - weight) * blended + weight * estimate)
+        blended = np.where(weight > 0, corrected, blended)
+        return blended, weight.max(axis=0)
+
+    def blend_air_data(self, latitude: float, longitude: float, air_data: dict) -> dict:
+        """``blend`` for one ``get_air_quality`` dict; adds ``station_weight`` when stations were used."""
+        concentrations = np.array([[np.nan if air_data.get(pollutant) is None else air_data[pollutant]]
+                                   for pollutant in POLLUTANTS])
+        blended, station_weight = self.blend([latitude], [longitude], concentrations)
+        if station_weight[0] <= 0:
+            return air_data
+
+        corrected = dict(air_data)
+        for row, pollutant in enumerate(POLLUTANTS):
+            if not np.isnan(blended[row, 0]):
+                corrected[pollutant] = round(float(blended[row, 0]), 2)
+        corrected["station_weight"] = round(float(station_weight[0]), 3)
+        return corrected
+
+
+station_layer = StationLayer()
+station_layer.reload()
+
+
+def refresh_snapshot(path: str = STATIONS_SNAPSHOT_PATH) -> int | None:
+    """Download the latest station readings into ``path``; returns the number of readings, None on failure."""
+    readings = get_latest_readings()
+    if readings is None:
+        return None
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # np.savez dopisuje ".npz" do innych nazw, więc plik tymczasowy też tak się kończy
+    temporary = path + ".tmp.npz"
+    np.savez(temporary, **readings)
+    os.replace(temporary, path)
+    station_layer.reload()
+    return sum(len(values) for name, values in readings.items() if name.endswith("_value"))
+
+
+def _written_this_period(path: str = STATIONS_SNAPSHOT_PATH) -> bool:
+    try:
+        return os.path.getmtime(path) // OPENAQ_REFRESH_SECONDS == time.time() // OPENAQ_REFRESH_SECONDS
+    except OSError:
+        return False
+
+
+def _refresh_loop():
+    while True:
+        # Migawkę pobiera jeden worker, pozostałe wczytują zapisany plik
+        if not _written_this_period() and claim_period("openaq_snapshot", OPENAQ_REFRESH_SECONDS):
+            try:
+                count = refresh_snapshot()
+                if count is not None:
+                    print(f"Pobrano {count} odczytów stacji OpenAQ")
+            except Exception as e:
+                print(f"Błąd odświeżania migawki stacji OpenAQ: {e}")
+        time.sleep(OPENAQ_REFRESH_SECONDS - time.time() % OPENAQ_REFRESH_SECONDS)
+
+
+def start_station_refresh() -> threading.Thread | None:
+    """Start the periodic OpenAQ snapshot download if OpenAQ is configured."""
+    if not OPENAQ_ENABLED:
+        return None
+
+    thread = threading.Thread(target=_refresh_loop, name="openaq-refresh", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,263 @@
+"""
+Push-based AQI updates for subscribed grid cells (Server-Sent Events).
+
+Clients subscribe to a set of points; each point is snapped to its cache grid
+cell. One background thread per process fetches every subscribed cell once
+after each upstream refresh (through the upstream cache, so cells shared with
+other workers or requests are not fetched twice) and pushes an ``aqi`` event
+to the subscribers of a cell only when its AQI summary changed. The work per
+refresh depends on the number of distinct cells, not on the number of clients.
+"""
+import abc
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+
+from api_scripts.grid_cache import snap_to_grid
+from prediction.neuralnetworkFRmock import aqi_batch
+from prediction.prefetch import seconds_until_prefetch
+
+SSE_MAX_CELLS = int(os.environ.get("SSE_MAX_CELLS", "100"))
+SSE_MAX_SUBSCRIBERS = int(os.environ.get("SSE_MAX_SUBSCRIBERS", "1000"))
+SSE_KEEPALIVE_SECONDS = float(os.environ.get("SSE_KEEPALIVE_SECONDS", "15"))
+# Po ilu sekundach ponowić pobranie komórek, których nie udało się pobrać
+SSE_RETRY_SECONDS = float(os.environ.get("SSE_RETRY_SECONDS", "60"))
+# Tyle zdarzeń może czekać na wolnego klienta - potem połączenie jest zamykane (klient połączy się ponownie)
+SSE_QUEUE_SIZE = 256
+
+# Podpowiedź dla EventSource: po zerwaniu połączenia spróbuj ponownie po 5 s
+STREAM_PREAMBLE = "retry: 5000\n\n"
+KEEPALIVE = ": keep-alive\n\n"
+# Proxy (np. nginx) nie może buforować strumienia
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+class HubFull(Exception):
+    """Raised when a new subscription would exceed SSE_MAX_SUBSCRIBERS."""
+
+
+def parse_cells(spec: str, max_cells: int = SSE_MAX_CELLS) -> frozenset[tuple[float, float]]:
+    """Parse ``"lat,lon;lat,lon"`` into the set of grid cells covering the points."""
+    cells = set()
+    for chunk in spec.split(";"):
+        if not chunk.strip():
+            continue
+        try:
+            latitude, longitude = (float(value) for value in chunk.split(","))
+        except ValueError:
+            raise ValueError(f"Niepoprawny punkt '{chunk}', oczekiwano 'lat,lon'.")
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            raise ValueError(f"Punkt '{chunk}' poza zakresem współrzędnych.")
+        cells.add(snap_to_grid(latitude, longitude))
+    if not cells:
+        raise ValueError("Brak punktów do subskrypcji.")
+    if len(cells) > max_cells:
+        raise ValueError(f"Za dużo komórek siatki ({len(cells)}), maksymalnie {max_cells}.")
+    return frozenset(cells)
+
+
+def format_event(event: dict) -> str:
+    return f"event: aqi\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+
+class Subscription(abc.ABC):
+    """One client's set of cells and its queue of pending events; ``None`` in the queue ends the stream."""
+
+    def __init__(self, cells: frozenset[tuple[float, float]]):
+        self.cells = cells
+
+    @abc.abstractmethod
+    def push(self, event: dict):
+        """Queue an event without blocking the hub; a subscriber that cannot keep up is closed."""
+
+    @abc.abstractmethod
+    def close(self):
+        """End the stream (queue the ``None`` sentinel)."""
+
+
+class ThreadSubscription(Subscription):
+    """Subscription consumed by a WSGI worker thread."""
+
+    def __init__(self, cells):
+        super().__init__(cells)
+        self.queue = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.close()
+
+    def close(self):
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.queue.put_nowait(None)
+
+    def events(self, keepalive: float = SSE_KEEPALIVE_SECONDS):
+        """SSE text chunks until the subscription is closed."""
+        yield STREAM_PREAMBLE
+        while True:
+            try:
+                event = self.queue.get(timeout=keepalive)
+            except queue.Empty:
+                yield KEEPALIVE
+                continue
+            if event is None:
+                return
+            yield format_event(event)
+
+
+class AsyncSubscription(Subscription):
+    """Subscription consumed on an asyncio event loop (must be created on that loop)."""
+
+    def __init__(self, cells):
+        super().__init__(cells)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+
+    def push(self, event):
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self._close()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self._close)
+
+    def _close(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def events(self, keepalive: float = SSE_KEEPALIVE_SECONDS):
+        yield STREAM_PREAMBLE
+        while True:
+            try:
+                event = await asyncio.wait_for(self.queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield KEEPALIVE
+                continue
+            if event is None:
+                return
+            yield format_event(event)
+
+
+class CellHub:
+    """
+    Subscribers per grid cell and the last AQI summary pushed for each cell.
+
+    New cells are fetched right away and known cells are sent to a new
+    subscriber immediately; after that every cell is refreshed once per
+    upstream refresh period.
+    """
+
+    def __init__(self, max_subscribers: int = SSE_MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self._subscribers = {}
+        self._last = {}
+        self._pending = set()
+        self._retry = set()
+        self._count = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def subscribe(self, subscription: Subscription):
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise HubFull("Za dużo otwartych subskrypcji, spróbuj ponownie później.")
+            self._count += 1
+            for cell in subscription.cells:
+                if cell not in self._subscribers:
+                    self._subscribers[cell] = set()
+                    self._pending.add(cell)
+                self._subscribers[cell].add(subscription)
+                if cell in self._last:
+                    subscription.push(self._event(cell, self._last[cell]))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="aqi-stream", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._count -= 1
+            for cell in subscription.cells:
+                subscribers = self._subscribers.get(cell)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[cell]
+                    self._last.pop(cell, None)
+
+    @staticmethod
+    def _event(cell, summary: dict) -> dict:
+        return {"cell": list(cell), **summary}
+
+    def refresh(self, cells) -> set[tuple[float, float]]:
+        """Fetch AQI for ``cells`` and push the changed ones; returns the cells that could not be fetched."""
+        cells = list(cells)
+        failed = set()
+        for result in aqi_batch(cells):
+            cell = cells[result["index"]]
+            if "error" in result:
+                failed.add(cell)
+                continue
+            summary = {name: value for name, value in result.items()
+                       if name not in ("index", "latitude", "longitude", "cell")}
+
+            with self._lock:
+                subscribers = self._subscribers.get(cell)
+                if not subscribers or self._last.get(cell) == summary:
+                    continue
+                self._last[cell] = summary
+                subscribers = list(subscribers)
+            event = self._event(cell, summary)
+            for subscription in subscribers:
+                subscription.push(event)
+        return failed
+
+    def _run(self):
+        next_refresh = time.time() + seconds_until_prefetch()
+        while True:
+            now = time.time()
+            with self._lock:
+                if now >= next_refresh:
+                    cells = set(self._subscribers)
+                    next_refresh = now + seconds_until_prefetch(now)
+                else:
+                    cells = (self._pending | self._retry) & set(self._subscribers)
+                self._pending.clear()
+
+            failed = set()
+            if cells:
+                try:
+                    failed = self.refresh(cells)
+                except Exception as e:
+                    print(f"Błąd odświeżania subskrybowanych komórek: {e}")
+                    failed = cells
+
+            with self._lock:
+                self._retry = failed
+            timeout = next_refresh - time.time()
+            if failed:
+                timeout = min(timeout, SSE_RETRY_SECONDS)
+            self._wake.wait(max(0.0, timeout))
+            self._wake.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"subscribers": self._count, "cells": len(self._subscribers)}
+
+
+aqi_hub = CellHub()
@@ -0,0 +1,148 @@
+import hashlib
+import math
+import os
+import threading
+import time
+
+from api_scripts.grid_cache import GridCache, UPSTREAM_REFRESH_SECONDS
+from api_scripts.shared_cache import claim_period, shared_cache
+from prediction.neuralnetworkFRmock import anchor_data_version, generate_heatmap_data, heatmap_anchor_data
+
+TILE_GRID_SIZE = int(os.environ.get("TILE_GRID_SIZE", "32"))
+MAX_TILE_ZOOM = int(os.environ.get("MAX_TILE_ZOOM", "12"))
+TILE_CACHE_MAX_ENTRIES = int(os.environ.get("TILE_CACHE_MAX_ENTRIES", "2048"))
+
+# Regiony do rozgrzewania w formacie "north,south,east,west;north,south,east,west"
+TILE_PRECOMPUTE_REGIONS = os.environ.get("TILE_PRECOMPUTE_REGIONS", "")
+TILE_PRECOMPUTE_ZOOMS = os.environ.get("TILE_PRECOMPUTE_ZOOMS", "4,5,6")
+# Ponowne rozgrzewanie kafli, których kotwice były jeszcze nieaktualne
+TILE_REWARM_ATTEMPTS = 5
+TILE_REWARM_DELAY_SECONDS = 30
+
+tile_cache = GridCache(max_entries=TILE_CACHE_MAX_ENTRIES, ttl=UPSTREAM_REFRESH_SECONDS, shared=shared_cache)
+
+
+def is_valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """Granice (north, south, east, west) kafla mapy z/x/y (Web Mercator)"""
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return north, south, east, west
+
+
+def lat_lon_to_tile(lat: float, lon: float, z: int) -> tuple[int, int]:
+    n = 2 ** z
+    lat = max(-85.0511, min(85.0511, lat))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_for_bbox(north: float, south: float, east: float, west: float, z: int):
+    x_min, y_min = lat_lon_to_tile(north, west, z)
+    x_max, y_max = lat_lon_to_tile(south, east, z)
+    for x in range(x_min, x_max + 1):
+        for y in range(y_min, y_max + 1):
+            yield x, y
+
+
+def tile_version(z: int, x: int, y: int) -> tuple[list, str | None]:
+    """
+    Dane kotwic kafla i jego ETag (skrót kafla i wersji kotwic) - bez liczenia siatki.
+    ETag jest None, gdy któraś kotwica jest nieaktualna albo brak danych.
+    """
+    anchor_data = heatmap_anchor_data(*tile_bounds(z, x, y))
+    version = anchor_data_version(anchor_data)
+    if version is None:
+        return anchor_data, None
+    return anchor_data, hashlib.sha1(f"{z}/{x}/{y}/{TILE_GRID_SIZE}/{version}".encode()).hexdigest()
+
+
+def heatmap_tile(z: int, x: int, y: int, anchor_data=None, etag: str | None = None) -> tuple[dict, str | None]:
+    """
+    Dane heatmapy dla kafla i jego ETag. Kafle są w cache pod wersją kotwic, a te z nieaktualnych
+    kotwic (ETag None) nie trafiają do cache. ``anchor_data`` i ``etag`` to wynik tile_version, jeśli już jest.
+    """
+    if anchor_data is None:
+        anchor_data, etag = tile_version(z, x, y)
+    key = ("heatmap_tile", z, x, y, etag)
+    if etag is not None:
+        cached = tile_cache.get(key)
+        if cached is not None:
+            return cached, etag
+
+    north, south, east, west = tile_bounds(z, x, y)
+    payload = {
+        "z": z,
+        "x": x,
+        "y": y,
+        "bounds": {"north": north, "south": south, "east": east, "west": west},
+        "size": TILE_GRID_SIZE,
+        "points": generate_heatmap_data(north, south, east, west, resolution=TILE_GRID_SIZE,
+                                        anchor_data=anchor_data),
+    }
+    if etag is not None:
+        tile_cache.remember(key, payload)
+    return payload, etag
+
+def parse_regions(spec: str) -> list[tuple[float, float, float, float]]:
+    regions = []
+    for chunk in spec.split(";"):
+        if chunk.strip():
+            north, south, east, west = (float(value) for value in chunk.split(","))
+            regions.append((north, south, east, west))
+    return regions
+
+
+def precompute_tiles(regions, zooms) -> tuple[int, list[tuple[int, int, int]]]:
+    """Rozgrzewa cache kafli dla regionów i zoomów: (liczba kafli w cache, kafle bez aktualnych kotwic)"""
+    warmed, pending = 0, []
+    for north, south, east, west in regions:
+        for z in zooms:
+            for x, y in tiles_for_bbox(north, south, east, west, z):
+                if heatmap_tile(z, x, y)[1] is None:
+                    pending.append((z, x, y))
+                else:
+                    warmed += 1
+    return warmed, pending
+
+
+def _precompute_loop(regions, zooms):
+    while True:
+        # Przy kilku workerach kafle rozgrzewa tylko jeden, reszta czyta je ze współdzielonego cache
+        if claim_period("tile_precompute", UPSTREAM_REFRESH_SECONDS):
+            try:
+                warmed, pending = precompute_tiles(regions, zooms)
+                # Kotwice podane z cache w trakcie odświeżania są oznaczone jako stale - takie kafle rozgrzewamy
+                # ponownie, gdy odświeżanie w tle się skończy
+                for _ in range(TILE_REWARM_ATTEMPTS):
+                    if not pending:
+                        break
+                    time.sleep(TILE_REWARM_DELAY_SECONDS)
+                    retried = len(pending)
+                    pending = [tile for tile in pending if heatmap_tile(*tile)[1] is None]
+                    warmed += retried - len(pending)
+                print(f"Rozgrzano {warmed} kafli heatmapy, bez aktualnych danych: {len(pending)}")
+            except Exception as e:
+                print(f"Błąd rozgrzewania kafli heatmapy: {e}")
+        # Czekamy do początku kolejnego okresu odświeżania danych w Open-Meteo
+        time.sleep(UPSTREAM_REFRESH_SECONDS - time.time() % UPSTREAM_REFRESH_SECONDS + 60)
+
+
+def start_tile_precompute(spec: str = TILE_PRECOMPUTE_REGIONS, zooms: str = TILE_PRECOMPUTE_ZOOMS) -> threading.Thread | None:
+    """Uruchamia rozgrzewanie kafli w tle, jeśli skonfigurowano regiony"""
+    regions = parse_regions(spec)
+    if not regions:
+        return None
+
+    zoom_levels = [int(z) for z in zooms.split(",") if z.strip()]
+    thread = threading.Thread(target=_precompute_loop, args=(regions, zoom_levels),
+                              name="tile-precompute", daemon=True)
+    thread.start()
+    return thread
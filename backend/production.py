@@ -0,0 +1,25 @@
+"""
+Production entry point: several uvicorn worker processes serving ``asgi:application``.
+
+    python production.py
+
+Each worker keeps its own in-memory cache in front of the SQLite cache shared
+by all of them (SHARED_CACHE_PATH), so a grid cell is fetched from the upstream
+once per refresh period no matter how many workers serve it. Periodic jobs
+(tile warm-up, NO2 rasters, hot-cell prefetch) run in one worker per period.
+"""
+import os
+
+import uvicorn
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "5001"))
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+
+
+def main():
+    uvicorn.run("asgi:application", host=HOST, port=PORT, workers=WEB_CONCURRENCY, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
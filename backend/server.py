@@ -1,10 +1,45 @@
-from flask import Flask, request
-from flask_restx import Api, Resource, fields
-from prediction.neuralnetworkFRmock import air_quality, current_weather, aqi, generate_heatmap_data
+import gzip
+import hashlib
+import json
+import os
+import time
+
+import httpx
+from flask import Flask, Response, g, request, stream_with_context
+from flask_restx import Api, Resource, fields, inputs
+from prediction.neuralnetworkFRmock import (air_quality, current_weather, aqi, aqi_batch, generate_heatmap_data, heatmap_grid,
+                                           location_snapshot, air_quality_forecast, aqi_forecast, FORECAST_MAX_HOURS,
+                                           anchor_data_version, heatmap_anchor_data)
+from prediction.tiles import heatmap_tile, is_valid_tile, start_tile_precompute, tile_cache, tile_version
+from prediction.no2_raster import no2_heatmap_data, no2_heatmap_grid, no2_layer, start_raster_refresh
+from prediction import aqi_arrays, grid_encoding, heatmap
+from prediction.prefetch import hot_cells, start_prefetch
+from prediction.stations import start_station_refresh, station_layer
+from prediction.subscriptions import SSE_MAX_CELLS, STREAM_HEADERS, HubFull, ThreadSubscription, aqi_hub, parse_cells
+from api_scripts import metrics
+from api_scripts.grid_cache import open_upstream_store, seconds_until_next_bucket, snap_to_grid, upstream_cache
+from api_scripts.http_client import UpstreamSaturated, circuit_states, in_flight
+from api_scripts.api_satelite import arrays_to_json, get_default_client
+from api_scripts.geocoding import MAX_RESULTS, geocode, geocode_cache
 from flask_cors import CORS
 
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+
+class SmogApp(Flask):
+    def log_exception(self, exc_info):
+        # flask-restx loguje każdą odpowiedź 5xx z tracebackiem - przeciążenie upstreamu to nie błąd,
+        # handle_upstream_saturated zapisuje je jedną linią
+        if exc_info is not None and isinstance(exc_info[1], UpstreamSaturated):
+            return
+        super().log_exception(exc_info)
+
 
-app = Flask(__name__)
+app = SmogApp(__name__)
 CORS(app)  # ✅ This enables CORS for all routes by default
 
 api = Api(
@@ -17,15 +52,130 @@ api = Api(
 
 ns = api.namespace('', description='Operacje predykcji smogu')
 
+# Nagłówek Server-Timing: zawsze (SERVER_TIMING=1) albo na żądanie klienta (nagłówek X-Server-Timing)
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+CACHES = {"upstream": upstream_cache, "tiles": tile_cache, "geocode": geocode_cache}
+
+metrics.register(metrics.Gauge(
+    "cache_hit_ratio", "Share of fresh cache hits among lookups.", ("cache",),
+    lambda: [((name,), cache.stats()["hit_ratio"]) for name, cache in CACHES.items()]))
+metrics.register(metrics.Gauge(
+    "cache_entries", "Entries held in memory per cache.", ("cache",),
+    lambda: [((name,), cache.stats()["size"]) for name, cache in CACHES.items()]))
+metrics.register(metrics.Gauge(
+    "aqi_stream_subscribers", "Open /aqi/stream subscriptions and distinct grid cells they cover.", ("kind",),
+    lambda: [((kind,), value) for kind, value in aqi_hub.stats().items()]))
+metrics.register(metrics.Gauge(
+    "upstream_in_flight", "Upstream API calls currently running in this process.", (), lambda: [((), in_flight())]))
+metrics.register(metrics.Gauge(
+    "upstream_circuit_open", "1 while the circuit breaker for an upstream host is open or half-open.", ("host",),
+    lambda: [((host,), int(state != "closed")) for host, state in circuit_states().items()]))
+metrics.register(metrics.Gauge(
+    "cache_fallbacks_total", "Last-known values served because the upstream fetch failed.", ("cache",),
+    lambda: [(("upstream",), upstream_cache.stats()["fallbacks"])], metric_type="counter"))
+
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    metrics.start_stages(SERVER_TIMING or "X-Server-Timing" in request.headers)
+
+@app.after_request
+def record_request_timing(response):
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    metrics.request_latency.observe(elapsed, route, request.method, str(response.status_code))
+
+    stages = metrics.current_stages()
+    if stages is not None:
+        response.headers["Server-Timing"] = metrics.server_timing(stages, elapsed)
+        # Bez tego przeglądarka nie pokaże etapów dla zapytań z innego originu (frontend)
+        response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
+# Kompresja odpowiedzi (brotli, jeśli jest zainstalowane, inaczej gzip) - strumienie NDJSON idą bez kompresji
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/msgpack', 'application/octet-stream', 'text/plain'}
+
+@app.after_request
+def compress_response(response):
+    if (response.is_streamed or response.direct_passthrough or response.status_code != 200
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+
+    if BROTLI_AVAILABLE and request.accept_encodings['br']:
+        response.set_data(brotli.compress(body, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@api.errorhandler(UpstreamSaturated)
+def handle_upstream_saturated(error):
+    """Wszystkie sloty na zapytania do upstreamu są zajęte - szybka odpowiedź 503"""
+    app.logger.warning("503 %s %s: %s", request.method, request.path, error.description)
+    return {"message": error.description}, 503, {"Retry-After": "1"}
+
+# ETag to skrót danych wejściowych z cache (304 bez liczenia AQI i heatmapy); słaby (W/), bo ta sama treść
+# idzie jako gzip albo br
+def _data_etag(*parts) -> str:
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def _value_etag(name: str, value: dict, *parts) -> str | None:
+    """ETag wartości z cache; None dla danych nieaktualnych (stale)"""
+    if value.get("stale"):
+        return None
+    return _data_etag(name, value, *parts)
+
+def _data_headers(etag: str) -> dict:
+    return {"ETag": f'W/"{etag}"', "Cache-Control": f"public, max-age={seconds_until_next_bucket()}"}
+
+def _not_modified(etag: str, headers: dict | None = None) -> Response | None:
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers={**_data_headers(etag), **(headers or {})})
+    return None
+
+def _validated(etag: str | None, build, headers: dict | None = None):
+    """304 dla pasującego If-None-Match, inaczej build() z ETagiem; bez ETagu odpowiedź idzie z no-cache"""
+    headers = headers or {}
+    if etag is None:
+        headers = {**headers, "Cache-Control": "no-cache"}
+    else:
+        not_modified = _not_modified(etag, headers)
+        if not_modified is not None:
+            return not_modified
+        headers = {**headers, **_data_headers(etag)}
+
+    result = build()
+    if isinstance(result, Response):
+        result.headers.update(headers)
+        return result
+    return result, 200, headers
+
 location_parser = api.parser()
 location_parser.add_argument('latitude', type=float, required=True, help='Szerokość geograficzna', location='args')
 location_parser.add_argument('longitude', type=float, required=True, help='Długość geograficzna', location='args')
 
+CODES_HELP = 'Tylko kody kategorii (category_code) bez nazw i komentarzy - opisy kodów: /aqi/categories'
+
+aqi_parser = location_parser.copy()
+aqi_parser.add_argument('codes', type=inputs.boolean, default=False, help=CODES_HELP, location='args')
+
 @ns.route('/air-quality')
 class CurrentAirQuality(Resource):
     @ns.doc('get_air_quality')
     @ns.expect(location_parser)
     @ns.response(200, 'Pomyślna predykcja')
+    @ns.response(304, 'Dane nie zmieniły się')
     @ns.response(400, 'Brakujące parametry')
     @ns.response(404, 'Błąd pobierania danych')
     def get(self):
@@ -38,12 +188,15 @@ class CurrentAirQuality(Resource):
             api.abort(400, "Brakujący parametr 'latitude' lub 'longitude'.",
                      example_usage="/predict?latitude=50.06&longitude=19.94")
 
+        hot_cells.record("air_quality", latitude, longitude)
         result = air_quality(latitude=latitude, longitude=longitude)
 
+        if result is None:
+            api.abort(404, "Błąd pobierania danych")
         if "error" in result:
             api.abort(404, result.get("error"))
 
-        return result
+        return _validated(_value_etag("air_quality", result), lambda: result)
 
 
 @ns.route('/current-weather')
@@ -51,6 +204,7 @@ class CurrentWeather(Resource):
     @ns.doc('get_current_weather')
     @ns.expect(location_parser)
     @ns.response(200, 'Dane pogodowe')
+    @ns.response(304, 'Dane nie zmieniły się')
     @ns.response(400, 'Brakujące parametry')
     @ns.response(404, 'Błąd pobierania danych')
     def get(self):
@@ -63,24 +217,28 @@ class CurrentWeather(Resource):
             api.abort(400, "Brakujący parametr 'latitude' lub 'longitude'.",
                      example_usage="/current-weather?latitude=50.06&longitude=19.94")
 
+        hot_cells.record("current_weather", latitude, longitude)
         result = current_weather(latitude=latitude, longitude=longitude)
 
+        if result is None:
+            api.abort(404, "Błąd pobierania danych")
         if "error" in result:
             api.abort(404, result.get("error"))
 
-        return result
+        return _validated(_value_etag("current_weather", result), lambda: result)
 
 
 @ns.route('/aqi')
 class AQI(Resource):
     @ns.doc('get_aqi')
-    @ns.expect(location_parser)
+    @ns.expect(aqi_parser)
     @ns.response(200, 'Indeks jakości powietrza')
+    @ns.response(304, 'Dane nie zmieniły się')
     @ns.response(400, 'Brakujące parametry')
     @ns.response(404, 'Błąd pobierania danych')
     def get(self):
         """Pobierz indeks jakości powietrza (AQI)"""
-        args = location_parser.parse_args()
+        args = aqi_parser.parse_args()
         latitude = args['latitude']
         longitude = args['longitude']
 
@@ -88,35 +246,399 @@ class AQI(Resource):
             api.abort(400, "Brakujący parametr 'latitude' lub 'longitude'.",
                      example_usage="/aqi?latitude=50.06&longitude=19.94")
 
-        result = aqi(latitude=latitude, longitude=longitude)
+        hot_cells.record("air_quality", latitude, longitude)
+        # Stężenia z cache wystarczą do ETagu - AQI liczymy dopiero, gdy klient nie ma aktualnej wersji
+        air_data = air_quality(latitude=latitude, longitude=longitude)
+        if air_data is None:
+            api.abort(404, "Błąd pobierania danych")
+
+        def build():
+            result = aqi(latitude=latitude, longitude=longitude, codes_only=args['codes'], air_data=air_data)
+            if "error" in result:
+                api.abort(404, result.get("error"))
+            return result
+
+        cell = snap_to_grid(latitude, longitude, upstream_cache.step)
+        return _validated(_value_etag("aqi", air_data, cell, args['codes'], station_layer.version()), build)
+
+
+categories_parser = api.parser()
+categories_parser.add_argument('lang', type=str, choices=tuple(aqi_arrays.CATEGORY_STRINGS),
+                               help='Język opisów (domyślnie wszystkie)', location='args')
+
+# Opisy kategorii nie zmieniają się w trakcie działania serwera - serializujemy je raz na język
+_categories_cache = {}
+
+def _categories_payload(lang: str | None) -> tuple[str, str]:
+    if lang not in _categories_cache:
+        body = json.dumps({"categories": aqi_arrays.categories(lang)}, ensure_ascii=False)
+        _categories_cache[lang] = (body, hashlib.sha1(body.encode()).hexdigest())
+    return _categories_cache[lang]
+
+@ns.route('/aqi/categories')
+class AQICategories(Resource):
+    @ns.doc('get_aqi_categories')
+    @ns.expect(categories_parser)
+    @ns.response(200, 'Kody kategorii AQI z zakresami oraz nazwami i komentarzami (PL/EN)')
+    @ns.response(304, 'Dane nie zmieniły się')
+    def get(self):
+        """Słownik kodów kategorii AQI (category_code) - do pobrania raz i trzymania w cache klienta"""
+        args = categories_parser.parse_args()
+        body, etag = _categories_payload(args['lang'])
+        headers = {"ETag": f'W/"{etag}"', "Cache-Control": "public, max-age=86400"}
+
+        if request.if_none_match.contains_weak(etag):
+            return Response(status=304, headers=headers)
+
+        return Response(body, mimetype='application/json', headers=headers)
+
+
+forecast_parser = location_parser.copy()
+forecast_parser.add_argument('hours', type=int, default=24, help=f'Liczba godzin prognozy (1-{FORECAST_MAX_HOURS})', location='args')
+forecast_parser.add_argument('step', type=int, default=1, help='Krok w godzinach (uśrednianie / najgorsza godzina w bloku)', location='args')
+
+aqi_forecast_parser = forecast_parser.copy()
+aqi_forecast_parser.add_argument('codes', type=inputs.boolean, default=False, help=CODES_HELP, location='args')
+
+def _forecast_args(parser=forecast_parser):
+    args = parser.parse_args()
+    if not 1 <= args['hours'] <= FORECAST_MAX_HOURS or not 1 <= args['step'] <= args['hours']:
+        api.abort(400, f"Parametr 'hours' musi być w zakresie 1-{FORECAST_MAX_HOURS}, a 'step' w zakresie 1-hours.")
+    return args
+
+@ns.route('/air-quality/forecast')
+class AirQualityForecast(Resource):
+    @ns.doc('get_air_quality_forecast')
+    @ns.expect(forecast_parser)
+    @ns.response(200, 'Prognoza stężeń (tablice kolumnowe)')
+    @ns.response(400, 'Nieprawidłowe parametry')
+    @ns.response(404, 'Błąd pobierania danych')
+    def get(self):
+        """Pobierz prognozę stężeń zanieczyszczeń na kolejne godziny"""
+        args = _forecast_args()
+        result = air_quality_forecast(args['latitude'], args['longitude'], hours=args['hours'], step=args['step'])
+
+        if "error" in result:
+            api.abort(404, result.get("error"))
+
+        return result
+
+
+@ns.route('/aqi/forecast')
+class AQIForecast(Resource):
+    @ns.doc('get_aqi_forecast')
+    @ns.expect(aqi_forecast_parser)
+    @ns.response(200, 'Prognoza AQI (tablice kolumnowe)')
+    @ns.response(400, 'Nieprawidłowe parametry')
+    @ns.response(404, 'Błąd pobierania danych')
+    def get(self):
+        """Pobierz prognozę indeksu jakości powietrza (AQI) na kolejne godziny"""
+        args = _forecast_args(aqi_forecast_parser)
+        result = aqi_forecast(args['latitude'], args['longitude'], hours=args['hours'], step=args['step'],
+                              codes_only=args['codes'])
+
+        if "error" in result:
+            api.abort(404, result.get("error"))
+
+        return result
+
+
+FORMAT_MIMETYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'msgpack': 'application/msgpack',
+    'binary': 'application/octet-stream',
+}
+
+def _response_format(supported: tuple) -> str:
+    """Format odpowiedzi z ?format=... albo z nagłówka Accept (domyślnie json)"""
+    requested = request.args.get('format')
+    if requested in supported:
+        return requested
+    mimetypes = [FORMAT_MIMETYPES[name] for name in supported]
+    if 'msgpack' in supported:
+        mimetypes.append('application/x-msgpack')
+    best = request.accept_mimetypes.best_match(mimetypes, default='application/json')
+    if best == 'application/x-msgpack':
+        return 'msgpack'
+    return next(name for name, mimetype in FORMAT_MIMETYPES.items() if mimetype == best)
+
+
+BATCH_MAX_POINTS = 10000
+
+batch_point = api.model('BatchPoint', {
+    'latitude': fields.Float(required=True, description='Szerokość geograficzna'),
+    'longitude': fields.Float(required=True, description='Długość geograficzna'),
+})
+
+batch_request = api.model('BatchRequest', {
+    'points': fields.List(fields.Nested(batch_point), required=True,
+                          description=f'Lista punktów (maks. {BATCH_MAX_POINTS})'),
+})
+
+def _ndjson_batch(points, codes_only):
+    """Linie NDJSON dla /aqi/batch; przy braku slotów na upstream ostatnia linia to {"error": ...}"""
+    try:
+        for result in aqi_batch(points, codes_only):
+            yield json.dumps(result) + "\n"
+    except UpstreamSaturated as error:
+        app.logger.warning("503 %s %s (strumień NDJSON): %s", request.method, request.path, error.description)
+        yield json.dumps({"error": error.description, "retry_after": 1}) + "\n"
+
+@ns.route('/aqi/batch')
+class AQIBatch(Resource):
+    @ns.doc('post_aqi_batch', params={'format': 'json (domyślnie), ndjson lub msgpack (kolumnowo)', 'codes': CODES_HELP})
+    @ns.expect(batch_request)
+    @ns.response(200, 'Indeksy jakości powietrza dla wszystkich punktów')
+    @ns.response(400, 'Nieprawidłowe dane wejściowe')
+    def post(self):
+        """Pobierz AQI dla wielu punktów w jednym zapytaniu (JSON lub strumień NDJSON)"""
+        payload = request.get_json(silent=True) or {}
+        raw_points = payload.get('points')
+
+        if not isinstance(raw_points, list) or not raw_points:
+            api.abort(400, "Brakująca lista 'points'.",
+                     example_usage='{"points": [{"latitude": 50.06, "longitude": 19.94}]}')
+        if len(raw_points) > BATCH_MAX_POINTS:
+            api.abort(400, f"Maksymalnie {BATCH_MAX_POINTS} punktów w jednym zapytaniu.")
+
+        try:
+            points = [(float(point['latitude']), float(point['longitude'])) for point in raw_points]
+        except (TypeError, KeyError, ValueError):
+            api.abort(400, "Każdy punkt musi mieć pola 'latitude' i 'longitude'.")
+
+        response_format = _response_format(('json', 'ndjson', 'msgpack'))
+        try:
+            codes_only = inputs.boolean(request.args.get('codes', False))
+        except ValueError:
+            api.abort(400, "Parametr 'codes' musi być wartością logiczną.")
+        if response_format == 'ndjson':
+            return Response(stream_with_context(_ndjson_batch(points, codes_only)), mimetype='application/x-ndjson')
+
+        results = sorted(aqi_batch(points, codes_only), key=lambda result: result['index'])
+        if response_format == 'msgpack':
+            return Response(grid_encoding.columns_to_msgpack(results), mimetype='application/msgpack',
+                            headers={'Vary': 'Accept'})
+        return results
+
+stream_parser = api.parser()
+stream_parser.add_argument('points', type=str, required=True,
+                           help=f'Punkty "lat,lon;lat,lon" (maks. {SSE_MAX_CELLS} komórek siatki)', location='args')
+
+@ns.route('/aqi/stream')
+class AQIStream(Resource):
+    @ns.doc('get_aqi_stream')
+    @ns.expect(stream_parser)
+    @ns.produces(['text/event-stream'])
+    @ns.response(200, 'Strumień zdarzeń "aqi" (Server-Sent Events) dla komórek siatki, wysyłanych tylko po zmianie')
+    @ns.response(400, 'Nieprawidłowe punkty')
+    @ns.response(503, 'Za dużo otwartych subskrypcji')
+    def get(self):
+        """Subskrybuj zmiany AQI dla punktów zamiast odpytywać /aqi"""
+        args = stream_parser.parse_args()
+        try:
+            cells = parse_cells(args['points'])
+        except ValueError as e:
+            api.abort(400, str(e), example_usage="/aqi/stream?points=50.06,19.94;52.23,21.01")
+
+        subscription = ThreadSubscription(cells)
+        try:
+            aqi_hub.subscribe(subscription)
+        except HubFull as e:
+            api.abort(503, str(e))
+
+        def events():
+            try:
+                yield from subscription.events()
+            finally:
+                aqi_hub.unsubscribe(subscription)
+
+        return Response(events(), mimetype='text/event-stream', headers=STREAM_HEADERS)
+
+
+@ns.route('/location-snapshot')
+class LocationSnapshot(Resource):
+    @ns.doc('get_location_snapshot')
+    @ns.expect(aqi_parser)
+    @ns.response(200, 'Pogoda, zanieczyszczenia i AQI dla lokalizacji')
+    @ns.response(400, 'Brakujące parametry')
+    @ns.response(404, 'Błąd pobierania danych')
+    def get(self):
+        """Pobierz pogodę, stężenia zanieczyszczeń i AQI w jednym zapytaniu"""
+        args = aqi_parser.parse_args()
+        latitude = args['latitude']
+        longitude = args['longitude']
+
+        if latitude is None or longitude is None:
+            api.abort(400, "Brakujący parametr 'latitude' lub 'longitude'.",
+                     example_usage="/location-snapshot?latitude=50.06&longitude=19.94")
+
+        result = location_snapshot(latitude=latitude, longitude=longitude, codes_only=args['codes'])
 
         if "error" in result:
             api.abort(404, result.get("error"))
 
         return result
 
+geocode_parser = api.parser()
+geocode_parser.add_argument('q', type=str, required=True, help='Nazwa miejscowości (lub jej początek)', location='args')
+geocode_parser.add_argument('limit', type=inputs.int_range(1, MAX_RESULTS), default=5, help='Maksymalna liczba wyników', location='args')
+geocode_parser.add_argument('snapshot', type=inputs.boolean, default=False,
+                            help='Dołącz pogodę, zanieczyszczenia i AQI dla pierwszego wyniku (jak /location-snapshot)', location='args')
+geocode_parser.add_argument('codes', type=inputs.boolean, default=False, help=CODES_HELP, location='args')
+
+@ns.route('/geocode')
+class Geocode(Resource):
+    @ns.doc('get_geocode')
+    @ns.expect(geocode_parser)
+    @ns.response(200, 'Pasujące miejscowości (najpierw z lokalnego gazetera, w razie braku z Nominatim)')
+    @ns.response(400, 'Brakujące parametry')
+    @ns.response(404, 'Nie znaleziono miejscowości')
+    @ns.response(503, 'Usługa geokodowania chwilowo niedostępna')
+    def get(self):
+        """Znajdź współrzędne miejscowości po nazwie"""
+        args = geocode_parser.parse_args()
+        query = args['q'].strip()
+
+        if not query:
+            api.abort(400, "Pusty parametr 'q'.", example_usage="/geocode?q=Krak&snapshot=true")
+
+        places, source = geocode(query, args['limit'])
+
+        if places is None:
+            api.abort(503, "Usługa geokodowania chwilowo niedostępna, spróbuj ponownie.")
+        if not places:
+            api.abort(404, f"Nie znaleziono miejscowości '{query}'.")
+
+        result = {"query": query, "source": source, "results": places}
+        if args['snapshot']:
+            result["snapshot"] = location_snapshot(latitude=places[0]["latitude"], longitude=places[0]["longitude"],
+                                                   codes_only=args['codes'])
+        return result
+
+satellite_parser = location_parser.copy()
+satellite_parser.add_argument('pollutant', type=str, default='no2', choices=('no2', 'so2'), help='Zanieczyszczenie', location='args')
+satellite_parser.add_argument('size_km', type=float, default=70, help='Bok kwadratowego obszaru w km', location='args')
+
+@ns.route('/satellite-stats')
+class SatelliteStats(Resource):
+    @ns.doc('get_satellite_stats')
+    @ns.expect(satellite_parser)
+    @ns.response(200, 'Statystyki Sentinel-5P dla obszaru (wczorajszy dzień)')
+    @ns.response(404, 'Błąd pobierania danych')
+    def get(self):
+        """Pobierz statystyki NO2 / SO2 z Sentinel-5P dla obszaru wokół punktu"""
+        args = satellite_parser.parse_args()
+        sentinel = get_default_client()
+        stats = sentinel.no2_stats if args['pollutant'] == 'no2' else sentinel.so2_stats
+
+        try:
+            result = stats(args['latitude'], args['longitude'], size_km=args['size_km'])
+        except (RuntimeError, httpx.HTTPError, KeyError, ValueError) as e:
+            api.abort(404, f"Błąd pobierania danych satelitarnych: {e}")
+
+        return arrays_to_json(result)
+
 heatmap_parser = api.parser()
 heatmap_parser.add_argument('north', type=float, required=True, help='Współrzędna północna', location='args')
 heatmap_parser.add_argument('south', type=float, required=True, help='Współrzędna południowa', location='args')
 heatmap_parser.add_argument('east', type=float, required=True, help='Współrzędna wschodnia', location='args')
 heatmap_parser.add_argument('west', type=float, required=True, help='Współrzędna zachodnia', location='args')
+heatmap_parser.add_argument('resolution', type=int, default=20, help='Liczba punktów siatki na bok (2-200)', location='args')
+heatmap_parser.add_argument('layer', type=str, default='aqi', choices=('aqi', 'no2'),
+                            help='aqi - interpolowane AQI, no2 - satelitarny NO2 (µmol/m²)', location='args')
+heatmap_parser.add_argument('format', type=str, choices=('json', 'msgpack', 'binary'),
+                            help='json - lista [lat, lon, intensywność], msgpack / binary - siatka (origin, step, shape) '
+                                 'i spakowana tablica wartości; domyślnie wg nagłówka Accept', location='args')
+heatmap_parser.add_argument('dtype', type=str, default='uint8', choices=('uint8', 'float16'),
+                            help='Typ wartości w formacie msgpack / binary', location='args')
 
 @ns.route('/heatmap-data')
 class HeatmapData(Resource):
     @ns.doc('get_heatmap_data')
     @ns.expect(heatmap_parser)
+    @ns.response(304, 'Dane nie zmieniły się')
     def get(self):
         """Generuje dane dla heatmapy dla widocznego obszaru mapy"""
         args = heatmap_parser.parse_args()
-        data = generate_heatmap_data(
-            north=args['north'],
-            south=args['south'],
-            east=args['east'],
-            west=args['west']
-        )
-        return data
+        response_format = _response_format(('json', 'msgpack', 'binary'))
+        bbox = (args['north'], args['south'], args['east'], args['west'])
+        resolution = max(2, min(heatmap.MAX_RESOLUTION, args['resolution']))
+        dtype = args['dtype'] if response_format != 'json' else None
+        if args['layer'] == 'no2':
+            anchor_data = None
+            etag = _data_etag("heatmap", "no2", response_format, dtype, bbox, resolution, no2_layer.version())
+        else:
+            anchor_data = heatmap_anchor_data(*bbox)
+            version = anchor_data_version(anchor_data)
+            etag = _data_etag("heatmap", "aqi", response_format, dtype, bbox, resolution, version) if version else None
+
+        def build():
+            if response_format != 'json':
+                return _compact_heatmap(bbox, resolution, args, response_format, anchor_data)
+            if args['layer'] == 'no2':
+                return no2_heatmap_data(*bbox, resolution)
+            return generate_heatmap_data(*bbox, resolution=resolution, anchor_data=anchor_data)
+
+        return _validated(etag, build, {'Vary': 'Accept'})
+
+
+def _compact_heatmap(bbox, resolution: int, args, response_format: str, anchor_data=None) -> Response:
+    if args['layer'] == 'no2':
+        grid = no2_heatmap_grid(*bbox, resolution)
+    else:
+        grid = heatmap_grid(*bbox, resolution, anchor_data)
+    if grid is None:
+        grid_lats, grid_lons = heatmap.grid_axes(*bbox, resolution)
+        grid = grid_lats, grid_lons, heatmap.empty_grid(resolution)
+
+    packed = grid_encoding.pack_grid(*grid, dtype=args['dtype'])
+    if response_format == 'msgpack':
+        body = grid_encoding.grid_to_msgpack(packed)
+    else:
+        body = grid_encoding.grid_to_binary(packed)
+    return Response(body, mimetype=FORMAT_MIMETYPES[response_format], headers={'Vary': 'Accept'})
+
+
+@ns.route('/heatmap/<int:z>/<int:x>/<int:y>')
+@ns.param('z', 'Poziom przybliżenia')
+@ns.param('x', 'Kolumna kafla')
+@ns.param('y', 'Wiersz kafla')
+class HeatmapTile(Resource):
+    @ns.doc('get_heatmap_tile')
+    @ns.response(200, 'Dane heatmapy dla kafla')
+    @ns.response(304, 'Dane nie zmieniły się')
+    @ns.response(400, 'Nieprawidłowy kafel')
+    def get(self, z, x, y):
+        """Dane heatmapy dla kafla mapy z/x/y (siatka o stałym rozmiarze)"""
+        if not is_valid_tile(z, x, y):
+            api.abort(400, "Nieprawidłowe współrzędne kafla.", example_usage="/heatmap/6/35/20")
+
+        # Wersja danych kotwic wystarczy do ETagu - siatkę kafla liczymy dopiero, gdy klient jej nie ma
+        anchor_data, etag = tile_version(z, x, y)
+        return _validated(etag, lambda: heatmap_tile(z, x, y, anchor_data, etag)[0])
+
+
+@ns.route('/metrics')
+class Metrics(Resource):
+    @ns.doc('get_metrics')
+    @ns.response(200, 'Metryki w formacie tekstowym Prometheusa')
+    def get(self):
+        """Metryki procesu: opóźnienia upstreamu i endpointów, trafienia w cache, zapytania w toku"""
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 
+def start_background_jobs():
+    """Podpina magazyn obserwacji i uruchamia zadania w tle - wołane z punktów startowych serwera, nie przy imporcie"""
+    open_upstream_store()
+    start_tile_precompute()
+    start_raster_refresh()
+    start_prefetch()
+    start_station_refresh()
 
 
 if __name__ == "__main__":
+    # Z debug=True proces nadrzędny reloadera tylko restartuje serwer - zadania startują w procesie potomnym
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_jobs()
     app.run(debug=True, port=5001)
\ No newline at end of file
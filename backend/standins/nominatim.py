@@ -0,0 +1,45 @@
+"""
+Local stand-in for the Nominatim search endpoint used as the geocoding fallback.
+
+Every query resolves to one deterministic place derived from its text, except
+queries containing "nowhere", which find nothing:
+
+    python -m standins.nominatim
+    NOMINATIM_DOMAIN=127.0.0.1:5103 NOMINATIM_SCHEME=http python server.py
+"""
+import zlib
+
+from flask import Flask, jsonify, request
+
+app = Flask(__name__)
+
+app.config["REQUEST_COUNT"] = 0
+
+
+@app.get("/search")
+def search():
+    app.config["REQUEST_COUNT"] += 1
+    query = request.args.get("q", "")
+    if "nowhere" in query.lower():
+        return jsonify([])
+
+    seed = zlib.crc32(query.encode())
+    place = {
+        "place_id": seed,
+        "display_name": f"{query}, Standin",
+        "lat": str(round(-60 + seed % 12000 / 100, 5)),
+        "lon": str(round(-180 + seed // 12000 % 36000 / 100, 5)),
+        "type": "city",
+    }
+    if request.args.get("addressdetails") == "1":
+        place["address"] = {"city": query, "country_code": "xx"}
+    return jsonify([place])
+
+
+@app.get("/stats")
+def stats():
+    return jsonify({"requests": app.config["REQUEST_COUNT"]})
+
+
+if __name__ == "__main__":
+    app.run(port=5103, threaded=True)
@@ -0,0 +1,126 @@
+"""
+Local stand-in for Open-Meteo's forecast (``/v1/forecast``) and air-quality
+(``/v1/air-quality``) endpoints, with configurable latency and error rate.
+
+Values are deterministic functions of position and hour, and multi-location
+queries (comma-separated latitude/longitude lists) return a JSON list like the
+real API:
+
+    python -m standins.open_meteo --port 5102 --latency-ms 80 --jitter-ms 40 --error-rate 0.01
+    OPEN_METEO_AIR_QUALITY_URL=http://127.0.0.1:5102/v1/air-quality \
+    OPEN_METEO_FORECAST_URL=http://127.0.0.1:5102/v1/forecast python server.py
+"""
+import argparse
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import Flask, jsonify, request
+
+app = Flask(__name__)
+app.config.update(LATENCY_MS=0.0, JITTER_MS=0.0, ERROR_RATE=0.0, FORECAST_DAYS=5)
+
+AIR_QUALITY_VARIABLES = {
+    # bazowy poziom, amplituda zmienności przestrzennej
+    "pm2_5": (12.0, 10.0),
+    "pm10": (25.0, 15.0),
+    "nitrogen_dioxide": (20.0, 15.0),
+    "sulphur_dioxide": (5.0, 4.0),
+}
+
+
+def _simulate_upstream():
+    """Apply configured latency and return an error response for a share of requests."""
+    latency = app.config["LATENCY_MS"] + random.uniform(0, app.config["JITTER_MS"])
+    if latency:
+        time.sleep(latency / 1000)
+    if random.random() < app.config["ERROR_RATE"]:
+        return jsonify({"error": True, "reason": "Simulated upstream failure"}), 503
+    return None
+
+
+def _locations() -> list[tuple[float, float]]:
+    latitudes = [float(value) for value in request.args.get("latitude", "").split(",") if value]
+    longitudes = [float(value) for value in request.args.get("longitude", "").split(",") if value]
+    if not latitudes or len(latitudes) != len(longitudes):
+        raise ValueError("latitude and longitude must be lists of equal length")
+    return list(zip(latitudes, longitudes))
+
+
+def _field(lat: float, lon: float, hour: int, base: float, amplitude: float) -> float:
+    spatial = math.sin(math.radians(lat * 9)) * math.cos(math.radians(lon * 7))
+    daily = math.sin(2 * math.pi * (hour % 24) / 24)
+    return round(max(0.0, base + amplitude * spatial + amplitude * 0.3 * daily), 1)
+
+
+def _respond(payloads: list[dict]):
+    return jsonify(payloads[0] if len(payloads) == 1 else payloads)
+
+
+@app.get("/v1/air-quality")
+def air_quality():
+    error = _simulate_upstream()
+    if error:
+        return error
+    try:
+        locations = _locations()
+    except ValueError as e:
+        return jsonify({"error": True, "reason": str(e)}), 400
+
+    start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    hours = 24 * app.config["FORECAST_DAYS"]
+    times = [(start + timedelta(hours=hour)).strftime("%Y-%m-%dT%H:%M") for hour in range(hours)]
+    requested = [name for name in request.args.get("hourly", "").split(",") if name in AIR_QUALITY_VARIABLES]
+
+    payloads = []
+    for lat, lon in locations:
+        hourly = {"time": times}
+        for name in requested:
+            base, amplitude = AIR_QUALITY_VARIABLES[name]
+            hourly[name] = [_field(lat, lon, hour, base, amplitude) for hour in range(hours)]
+        payloads.append({"latitude": lat, "longitude": lon, "hourly": hourly})
+    return _respond(payloads)
+
+
+@app.get("/v1/forecast")
+def forecast():
+    error = _simulate_upstream()
+    if error:
+        return error
+    try:
+        locations = _locations()
+    except ValueError as e:
+        return jsonify({"error": True, "reason": str(e)}), 400
+
+    now = datetime.now(timezone.utc)
+    payloads = []
+    for lat, lon in locations:
+        payloads.append({
+            "latitude": lat,
+            "longitude": lon,
+            "current": {
+                "time": now.strftime("%Y-%m-%dT%H:%M"),
+                "temperature_2m": _field(lat, lon, now.hour, 12.0, 8.0),
+                "relative_humidity_2m": _field(lat, lon, now.hour, 65.0, 20.0),
+                "wind_speed_10m": _field(lat, lon, now.hour, 10.0, 6.0),
+                "weather_code": (int(abs(lat) + abs(lon)) % 4),
+            },
+        })
+    return _respond(payloads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Open-Meteo stand-in")
+    parser.add_argument("--port", type=int, default=5102)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="base latency added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="extra uniformly random latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    args = parser.parse_args()
+
+    app.config.update(LATENCY_MS=args.latency_ms, JITTER_MS=args.jitter_ms, ERROR_RATE=args.error_rate)
+    app.run(port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Local stand-in for the OpenAQ v3 "latest readings per parameter" endpoint.
+
+Serves a fixed, seeded set of stations (dense over Poland, sparser over the
+rest of Europe) with readings timestamped at the current hour, paginated like
+the real API, so the station snapshot and blending can run without an API key:
+
+    python -m standins.openaq
+    OPENAQ_BASE_URL=http://127.0.0.1:5104/v3 python server.py
+"""
+import argparse
+from datetime import datetime, timezone
+
+import numpy as np
+from flask import Flask, jsonify, request
+
+app = Flask(__name__)
+
+# Typowe stężenia (µg/m³) dla parametrów OpenAQ: pm10, pm25, no2, so2
+BASE_LEVELS = {1: 30.0, 2: 18.0, 5: 25.0, 6: 6.0}
+# Jaka część lokalizacji mierzy dany parametr
+COVERAGE = {1: 0.7, 2: 0.9, 5: 0.6, 6: 0.3}
+
+EUROPE = (35.0, 70.0, -10.0, 40.0)
+POLAND = (49.0, 54.8, 14.1, 24.1)
+
+app.config["REQUEST_COUNT"] = 0
+
+
+def _stations(parameter_id: int, europe: int, poland: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Te same lokalizacje dla wszystkich parametrów, jak w OpenAQ - każdy mierzony w części z nich
+    rng = np.random.default_rng(0)
+    lats, lons = [], []
+    for (south, north, west, east), count in ((EUROPE, europe), (POLAND, poland)):
+        lats.append(rng.uniform(south, north, count))
+        lons.append(rng.uniform(west, east, count))
+    lats, lons = np.concatenate(lats), np.concatenate(lons)
+
+    rng = np.random.default_rng(parameter_id)
+    measured = rng.random(len(lats)) < COVERAGE[parameter_id]
+    values = BASE_LEVELS[parameter_id] * rng.lognormal(0.0, 0.5, len(lats))
+    return lats[measured], lons[measured], values[measured]
+
+
+@app.get("/v3/parameters/<int:parameter_id>/latest")
+def latest(parameter_id: int):
+    app.config["REQUEST_COUNT"] += 1
+    limit = min(1000, int(request.args.get("limit", 100)))
+    page = max(1, int(request.args.get("page", 1)))
+
+    if parameter_id in BASE_LEVELS:
+        lats, lons, values = _stations(parameter_id, app.config["EUROPE_STATIONS"], app.config["POLAND_STATIONS"])
+    else:
+        lats = lons = values = np.empty(0)
+
+    hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    start = (page - 1) * limit
+    results = [
+        {
+            "datetime": {"utc": hour.strftime("%Y-%m-%dT%H:%M:%SZ"), "local": hour.isoformat()},
+            "value": round(float(values[index]), 1),
+            "coordinates": {"latitude": round(float(lats[index]), 5), "longitude": round(float(lons[index]), 5)},
+            "sensorsId": parameter_id * 100000 + index,
+            "locationsId": index,
+        }
+        for index in range(start, min(start + limit, len(values)))
+    ]
+    response = jsonify({
+        "meta": {"name": "openaq-api", "website": "/", "page": page, "limit": limit, "found": len(values)},
+        "results": results,
+    })
+    # Jak w prawdziwym API
+    response.headers["x-ratelimit-remaining"] = "60"
+    response.headers["x-ratelimit-reset"] = "60"
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAQ stand-in")
+    parser.add_argument("--port", type=int, default=5104)
+    parser.add_argument("--europe-stations", type=int, default=4000, help="station locations across Europe")
+    parser.add_argument("--poland-stations", type=int, default=1000, help="extra station locations in Poland")
+    args = parser.parse_args()
+
+    app.config.update(EUROPE_STATIONS=args.europe_stations, POLAND_STATIONS=args.poland_stations)
+    app.run(port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
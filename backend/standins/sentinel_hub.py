@@ -0,0 +1,110 @@
+"""
+Local stand-in for the Copernicus token endpoint and the Sentinel Hub Statistics / Process APIs.
+
+Returns deterministic Sentinel-5P-like statistics and NO2 rasters derived from position,
+so SentinelStatsClient can be exercised without credentials or network access:
+
+    python -m standins.sentinel_hub
+    SH_CLIENT_ID=standin SH_CLIENT_SECRET=standin \
+    SH_TOKEN_URL=http://127.0.0.1:5101/token \
+    SH_STATISTICS_URL=http://127.0.0.1:5101/api/v1/statistics \
+    SH_PROCESS_URL=http://127.0.0.1:5101/api/v1/process python server.py
+"""
+import math
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import numpy as np
+import tifffile
+from flask import Flask, Response, jsonify, request
+
+app = Flask(__name__)
+
+STANDIN_TOKEN = "standin-token"
+
+# Typowe rzędy wielkości kolumn troposferycznych (mol/m²)
+BASE_LEVELS = {
+    "no2": 0.00005,
+    "so2": 0.0005,
+}
+
+app.config["REQUEST_COUNT"] = 0
+
+
+@app.post("/token")
+def token():
+    if not request.form.get("client_id") or not request.form.get("client_secret"):
+        return jsonify({"error": "invalid_client"}), 401
+    return jsonify({"access_token": STANDIN_TOKEN, "expires_in": 3600, "token_type": "Bearer"})
+
+
+def _stats(level: float) -> dict:
+    return {
+        "min": level * 0.5,
+        "max": level * 1.8,
+        "mean": level,
+        "stDev": level * 0.2,
+        "sampleCount": 1000,
+        "noDataCount": 50,
+        "percentiles": {"25.0": level * 0.85, "50.0": level, "75.0": level * 1.15, "90.0": level * 1.3},
+    }
+
+
+@app.post("/api/v1/statistics")
+def statistics():
+    if request.headers.get("Authorization") != f"Bearer {STANDIN_TOKEN}":
+        return jsonify({"error": {"status": 401, "reason": "Unauthorized"}}), 401
+
+    app.config["REQUEST_COUNT"] += 1
+    body = request.get_json()
+    west, south, east, north = body["input"]["bounds"]["bbox"]
+    lat, lon = (north + south) / 2, (east + west) / 2
+    outputs = [output for output in body["aggregation"]["evalscript"].split('id: "')[1:]]
+    outputs = [output.split('"')[0] for output in outputs if not output.startswith("dataMask")]
+
+    time_range = body["aggregation"]["timeRange"]
+    start = datetime.fromisoformat(time_range["from"].replace("Z", ""))
+    end = datetime.fromisoformat(time_range["to"].replace("Z", ""))
+
+    data = []
+    day = start
+    while day < end:
+        # Gładkie pole zależne od położenia - sąsiednie obszary mają zbliżone wartości
+        factor = 1.0 + 0.5 * math.sin(math.radians(lat * 7)) * math.cos(math.radians(lon * 5))
+        data.append({
+            "interval": {
+                "from": day.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "to": (day + timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            },
+            "outputs": {
+                output: {"bands": {"B0": {"stats": _stats(BASE_LEVELS.get(output, 0.0001) * factor)}}}
+                for output in outputs
+            },
+        })
+        day += timedelta(days=1)
+
+    return jsonify({"data": data, "status": "OK"})
+
+
+@app.post("/api/v1/process")
+def process():
+    if request.headers.get("Authorization") != f"Bearer {STANDIN_TOKEN}":
+        return jsonify({"error": {"status": 401, "reason": "Unauthorized"}}), 401
+
+    body = request.get_json()
+    west, south, east, north = body["input"]["bounds"]["bbox"]
+    width, height = body["output"]["width"], body["output"]["height"]
+
+    # Środki pikseli, wiersz 0 = północ
+    lats = north - (np.arange(height) + 0.5) * (north - south) / height
+    lons = west + (np.arange(width) + 0.5) * (east - west) / width
+    factor = 1.0 + 0.5 * np.sin(np.radians(lats[:, None] * 7)) * np.cos(np.radians(lons[None, :] * 5))
+    grid = (BASE_LEVELS["no2"] * factor).astype(np.float32)
+
+    image = BytesIO()
+    tifffile.imwrite(image, grid)
+    return Response(image.getvalue(), mimetype="image/tiff")
+
+
+if __name__ == "__main__":
+    app.run(port=5101)
@@ -13,18 +13,22 @@ const SearchBar = () => {
     setIsLoading(true);
     try {
       const response = await fetch(
-        `https://nominatim.openstreetmap.org/search?format=json&q=${encodeURIComponent(
+        `http://127.0.0.1:5001/geocode?limit=1&q=${encodeURIComponent(
           searchValue
         )}`
       );
-      const data = await response.json();
 
-      if (data && data.length > 0) {
-        const { lat, lon } = data[0];
-        navigate(`/details/${lat}/${lon}`);
-      } else {
+      if (response.status === 404) {
         alert("Location not found. Please try another search.");
+        return;
+      }
+      if (!response.ok) {
+        throw new Error(`Geocoding failed with status ${response.status}`);
       }
+
+      const data = await response.json();
+      const { latitude, longitude } = data.results[0];
+      navigate(`/details/${latitude}/${longitude}`);
     } catch (error) {
       console.error("Search error:", error);
       alert("Error searching for location. Please try again.");